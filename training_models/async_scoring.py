@@ -0,0 +1,101 @@
+import copy
+import queue
+import threading
+import time
+from typing import Callable, Iterator, Tuple
+
+import torch
+
+from distributed import unwrap_model
+
+
+class _Failure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+_DONE = object()
+
+
+class AsyncScorer:
+    """
+    Scores training batches in a background thread while the main thread trains.
+
+    The scorer keeps its own copy of the model, refreshed from the live weights at the start of
+    every pass and every ``refresh_steps`` optimizer steps, so masks are computed with weights
+    that are at most ``refresh_steps`` steps stale. Scored batches wait in a queue of at most
+    ``queue_size`` entries; a full queue blocks the scorer, an empty one blocks the trainer.
+    """
+
+    def __init__(self, model: torch.nn.Module, score_fn: Callable, device: torch.device,
+                 refresh_steps: int = 50, queue_size: int = 4):
+        self.model = model
+        self.score_fn = score_fn
+        self.device = device
+        self.refresh_steps = max(1, refresh_steps)
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._snapshot = copy.deepcopy(unwrap_model(model))
+        self._steps = 0
+        self.refreshes = 0
+
+    def refresh(self):
+        live = unwrap_model(self.model)
+        with self._lock, torch.no_grad():
+            for dst, src in zip(self._snapshot.state_dict().values(), live.state_dict().values()):
+                dst.copy_(src)
+            # score in the same mode as the synchronous path (BatchNorm batch statistics in train mode)
+            self._snapshot.train(self.model.training)
+        self.refreshes += 1
+
+    def step(self):
+        """Call after every optimizer step."""
+        self._steps += 1
+        if self._steps % self.refresh_steps == 0:
+            self.refresh()
+
+    def batches(self, loader) -> Iterator[Tuple]:
+        """One pass over ``loader`` as (batch_idx, batch, inputs, labels, mask, preds) tuples."""
+        self.refresh()
+        scored = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    scored.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def produce():
+            try:
+                for batch_idx, batch in enumerate(loader):
+                    if stop.is_set():
+                        return
+                    inputs, labels = batch[0].to(self.device), batch[1].to(self.device)
+                    with self._lock, torch.no_grad():
+                        mask, preds = self.score_fn(self._snapshot(inputs), labels)
+                    put((batch_idx, batch, inputs, labels, mask, preds))
+            except BaseException as e:
+                put(_Failure(e))
+            finally:
+                put(_DONE)
+
+        worker = threading.Thread(target=produce, daemon=True)
+        worker.start()
+        waited = 0.0
+        try:
+            while True:
+                t0 = time.time()
+                item = scored.get()
+                waited += time.time() - t0
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.exc
+                yield item
+        finally:
+            stop.set()
+            worker.join()
+        print(f"Async scoring: trainer waited {waited:.2f}s for scores, {self.refreshes} weight refreshes so far")
@@ -2,27 +2,14 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.optim.lr_scheduler import ReduceLROnPlateau, StepLR
+import os
 import time
-from utils import log_memory, plot_metrics, plot_metrics_test, plot_accuracy_time_multi, plot_accuracy_time_multi_test
+from utils import log_memory, log_results, record_accuracy_time
 from tqdm import tqdm
-import torch.nn.functional as F
-import numpy as np
-
-def focal_loss(input_values, gamma):
-    """Computes the focal loss"""
-    p = torch.exp(-input_values)
-    loss = (1 - p) ** gamma * input_values
-    return loss.mean()
-
-class FocalLoss(nn.Module):
-    def __init__(self, weight=None, gamma=0.):
-        super(FocalLoss, self).__init__()
-        assert gamma >= 0
-        self.gamma = gamma
-        self.weight = weight
-
-    def forward(self, input, target):
-        return focal_loss(F.cross_entropy(input, target, reduction='none', weight=self.weight), self.gamma)
+from longtail_loss import FocalLoss, drw_weights
+from instrumentation import annotate
+from flops import FlopAccountant
+from distributed import reduce_sum
 
 def train_baseline(model_name, model, train_loader, test_loader, device, epochs, save_path, task, cls_num_list):
     model.to(device)
@@ -33,13 +20,8 @@ def train_baseline(model_name, model, train_loader, test_loader, device, epochs,
             criterion = nn.CrossEntropyLoss()
     elif 'longtail':
         train_sampler = None
-        idx = epochs // 160
-        betas = [0, 0.9999]
-        effective_num = 1.0 - np.power(betas[idx], cls_num_list)
-        per_cls_weights = (1.0 - betas[idx]) / np.array(effective_num)
-        per_cls_weights = per_cls_weights / np.sum(per_cls_weights) * len(cls_num_list)
-        per_cls_weights = torch.FloatTensor(per_cls_weights).cuda(device)
-        criterion = FocalLoss(weight=per_cls_weights, gamma=1).cuda(device)
+        per_cls_weights = drw_weights(cls_num_list, 0, 160, device)
+        criterion = FocalLoss(weight=per_cls_weights, gamma=1).to(device)
     # scheduler = ReduceLROnPlateau(optimizer, mode='min', factor=0.1, patience=2, verbose=True)
     optimizer = optim.AdamW(model.parameters(), lr=3e-4)
     scheduler = StepLR(optimizer, step_size=1, gamma=0.98)
@@ -51,8 +33,12 @@ def train_baseline(model_name, model, train_loader, test_loader, device, epochs,
     start_time = time.time()
     num_step = 0
     samples_used_per_epoch = []
+    flops = FlopAccountant(model, len(train_loader.dataset))
 
     for epoch in range(epochs):
+        if isinstance(criterion, FocalLoss):
+            # deferred re-weighting: class-balanced weights from epoch 160 on
+            criterion.weight = drw_weights(cls_num_list, epoch, 160, device)
         samples_used = 0
         model.train()
         epoch_start_time = time.time()
@@ -64,24 +50,29 @@ def train_baseline(model_name, model, train_loader, test_loader, device, epochs,
         progress_bar = tqdm(enumerate(train_loader), total=len(train_loader), desc="Training")
 
 
-        for batch_idx, (inputs, labels) in progress_bar:
+        for batch_idx, (inputs, labels, *_) in progress_bar:
             inputs, labels = inputs.to(device), labels.to(device)
 
             optimizer.zero_grad()
 
-            outputs = model(inputs)
-            loss = criterion(outputs, labels)
-            loss.backward()
+            with annotate("forward"):
+                outputs = model(inputs)
+                loss = criterion(outputs, labels)
+            flops.add("train", inputs)
+            with annotate("backward"):
+                loss.backward()
             optimizer.step()
             num_step+=len(outputs)
             samples_used+=len(outputs)
 
             running_loss += loss.item()
             
-            outputs = model(inputs)
-            preds = torch.argmax(outputs, dim=1)
-            correct += (preds == labels).sum().item()
-            total += labels.size(0)
+            with annotate("metrics"):
+                outputs = model(inputs)
+                flops.add("extra", inputs)
+                preds = torch.argmax(outputs, dim=1)
+                correct += (preds == labels).sum().item()
+                total += labels.size(0)
 
         epoch_loss = running_loss / len(train_loader)
         epoch_accuracy = correct / total
@@ -97,11 +88,12 @@ def train_baseline(model_name, model, train_loader, test_loader, device, epochs,
         test_correct = 0
         test_total = 0
         test_loss = 0.0
-        with torch.no_grad():
+        with torch.no_grad(), annotate("eval"):
             for batch in tqdm(test_loader, desc="Evaluating"):
                 inputs = batch[0].to(device)
                 labels = batch[1].to(device)
                 outputs = model(inputs)
+                flops.add("eval", inputs)
                 batch_loss = criterion(outputs, labels)
                 test_loss+=batch_loss.item()
                 predictions = torch.argmax(outputs, dim=-1)
@@ -114,28 +106,29 @@ def train_baseline(model_name, model, train_loader, test_loader, device, epochs,
         scheduler.step(val_loss)
         epoch_test_accuracies.append(accuracy)
         epoch_test_losses.append(val_loss)
+        flops.end_epoch(epoch, test_accuracy=accuracy)
+        samples_used_per_epoch.append(reduce_sum(samples_used))
 
     end_time = time.time()
-    samples_used_per_epoch.append(samples_used)
     log_memory(start_time, end_time)
+    flops.save(os.path.join(os.path.dirname(save_path), "flops.json"))
+    log_results(model_name, "train", save_path, loss=epoch_losses, flops=[r["total_flops"] for r in flops.records])
+    log_results(model_name, "test", save_path, loss=epoch_test_losses)
     print(num_step)
 
-    # plot_metrics(epoch_losses, epoch_accuracies, "Baseline Training")
-    # plot_metrics_test(epoch_test_accuracies, "Baseline Training")
-    plot_accuracy_time_multi(
-    model_name=model_name,  
-    accuracy=epoch_accuracies,
-    time_per_epoch=time_per_epoch,  
-    save_path=save_path,
-    data_file=save_path
+    record_accuracy_time(
+        model_name=model_name,
+        split="train",
+        accuracy=epoch_accuracies,
+        time_per_epoch=time_per_epoch,
+        data_file=save_path
     )
-    plot_accuracy_time_multi_test(
-        model_name = model_name,
+    record_accuracy_time(
+        model_name=model_name,
+        split="test",
         accuracy=epoch_test_accuracies,
         time_per_epoch=time_per_epoch,
         samples_per_epoch=samples_used_per_epoch,
-        threshold=None,
-        save_path=save_path,
         data_file=save_path
     )
     return model
@@ -149,13 +142,8 @@ def train_baseline_noisy(model_name, model, train_loader, test_loader, device, e
             criterion = nn.CrossEntropyLoss()
     elif 'longtail':
         train_sampler = None
-        idx = epochs // 160
-        betas = [0, 0.9999]
-        effective_num = 1.0 - np.power(betas[idx], cls_num_list)
-        per_cls_weights = (1.0 - betas[idx]) / np.array(effective_num)
-        per_cls_weights = per_cls_weights / np.sum(per_cls_weights) * len(cls_num_list)
-        per_cls_weights = torch.FloatTensor(per_cls_weights).cuda(device)
-        criterion = FocalLoss(weight=per_cls_weights, gamma=1).cuda(device)
+        per_cls_weights = drw_weights(cls_num_list, 0, 160, device)
+        criterion = FocalLoss(weight=per_cls_weights, gamma=1).to(device)
     # scheduler = ReduceLROnPlateau(optimizer, mode='min', factor=0.1, patience=2, verbose=True)
     optimizer = optim.AdamW(model.parameters(), lr=3e-4)
     scheduler = StepLR(optimizer, step_size=1, gamma=0.98)
@@ -167,8 +155,12 @@ def train_baseline_noisy(model_name, model, train_loader, test_loader, device, e
     start_time = time.time()
     num_step = 0
     samples_used_per_epoch = []
+    flops = FlopAccountant(model, len(train_loader.dataset))
 
     for epoch in range(epochs):
+        if isinstance(criterion, FocalLoss):
+            # deferred re-weighting: class-balanced weights from epoch 160 on
+            criterion.weight = drw_weights(cls_num_list, epoch, 160, device)
         samples_used = 0
         model.train()
         epoch_start_time = time.time()
@@ -185,19 +177,24 @@ def train_baseline_noisy(model_name, model, train_loader, test_loader, device, e
 
             optimizer.zero_grad()
 
-            outputs = model(inputs)
-            loss = criterion(outputs, labels)
-            loss.backward()
+            with annotate("forward"):
+                outputs = model(inputs)
+                loss = criterion(outputs, labels)
+            flops.add("train", inputs)
+            with annotate("backward"):
+                loss.backward()
             optimizer.step()
             num_step+=len(outputs)
             samples_used+=len(outputs)
 
             running_loss += loss.item()
             
-            outputs = model(inputs)
-            preds = torch.argmax(outputs, dim=1)
-            correct += (preds == labels).sum().item()
-            total += labels.size(0)
+            with annotate("metrics"):
+                outputs = model(inputs)
+                flops.add("extra", inputs)
+                preds = torch.argmax(outputs, dim=1)
+                correct += (preds == labels).sum().item()
+                total += labels.size(0)
 
         epoch_loss = running_loss / len(train_loader)
         epoch_accuracy = correct / total
@@ -213,11 +210,12 @@ def train_baseline_noisy(model_name, model, train_loader, test_loader, device, e
         test_correct = 0
         test_total = 0
         test_loss = 0.0
-        with torch.no_grad():
+        with torch.no_grad(), annotate("eval"):
             for batch in tqdm(test_loader, desc="Evaluating"):
                 inputs = batch[0].to(device)
                 labels = batch[1].to(device)
                 outputs = model(inputs)
+                flops.add("eval", inputs)
                 batch_loss = criterion(outputs, labels)
                 test_loss+=batch_loss.item()
                 predictions = torch.argmax(outputs, dim=-1)
@@ -230,28 +228,29 @@ def train_baseline_noisy(model_name, model, train_loader, test_loader, device, e
         scheduler.step(val_loss)
         epoch_test_accuracies.append(accuracy)
         epoch_test_losses.append(val_loss)
+        flops.end_epoch(epoch, test_accuracy=accuracy)
+        samples_used_per_epoch.append(reduce_sum(samples_used))
 
     end_time = time.time()
-    samples_used_per_epoch.append(samples_used)
     log_memory(start_time, end_time)
+    flops.save(os.path.join(os.path.dirname(save_path), "flops.json"))
+    log_results(model_name, "train", save_path, loss=epoch_losses, flops=[r["total_flops"] for r in flops.records])
+    log_results(model_name, "test", save_path, loss=epoch_test_losses)
     print(num_step)
 
-    # plot_metrics(epoch_losses, epoch_accuracies, "Baseline Training")
-    # plot_metrics_test(epoch_test_accuracies, "Baseline Training")
-    plot_accuracy_time_multi(
-    model_name=model_name,  
-    accuracy=epoch_accuracies,
-    time_per_epoch=time_per_epoch,  
-    save_path=save_path,
-    data_file=save_path
+    record_accuracy_time(
+        model_name=model_name,
+        split="train",
+        accuracy=epoch_accuracies,
+        time_per_epoch=time_per_epoch,
+        data_file=save_path
     )
-    plot_accuracy_time_multi_test(
-        model_name = model_name,
+    record_accuracy_time(
+        model_name=model_name,
+        split="test",
         accuracy=epoch_test_accuracies,
         time_per_epoch=time_per_epoch,
         samples_per_epoch=samples_used_per_epoch,
-        threshold=None,
-        save_path=save_path,
         data_file=save_path
     )
     return model
\ No newline at end of file
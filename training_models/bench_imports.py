@@ -0,0 +1,69 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+# Optional heavy dependencies that should only be imported when the selected dataset/model needs them
+HEAVY = ["pandas", "medmnist", "timm", "transformers", "matplotlib", "psutil"]
+
+DEFAULT_TARGETS = ["data", "model_zoo", "utils", "registry", "selective_gradient", "main"]
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {target}
+elapsed = time.perf_counter() - t0
+try:
+    import resource
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if sys.platform == "darwin":
+        rss_mb /= 1024
+except ImportError:
+    rss_mb = float("nan")
+print(json.dumps({{"seconds": elapsed, "peak_rss_mb": rss_mb,
+                  "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(target: str, repeats: int = 5) -> Dict:
+    """Imports ``target`` in ``repeats`` fresh interpreters and reports the median wall time."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", _PROBE.format(target=target, heavy=HEAVY)],
+                             cwd=here, capture_output=True, text=True)
+        if out.returncode != 0:
+            return {"target": target, "error": out.stderr.strip().splitlines()[-1]}
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        "target": target,
+        "seconds": statistics.median(r["seconds"] for r in runs),
+        "peak_rss_mb": statistics.median(r["peak_rss_mb"] for r in runs),
+        "heavy": runs[-1]["heavy"],
+    }
+
+
+def main(targets: List[str], repeats: int, json_path: str = None):
+    results = [measure(t, repeats) for t in targets]
+    print(f"{'module':<20} {'import s':>9} {'peak RSS MB':>12}  heavy deps loaded")
+    for r in results:
+        if "error" in r:
+            print(f"{r['target']:<20} failed: {r['error']}")
+            continue
+        print(f"{r['target']:<20} {r['seconds']:>9.3f} {r['peak_rss_mb']:>12.1f}  {', '.join(r['heavy']) or '-'}")
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {json_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold import time and memory of the training modules")
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_TARGETS, help="Modules to import")
+    parser.add_argument("--repeats", type=int, default=5, help="Fresh interpreters per module (median is reported)")
+    parser.add_argument("--json", type=str, default=None, help="Optionally save the results as JSON")
+    args = parser.parse_args()
+    main(args.modules, args.repeats, args.json)
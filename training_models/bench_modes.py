@@ -0,0 +1,300 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+# CPU benchmark of every training mode of main.py on the generated ``synthetic`` dataset with a
+# small model. Each mode runs main.main() in its own worker process (fresh memory peak, no state
+# shared between modes) and reports:
+#   - samples seen and samples trained per second of training (evaluation excluded),
+#   - step latency percentiles (time between optimizer steps of the same epoch),
+#   - scoring overhead (share of time from timeline.jsonl, share of FLOPs from flops.json),
+#   - RSS after setup and peak RSS, final test accuracy (results store).
+# --json saves the results; --compare checks them against saved results of the same configuration
+# and exits with status 1 when a mode got slower or heavier than the tolerance allows.
+
+MODES = ["baseline", "train_with_revision", "train_with_random", "train_with_percentage", "train_with_inv_lin",
+         "train_with_log", "train_with_adaptive", "train_with_alternative", "selective_gradient", "selective_epoch"]
+# timeline phases spent computing or waiting for DBPD masks
+SCORING_PHASES = ("score", "score_wait", "probe", "select")
+# (metric, direction): +1 = higher is better, -1 = lower is better
+COMPARED = [("samples_seen_per_s", 1), ("step_p50_ms", -1), ("step_p90_ms", -1), ("peak_rss_mb", -1)]
+RESULT_PREFIX = "BENCH_RESULT "
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class StepClock:
+    """Intervals between optimizer steps; a new epoch or an evaluation pass starts a new interval."""
+
+    def __init__(self):
+        self.intervals: List[float] = []
+        self.eval_time = 0.0
+        self.first_epoch: Optional[float] = None
+        self._last: Optional[float] = None
+
+    def on_step(self, *_):
+        now = time.perf_counter()
+        if self._last is not None:
+            self.intervals.append(now - self._last)
+        self._last = now
+
+    def next_epoch(self):
+        if self.first_epoch is None:
+            self.first_epoch = time.perf_counter()
+        self._last = None
+
+    def eval_loader(self, loader):
+        clock = self
+
+        class _EvalLoader:
+            def __iter__(self):
+                t0 = time.perf_counter()
+                try:
+                    yield from loader
+                finally:
+                    clock.eval_time += time.perf_counter() - t0
+                    clock._last = None
+
+            def __len__(self):
+                return len(loader)
+
+            def __getattr__(self, name):
+                return getattr(loader, name)
+
+        return _EvalLoader()
+
+
+def _main_argv(mode: str, config: Dict, save_path: str) -> List[str]:
+    start = config["start_revision"] if config["start_revision"] is not None else config["epochs"] - 1
+    return ["main.py", "--mode", mode, "--dataset", "synthetic", "--model", config["model"], "--task", "classification",
+            "--epoch", str(config["epochs"]), "--batch_size", str(config["batch_size"]), "--start_revision", str(start),
+            "--tau-min", str(config["tau"]), "--save_path", save_path, "--timeline", "--num-workers", "0"]
+
+
+def _read_outputs(results_dir: str, run_id: str) -> Dict:
+    from instrumentation import summarize
+    from results_store import DB_NAME, ResultsStore
+
+    out = {"test_accuracy": None, "samples_trained": None, "scoring_time_share": None, "scoring_flops_share": None}
+    db_path = os.path.join(results_dir, DB_NAME)
+    if os.path.exists(db_path):
+        store = ResultsStore(db_path)
+        runs = [r for r in store.runs(group="bench") if r["run_id"] == run_id]
+        if runs:
+            out["test_accuracy"] = runs[-1]["final_test_accuracy"]
+            used = store.curves("bench", "test", ("samples_used",), [runs[-1]["model_name"]], [run_id])
+            used = [v for curve in used.values() for v in curve["samples_used"] if v is not None]
+            if used:
+                out["samples_trained"] = sum(used)
+    timeline_path = os.path.join(results_dir, "timeline.jsonl")
+    if os.path.exists(timeline_path):
+        shares = summarize(timeline_path)
+        out["scoring_time_share"] = sum(shares.get(name, 0.0) for name in SCORING_PHASES)
+    flops_path = os.path.join(results_dir, "flops.json")
+    if os.path.exists(flops_path):
+        with open(flops_path) as f:
+            records = json.load(f)["epochs"]
+        total = sum(r["total_flops"] for r in records)
+        if total:
+            out["scoring_flops_share"] = sum(r["flops"]["score"] for r in records) / total
+        # samples that went through forward + backward, counted where they were trained
+        out["samples_trained"] = sum(r["samples"]["train"] for r in records)
+    return out
+
+
+def run_worker(mode: str, config: Dict) -> Dict:
+    """Runs one mode in this process (see ``bench``); call from a fresh interpreter."""
+    import torch
+    from torch.optim.optimizer import register_optimizer_step_post_hook
+    if config["threads"]:
+        torch.set_num_threads(config["threads"])
+    import main as train_main
+    from data import load_synthetic
+    from profiling import EpochLoader
+    from registry import DATASETS
+
+    workdir = tempfile.mkdtemp(prefix=f"bench_{mode}_")
+    results_dir = os.path.join(workdir, "results")
+    os.makedirs(results_dir)
+    clock = StepClock()
+    num_classes = DATASETS["synthetic"][0]
+
+    def adapter(args):
+        train_loader, test_loader, data_size = load_synthetic(
+            batch_size=args.batch_size, image_size=config["image_size"], num_classes=num_classes,
+            train_size=config["train_size"], test_size=config["test_size"])
+        return EpochLoader(train_loader, clock), clock.eval_loader(test_loader), None, data_size
+
+    DATASETS["synthetic"] = (num_classes, adapter)
+    torch.manual_seed(config["seed"])
+    run_id = f"bench-{mode}-{int(time.time())}"
+    os.environ["RUN_ID"] = run_id
+    hook = register_optimizer_step_post_hook(clock.on_step)
+    result = dict(mode=mode, error=None, invalid=None)
+    cwd = os.getcwd()
+    os.chdir(workdir)  # main.py saves trained_model.pth into the working directory
+    sys.argv = _main_argv(mode, config, os.path.join(results_dir, "bench"))
+    start = time.perf_counter()
+    try:
+        train_main.main()
+    except Exception as e:  # a broken mode is reported, the other modes still run
+        result["error"] = f"{type(e).__name__}: {e}"
+    end = time.perf_counter()
+    hook.remove()
+    os.chdir(cwd)
+
+    train_time = end - (clock.first_epoch or start) - clock.eval_time
+    seen = config["epochs"] * config["train_size"]
+    result.update(_read_outputs(results_dir, run_id))
+    if result["samples_trained"] is not None and result["samples_trained"] > seen:
+        # a mode cannot train on more samples than it was given; the count (or the mode) is broken
+        result["invalid"] = f"samples trained {result['samples_trained']:.0f} > samples seen {seen}"
+        result["samples_trained"] = None
+    result.update(
+        wall_s=end - start,
+        train_s=train_time,
+        steps=len(clock.intervals),
+        samples_seen_per_s=seen / train_time if train_time > 0 and clock.intervals else None,
+        samples_trained_per_s=(result["samples_trained"] / train_time
+                               if result["samples_trained"] is not None and train_time > 0 else None),
+        step_p50_ms=None, step_p90_ms=None, step_p99_ms=None,
+        peak_rss_mb=_peak_rss_mb(),
+        workdir=workdir,
+    )
+    for q in (50, 90, 99):
+        value = percentile(clock.intervals, q / 100)
+        result[f"step_p{q}_ms"] = value * 1e3 if value is not None else None
+    return result
+
+
+def bench(modes: List[str], config: Dict) -> List[Dict]:
+    results = []
+    for mode in modes:
+        print(f"Benchmarking {mode} ...", flush=True)
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", mode, "--config", json.dumps(config)],
+                              capture_output=True, text=True)
+        lines = [line for line in proc.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+        if lines:
+            results.append(json.loads(lines[-1][len(RESULT_PREFIX):]))
+        else:
+            tail = (proc.stderr or proc.stdout).strip().splitlines()[-1:] or ["no output"]
+            results.append(dict(mode=mode, error=f"worker exited with status {proc.returncode}: {tail[0]}"))
+    return results
+
+
+def _fmt(value, spec: str) -> str:
+    width = spec.split(".")[0]
+    return format(value, spec) if value is not None else format("-", ">" + width)
+
+
+def print_table(results: List[Dict]):
+    print(f"{'mode':<24} {'seen/s':>8} {'trained/s':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} "
+          f"{'score t':>7} {'score F':>7} {'peak MB':>8} {'test acc':>8}  error")
+    for r in results:
+        if r.get("samples_seen_per_s") is None:
+            print(f"{r['mode']:<24} failed: {r['error']}")
+            continue
+        print(f"{r['mode']:<24} {_fmt(r['samples_seen_per_s'], '8.1f')} {_fmt(r['samples_trained_per_s'], '9.1f')} "
+              f"{_fmt(r['step_p50_ms'], '8.1f')} {_fmt(r['step_p90_ms'], '8.1f')} {_fmt(r['step_p99_ms'], '8.1f')} "
+              f"{_fmt(r['scoring_time_share'], '7.1%')} {_fmt(r['scoring_flops_share'], '7.1%')} "
+              f"{_fmt(r['peak_rss_mb'], '8.1f')} {_fmt(r['test_accuracy'], '8.4f')}  "
+              f"{r['error'] or ''}{'invalid: ' + r['invalid'] if r.get('invalid') else ''}")
+
+
+def compare(results: List[Dict], config: Dict, saved: Dict, tolerance: float) -> List[str]:
+    """
+    Regressions of ``results`` against the ``saved`` results (a --json file) beyond a relative
+    ``tolerance``. Raises ValueError if ``saved`` was measured with a different ``config``.
+    """
+    saved_config = saved.get("config", {})
+    differing = sorted(k for k in set(config) | set(saved_config) if config.get(k) != saved_config.get(k))
+    if differing:
+        raise ValueError("saved results used a different configuration: "
+                         + ", ".join(f"{k} {saved_config.get(k)!r} -> {config.get(k)!r}" for k in differing))
+    previous = {r["mode"]: r for r in saved["results"]}
+    regressions = []
+    for r in results:
+        old = previous.get(r["mode"])
+        if old is None:
+            continue
+        if r.get("error") and not old.get("error"):
+            regressions.append(f"{r['mode']}: now fails ({r['error']})")
+            continue
+        for metric, direction in COMPARED:
+            new_value, old_value = r.get(metric), old.get(metric)
+            if new_value is None or not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            if change * direction < -tolerance:
+                regressions.append(f"{r['mode']}: {metric} {old_value:.2f} -> {new_value:.2f} ({change:+.1%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every training mode on synthetic data on CPU")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--model", type=str, default="efficientnet_b0_cifar",
+                        help="Any model of registry.MODELS (small CIFAR-native ones on CPU)")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--start-revision", dest="start_revision", type=int, default=None,
+                        help="Epoch after which selection starts (default: the last epoch is selective)")
+    parser.add_argument("--tau", type=float, default=0.1)
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default=64)
+    parser.add_argument("--train-size", dest="train_size", type=int, default=2048)
+    parser.add_argument("--test-size", dest="test_size", type=int, default=512)
+    parser.add_argument("--image-size", dest="image_size", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=0, help="torch.set_num_threads in the workers (0: torch default)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=str, default=None, help="Optionally save the results as JSON")
+    parser.add_argument("--compare", type=str, default=None, help="Results JSON of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative slowdown / growth in --compare")
+    parser.add_argument("--worker", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--config", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(RESULT_PREFIX + json.dumps(run_worker(args.worker, json.loads(args.config))), flush=True)
+        sys.exit(0)
+    config = {k: getattr(args, k) for k in ("model", "epochs", "start_revision", "tau", "batch_size", "train_size",
+                                            "test_size", "image_size", "threads", "seed")}
+    results = bench(args.modes, config)
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(dict(config=config, results=results), f, indent=2)
+        print(f"Results saved to {args.json}")
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        try:
+            regressions = compare(results, config, saved, args.tolerance)
+        except ValueError as e:
+            print(f"Error: cannot compare with {args.compare}: {e}")
+            sys.exit(2)
+        for line in regressions:
+            print(f"Regression: {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%}")
@@ -0,0 +1,74 @@
+import argparse
+import json
+import statistics
+import time
+from typing import Dict, List, Tuple
+
+import torch
+
+from selection import SELECTION_CRITERIA
+
+# (batch size, number of classes): CIFAR-100, ImageNet-1k, GPT-2 vocabulary
+DEFAULT_SHAPES = [(256, 100), (256, 1000), (32, 50257)]
+PAIRS = [("low_confidence_softmax", "low_confidence"), ("relative_margin_softmax", "relative_margin")]
+
+
+def _sync(device: torch.device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def measure(name: str, logits: torch.Tensor, labels: torch.Tensor, threshold: float, repeats: int) -> Dict:
+    """Median wall time of one selection call and, on CUDA, its peak extra allocation."""
+    fn = SELECTION_CRITERIA[name]
+    device = logits.device
+    fn(logits, labels, threshold)  # warm-up
+    times = []
+    for _ in range(repeats):
+        _sync(device)
+        t0 = time.perf_counter()
+        fn(logits, labels, threshold)
+        _sync(device)
+        times.append(time.perf_counter() - t0)
+    peak_mb = None
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+        base = torch.cuda.memory_allocated(device)
+        fn(logits, labels, threshold)
+        peak_mb = (torch.cuda.max_memory_allocated(device) - base) / 2 ** 20
+    return {"criterion": name, "ms": statistics.median(times) * 1e3, "peak_extra_mb": peak_mb}
+
+
+def main(shapes: List[Tuple[int, int]], device: torch.device, threshold: float, repeats: int, json_path: str = None):
+    results = []
+    torch.manual_seed(0)
+    print(f"{'batch x classes':<18} {'criterion':<24} {'ms':>8} {'extra MB':>9}  mask agrees")
+    for batch, classes in shapes:
+        logits = torch.randn(batch, classes, device=device) * 3
+        labels = torch.randint(0, classes, (batch,), device=device)
+        for reference, fused in PAIRS:
+            ref_mask, _ = SELECTION_CRITERIA[reference](logits, labels, threshold)
+            fused_mask, _ = SELECTION_CRITERIA[fused](logits, labels, threshold)
+            agrees = bool(torch.equal(ref_mask, fused_mask))
+            for name in (reference, fused):
+                r = dict(measure(name, logits, labels, threshold, repeats), batch=batch, classes=classes, agrees=agrees)
+                results.append(r)
+                extra = f"{r['peak_extra_mb']:.1f}" if r["peak_extra_mb"] is not None else "-"
+                print(f"{f'{batch} x {classes}':<18} {name:<24} {r['ms']:>8.3f} {extra:>9}  {agrees}")
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {json_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare softmax-based and logsumexp-based DBPD selection criteria")
+    parser.add_argument("--shapes", nargs="+", default=[f"{b}x{c}" for b, c in DEFAULT_SHAPES],
+                        help="Logit shapes as BATCHxCLASSES")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--threshold", type=float, default=0.5, help="tau passed to the criteria")
+    parser.add_argument("--repeats", type=int, default=50, help="Timed calls per criterion (median is reported)")
+    parser.add_argument("--json", type=str, default=None, help="Optionally save the results as JSON")
+    args = parser.parse_args()
+    shapes = [tuple(int(v) for v in s.lower().split("x")) for s in args.shapes]
+    main(shapes, torch.device(args.device), args.threshold, args.repeats, args.json)
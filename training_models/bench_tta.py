@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+from results_store import DB_NAME, ResultsStore
+
+# Time-to-accuracy benchmark of the selection strategies. ``run`` trains every configuration of a
+# suite with main.py (one process each, one after the other so timings are comparable) into a
+# shared results store; ``analyze`` reads any results store (also of real CIFAR / ImageNet runs)
+# and reports, per run, the training time, samples trained and FLOPs until the test accuracy
+# first reaches each target, plus the runs on the accuracy / cost Pareto frontier.
+# Costs are counted at epoch granularity: the target is reached at the end of the first epoch
+# whose test accuracy is at or above it.
+
+# small CPU suite on the generated dataset: name -> main.py options
+SUITE: Dict[str, List[str]] = {
+    "baseline": ["--mode", "baseline"],
+    "dbpd_fixed_0.1": ["--mode", "train_with_revision", "--threshold-method", "fixed", "--tau-min", "0.1"],
+    "dbpd_fixed_0.3": ["--mode", "train_with_revision", "--threshold-method", "fixed", "--tau-min", "0.3"],
+    "dbpd_linear_0.1-0.9": ["--mode", "train_with_revision", "--threshold-method", "linear", "--tau-min", "0.1", "--tau-max", "0.9"],
+    "dbpd_cosine_0.1-0.9": ["--mode", "train_with_revision", "--threshold-method", "cosine", "--tau-min", "0.1", "--tau-max", "0.9"],
+    "random": ["--mode", "train_with_random", "--tau-min", "0.1"],
+    "percentage": ["--mode", "train_with_percentage", "--tau-min", "0.1"],
+}
+DEFAULT_OPTIONS = ["--dataset", "synthetic", "--model", "efficientnet_b0_cifar", "--task", "classification",
+                   "--epoch", "4", "--batch_size", "64", "--start_revision", "1"]
+GROUP = "tta"
+# cost name -> label
+COSTS = {"time": "seconds", "samples": "samples", "flops": "FLOPs"}
+
+
+def run_suite(out_dir: str, suite: Dict[str, List[str]], options: Sequence[str]) -> Dict[str, str]:
+    """Trains every configuration into ``out_dir``; returns run id -> configuration name."""
+    os.makedirs(out_dir, exist_ok=True)
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    labels = {}
+    for name, config in suite.items():
+        run_id = f"tta-{stamp}-{name}"
+        print(f"Training {name} (run {run_id}) ...", flush=True)
+        proc = subprocess.run([sys.executable, main_py, *options, *config, "--save_path", os.path.join(out_dir, GROUP)],
+                              cwd=out_dir, env=dict(os.environ, RUN_ID=run_id), capture_output=True, text=True)
+        if proc.returncode != 0:
+            tail = (proc.stderr or proc.stdout).strip().splitlines()[-1:] or ["no output"]
+            print(f"Error: {name} exited with status {proc.returncode}: {tail[0]}")
+        labels[run_id] = name
+    return labels
+
+
+def _cumulative(values: Sequence[Optional[float]]) -> Optional[List[float]]:
+    if not values or any(v is None for v in values):
+        return None
+    out, total = [], 0.0
+    for v in values:
+        total += v
+        out.append(total)
+    return out
+
+
+def load_runs(store: ResultsStore, group: str, run_ids: Optional[Sequence[str]] = None,
+              labels: Optional[Dict[str, str]] = None) -> List[Dict]:
+    """Per run of ``group`` (among ``run_ids``): test accuracy and cumulative costs per epoch."""
+    runs = [r for r in store.runs(group=group) if r["test_epochs"] and (run_ids is None or r["run_id"] in run_ids)]
+    names = [r["model_name"] for r in runs]
+    out = []
+    for r in runs:
+        test = store.curves(group, "test", ("accuracy", "cumulative_time", "samples_used"), [r["model_name"]], [r["run_id"]])
+        train = store.curves(group, "train", ("flops",), [r["model_name"]], [r["run_id"]])
+        test = test[r["model_name"]]
+        flops = train.get(r["model_name"], {}).get("flops", [])[:len(test["accuracy"])]
+        if labels and r["run_id"] in labels:
+            label = labels[r["run_id"]]
+        else:
+            label = r["model_name"] if names.count(r["model_name"]) == 1 else f"{r['model_name']}@{r['run_id']}"
+        out.append(dict(label=label, run_id=r["run_id"], model_name=r["model_name"], accuracy=test["accuracy"],
+                        time=test["cumulative_time"] if None not in test["cumulative_time"] else None,
+                        samples=_cumulative(test["samples_used"]),
+                        flops=_cumulative(flops) if len(flops) == len(test["accuracy"]) else None))
+    return out
+
+
+def to_target(run: Dict, target: float) -> Optional[Dict]:
+    """Epoch and cumulative costs at which the test accuracy of ``run`` first reaches ``target``."""
+    for epoch, accuracy in enumerate(run["accuracy"]):
+        if accuracy is not None and accuracy >= target:
+            return dict(epoch=epoch + 1, **{cost: run[cost][epoch] if run[cost] else None for cost in COSTS})
+    return None
+
+
+def pareto_frontier(runs: List[Dict], cost: str) -> List[str]:
+    """Labels of the runs whose final accuracy no cheaper (in total ``cost``) run matches, cheapest first."""
+    points = sorted(((run[cost][-1], run["accuracy"][-1], run["label"]) for run in runs
+                     if run[cost] and run["accuracy"] and run["accuracy"][-1] is not None), key=lambda p: (p[0], -p[1]))
+    frontier, best = [], float("-inf")
+    for total, accuracy, label in points:
+        if accuracy > best:
+            frontier.append(label)
+            best = accuracy
+    return frontier
+
+
+def analyze(runs: List[Dict], targets: Sequence[float]) -> Dict:
+    results = []
+    for run in runs:
+        results.append(dict(label=run["label"], run_id=run["run_id"], model_name=run["model_name"],
+                            epochs=len(run["accuracy"]), final_accuracy=run["accuracy"][-1],
+                            best_accuracy=max((a for a in run["accuracy"] if a is not None), default=None),
+                            **{f"total_{cost}": run[cost][-1] if run[cost] else None for cost in COSTS},
+                            targets={str(t): to_target(run, t) for t in targets}))
+    # runs that did not record a cost (e.g. no FLOPs on torch < 2.1) cannot be placed on its frontier
+    unmeasured = {cost: [run["label"] for run in runs if not run[cost]] for cost in COSTS}
+    return dict(runs=results, pareto={cost: pareto_frontier(runs, cost) for cost in COSTS}, unmeasured=unmeasured)
+
+
+def _fmt(value, spec: str) -> str:
+    width = spec.split(".")[0]
+    return format(value, spec) if value is not None else format("n/a", ">" + width)
+
+
+def print_report(report: Dict, targets: Sequence[float]):
+    width = max([32] + [len(r["label"]) for r in report["runs"]])
+    for target in targets:
+        print(f"\nTo test accuracy {target:.2f}:")
+        print(f"{'run':<{width}} {'epoch':>5} {'seconds':>9} {'samples':>10} {'FLOPs':>10}")
+        ranked = sorted(report["runs"], key=lambda r: (r["targets"][str(target)] is None,
+                                                       (r["targets"][str(target)] or {}).get("time") or 0.0))
+        for r in ranked:
+            hit = r["targets"][str(target)]
+            if hit is None:
+                print(f"{r['label']:<{width}} not reached in {r['epochs']} epochs (best {_fmt(r['best_accuracy'], '.4f')})")
+                continue
+            print(f"{r['label']:<{width}} {hit['epoch']:>5} {_fmt(hit['time'], '9.1f')} {_fmt(hit['samples'], '10.0f')} "
+                  f"{_fmt(hit['flops'], '10.3e')}")
+    print()
+    for cost, unit in COSTS.items():
+        frontier = report["pareto"][cost]
+        unmeasured = report["unmeasured"][cost]
+        print(f"Pareto frontier (final accuracy vs {unit}): {' < '.join(frontier) if frontier else '-'}"
+              + (f" (n/a: {', '.join(unmeasured)})" if unmeasured else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time-, samples- and FLOPs-to-accuracy of selection strategies")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="Train a suite of configurations, then analyze them")
+    run_parser.add_argument("--out", type=str, default="tta_results", help="Results directory of the suite")
+    run_parser.add_argument("--configs", nargs="+", choices=list(SUITE), default=list(SUITE))
+    run_parser.add_argument("--main-options", dest="main_options", type=str, default=" ".join(DEFAULT_OPTIONS),
+                            help="main.py options shared by all configurations")
+    analyze_parser = sub.add_parser("analyze", help="Analyze the runs of a results store")
+    analyze_parser.add_argument("db", type=str, help=f"Results directory (containing {DB_NAME}) or database file")
+    analyze_parser.add_argument("--group", type=str, default=GROUP, help="Results group, e.g. mobilenet_v2")
+    analyze_parser.add_argument("--runs", nargs="+", default=None, help="Only these run ids")
+    for p in (run_parser, analyze_parser):
+        p.add_argument("--targets", nargs="+", type=float, default=[0.5, 0.8, 0.9], help="Test accuracy targets")
+        p.add_argument("--json", type=str, default=None, help="Optionally save the report as JSON")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        labels = run_suite(args.out, {name: SUITE[name] for name in args.configs}, args.main_options.split())
+        runs = load_runs(ResultsStore(os.path.join(args.out, DB_NAME)), GROUP, list(labels), labels)
+        group = GROUP
+    else:
+        db_path = os.path.join(args.db, DB_NAME) if os.path.isdir(args.db) else args.db
+        runs = load_runs(ResultsStore(db_path), args.group, args.runs)
+        group = args.group
+    report = analyze(runs, args.targets)
+    print_report(report, args.targets)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(dict(group=group, targets=args.targets, **report), f, indent=2)
+        print(f"Report saved to {args.json}")
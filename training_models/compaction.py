@@ -0,0 +1,172 @@
+import os
+import threading
+from typing import Optional, Sequence
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, Subset
+
+
+class CompactedDataset(Dataset):
+    """
+    Map-style view over one compacted segment.
+
+    Row ``i`` is the sample with global id ``global_ids[i]`` (and so is item ``i`` until
+    ``reshuffle``). Raw segments hold the dataset's untransformed image rows and apply
+    ``transform`` on read, tensor segments hold the already transformed samples. Segments are
+    written in a shuffled order, so reading them front to back is sequential I/O and still visits
+    the hard set in random order; ``reshuffle`` gives every epoch its own order without giving up
+    the sequential reads.
+    """
+
+    def __init__(self, data_path: str, labels: np.ndarray, global_ids: np.ndarray, raw: bool, transform=None):
+        self.data_path = data_path
+        self.labels = labels
+        self.global_ids = global_ids
+        self.raw = raw
+        self.transform = transform
+        self._data = None
+        self._order: Optional[np.ndarray] = None
+
+    def __len__(self):
+        return len(self.global_ids)
+
+    def reshuffle(self, seed: int, block: int = 256):
+        """
+        Visits blocks of ``block`` consecutive rows in a random order and the rows of each block
+        in a random order. The same ``seed`` gives the same order on every rank.
+        """
+        n = len(self.global_ids)
+        if n == 0:
+            return
+        rng = np.random.RandomState(seed)
+        starts = np.arange(0, n, block)
+        self._order = np.concatenate([start + rng.permutation(min(block, n - start))
+                                      for start in starts[rng.permutation(len(starts))]])
+
+    def __getitem__(self, index):
+        # Opened lazily so that DataLoader workers each map the file themselves
+        if self._data is None:
+            self._data = np.load(self.data_path, mmap_mode="r")
+        if self._order is not None:
+            index = int(self._order[index])
+        sample = np.array(self._data[index])
+        target = int(self.labels[index])
+        if not self.raw:
+            return torch.from_numpy(sample), target
+        img = Image.fromarray(sample)
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, target
+
+
+class SurvivorCompactor:
+    """
+    Rewrites the current hard set into a contiguous memmap segment in a background thread.
+
+    ``submit`` schedules a rewrite for a set of global indices (newer submissions replace pending
+    ones), ``dataset_for`` returns the compacted segment once it matches the requested indices
+    (reshuffled for ``epoch``) and falls back to a plain ``Subset`` of the original dataset until then.
+    """
+
+    def __init__(self, dataset, out_dir: str, dtype: Optional[np.dtype] = None, seed: int = 0):
+        self.dataset = dataset
+        self.out_dir = out_dir
+        self.dtype = dtype
+        self.rng = np.random.RandomState(seed)
+        os.makedirs(out_dir, exist_ok=True)
+        # CIFAR-style datasets keep their images in memory as uint8 rows, compact those instead of
+        # the (much larger) transformed tensors.
+        self.raw = isinstance(getattr(dataset, "data", None), np.ndarray) and hasattr(dataset, "targets")
+        self._lock = threading.Lock()
+        self._pending: Optional[np.ndarray] = None
+        self._worker: Optional[threading.Thread] = None
+        self._segment: Optional[CompactedDataset] = None
+        self._segment_key: Optional[bytes] = None
+        self._generation = 0
+
+    @staticmethod
+    def _key(indices: np.ndarray) -> bytes:
+        return np.sort(indices).tobytes()
+
+    def submit(self, indices: Sequence[int]):
+        indices = np.asarray(indices, dtype=np.int64)
+        with self._lock:
+            self._pending = indices
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def dataset_for(self, indices: Sequence[int], epoch: Optional[int] = None):
+        indices = np.asarray(indices, dtype=np.int64)
+        with self._lock:
+            segment = self._segment if self._segment is not None and self._segment_key == self._key(indices) else None
+        if segment is None:
+            return Subset(self.dataset, indices.tolist())
+        if epoch is not None:
+            segment.reshuffle(epoch)
+        return segment
+
+    def close(self):
+        if self._worker is not None:
+            self._worker.join()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                indices, self._pending = self._pending, None
+                if indices is None:
+                    return
+            self._compact(indices)
+
+    def _compact(self, indices: np.ndarray):
+        with self._lock:
+            current = self._segment_key
+        if len(indices) == 0 or current == self._key(indices):
+            return
+        order = indices[self.rng.permutation(len(indices))]
+        self._generation += 1
+        data_path = os.path.join(self.out_dir, f"segment-{self._generation:05d}.npy")
+        tmp_path = data_path + ".tmp"
+
+        if self.raw:
+            rows = self.dataset.data
+            labels = np.asarray(self.dataset.targets, dtype=np.int64)[order]
+            segment = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=rows.dtype,
+                                                shape=(len(order),) + rows.shape[1:])
+            for start in range(0, len(order), 4096):
+                segment[start:start + 4096] = rows[order[start:start + 4096]]
+        else:
+            labels = np.zeros(len(order), dtype=np.int64)
+            segment = None
+            for row, idx in enumerate(order):
+                sample, target = self.dataset[int(idx)][:2]
+                sample = sample.numpy() if torch.is_tensor(sample) else np.asarray(sample)
+                if self.dtype is not None:
+                    sample = sample.astype(self.dtype)
+                if segment is None:
+                    segment = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=sample.dtype,
+                                                        shape=(len(order),) + sample.shape)
+                segment[row] = sample
+                labels[row] = target
+        segment.flush()
+        del segment
+        os.replace(tmp_path, data_path)
+        np.save(os.path.join(self.out_dir, f"segment-{self._generation:05d}.ids.npy"), order)
+
+        compacted = CompactedDataset(data_path, labels, order, raw=self.raw,
+                                     transform=getattr(self.dataset, "transform", None))
+        with self._lock:
+            self._segment = compacted
+            self._segment_key = self._key(indices)
+        print(f"Compacted {len(order)} hard samples into {data_path}")
+
+        # The previous segment may still back a running epoch, only the one before it is dropped
+        stale = os.path.join(self.out_dir, f"segment-{self._generation - 2:05d}")
+        for path in (stale + ".npy", stale + ".ids.npy"):
+            try:
+                os.remove(path)
+            except OSError:
+                # Missing, or still mapped by a reader (e.g. on Windows)
+                pass
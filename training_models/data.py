@@ -1,20 +1,26 @@
 import os
-import pandas as pd
+import torch
 import torchvision
 import torchvision.transforms as transforms
 from torch.utils.data import DataLoader
 import torch.utils.data as data
-import torchvision.models as models
 from torchvision.datasets import VisionDataset
 from torchvision.datasets.folder import default_loader
 from torchvision.datasets.utils import download_file_from_google_drive, download_url, extract_archive
 from imbalance_cifar import IMBALANCECIFAR100, IMBALANCECIFAR10
-from medmnist import NoduleMNIST3D, INFO, Evaluator
-import medmnist
-from noisy_data.datasets import input_dataset
+from shard_dataset import ShardedImageDataset
+from dataset_cache import CachedIntegrityMixin, cached_verdict, check_integrity_cached, download_enabled, require_online
 import numpy as np
 
 
+class CIFAR10(CachedIntegrityMixin, torchvision.datasets.CIFAR10):
+    """CIFAR10 whose archive md5 checks are cached across runs (see dataset_cache.py)."""
+
+
+class CIFAR100(CachedIntegrityMixin, torchvision.datasets.CIFAR100):
+    """CIFAR100 whose archive md5 checks are cached across runs (see dataset_cache.py)."""
+
+
 class Cub2011(VisionDataset):
     """`CUB-200-2011 <http://www.vision.caltech.edu/visipedia/CUB-200-2011.html>`_ Dataset.
 
@@ -44,8 +50,12 @@ class Cub2011(VisionDataset):
         if download:
             self._download()
 
+        if not self._check_integrity():
+            raise RuntimeError('Dataset not found or corrupted. You can use download=True to download it')
 
     def _load_metadata(self):
+        import pandas as pd
+
         images = pd.read_csv(os.path.join(self.root, 'CUB_200_2011', 'images.txt'), sep=' ',
                              names=['img_id', 'filepath'])
         image_class_labels = pd.read_csv(os.path.join(self.root, 'CUB_200_2011', 'image_class_labels.txt'),
@@ -70,12 +80,19 @@ class Cub2011(VisionDataset):
         except Exception:
             return False
 
-        for index, row in self.data.iterrows():
-            filepath = os.path.join(self.root, self.base_folder, row.filepath)
-            if not os.path.isfile(filepath):
-                print(filepath)
-                return False
-        return True
+        def all_images_present():
+            for index, row in self.data.iterrows():
+                filepath = os.path.join(self.root, self.base_folder, row.filepath)
+                if not os.path.isfile(filepath):
+                    print(filepath)
+                    return False
+            return True
+
+        # Stat-ing every image is slow, only redo it when the metadata files change
+        meta_dir = os.path.join(self.root, 'CUB_200_2011')
+        meta_files = [os.path.join(meta_dir, f) for f in ('images.txt', 'image_class_labels.txt', 'train_test_split.txt')]
+        split = 'train' if self.train else 'test'
+        return cached_verdict(meta_dir, f'cub2011_{split}_images', meta_files, all_images_present)
 
     def _download(self):
         import tarfile
@@ -84,6 +101,7 @@ class Cub2011(VisionDataset):
             print('Files already downloaded and verified')
             return
 
+        require_online(self.filename)
         download_file_from_google_drive(self.file_id, self.root, self.filename, self.tgz_md5)
 
         with tarfile.open(os.path.join(self.root, self.filename), "r:gz") as tar:
@@ -176,6 +194,7 @@ class Aircraft(VisionDataset):
         if self._check_exists():
             return
 
+        require_online(self.url)
         # prepare to download data to PARENT_DIR/fgvc-aircraft-2013.tar.gz
         print('Downloading %s...' % self.url)
         tar_name = self.url.rpartition('/')[-1]
@@ -212,53 +231,90 @@ class Aircraft(VisionDataset):
         return images
 
 
-def load_cifar100(long_tail, batch_size=128):
-    cls_num_list = None
-    transform = transforms.Compose([
-        transforms.Resize((224,224)),
+def cifar_transform(image_size=224):
+    """CIFAR images resized for ImageNet-shaped models, or kept at 32x32 for CIFAR-native ones."""
+    resize = [transforms.Resize((image_size, image_size))] if image_size != 32 else []
+    return transforms.Compose(resize + [
         transforms.ToTensor(),
         transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
     ])
 
+
+def load_cifar100(long_tail, batch_size=128, image_size=224):
+    cls_num_list = None
+    transform = cifar_transform(image_size)
+
     if long_tail:
-        trainset = IMBALANCECIFAR100(root='./data', imb_type="exp", imb_factor=0.01, rand_number=0, train=True, download=True, transform=transform)
+        trainset = IMBALANCECIFAR100(root='./data', imb_type="exp", imb_factor=0.01, rand_number=0, train=True, download=download_enabled(), transform=transform)
         cls_num_list = trainset.get_cls_num_list()
 
     else: 
-        trainset = torchvision.datasets.CIFAR100(root='./data', train=True, download=True, transform=transform)
-    testset = torchvision.datasets.CIFAR100(root='./data', train=False, download=True, transform=transform)
+        trainset = CIFAR100(root='./data', train=True, download=download_enabled(), transform=transform)
+    testset = CIFAR100(root='./data', train=False, download=download_enabled(), transform=transform)
     train_loader = DataLoader(trainset, batch_size=batch_size, shuffle=True)
     test_loader = DataLoader(testset, batch_size=batch_size, shuffle=False)
     return train_loader, test_loader, cls_num_list, len(trainset)
 
-def load_cifar10(long_tail, batch_size=128):
+def load_cifar10(long_tail, batch_size=128, image_size=224):
     cls_num_list = None
-    transform = transforms.Compose([
-        transforms.Resize((224,224)),
-        transforms.ToTensor(),
-        transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
-    ])
+    transform = cifar_transform(image_size)
 
     if long_tail:
-        trainset = IMBALANCECIFAR10(root='./data', imb_type="exp", imb_factor=0.01, rand_number=0, train=True, download=True, transform=transform)
+        trainset = IMBALANCECIFAR10(root='./data', imb_type="exp", imb_factor=0.01, rand_number=0, train=True, download=download_enabled(), transform=transform)
         cls_num_list = trainset.get_cls_num_list()
 
     else: 
-        trainset = torchvision.datasets.CIFAR10(root='./data', train=True, download=True, transform=transform)
-    testset = torchvision.datasets.CIFAR10(root='./data', train=False, download=True, transform=transform)
+        trainset = CIFAR10(root='./data', train=True, download=download_enabled(), transform=transform)
+    testset = CIFAR10(root='./data', train=False, download=download_enabled(), transform=transform)
     train_loader = DataLoader(trainset, batch_size=batch_size, shuffle=True)
     test_loader = DataLoader(testset, batch_size=batch_size, shuffle=False)
     return train_loader, test_loader, cls_num_list, len(trainset)
 
 
+class SyntheticImages(data.Dataset):
+    """
+    Class-conditional Gaussian images for benchmarks, generated on the fly from a seed (nothing is
+    downloaded or kept in memory). Every class has a fixed random prototype shared by all splits;
+    a sample is its prototype plus noise of a per-sample scale, so some samples are easy and some
+    stay hard, which is what the selection strategies need to show their behaviour.
+    """
+
+    def __init__(self, size, num_classes=10, image_size=32, noise=1.5, seed=0):
+        self.size = size
+        self.noise = noise
+        self.seed = seed
+        g = torch.Generator().manual_seed(12345)
+        self.prototypes = torch.randn(num_classes, 3, image_size, image_size, generator=g)
+        g.manual_seed(seed)
+        self.targets = torch.randint(0, num_classes, (size,), generator=g).tolist()
+        self.scales = (torch.rand(size, generator=g) * 1.5 + 0.25).tolist()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        g = torch.Generator().manual_seed(self.seed * 1_000_003 + index)
+        target = self.targets[index]
+        noise = torch.randn(self.prototypes.shape[1:], generator=g)
+        return self.prototypes[target] + self.noise * self.scales[index] * noise, target
+
+
+def load_synthetic(batch_size=128, image_size=32, num_classes=10, train_size=2048, test_size=512, noise=1.5):
+    trainset = SyntheticImages(train_size, num_classes, image_size, noise, seed=0)
+    testset = SyntheticImages(test_size, num_classes, image_size, noise, seed=1)
+    train_loader = DataLoader(trainset, batch_size=batch_size, shuffle=True)
+    test_loader = DataLoader(testset, batch_size=batch_size, shuffle=False)
+    return train_loader, test_loader, len(trainset)
+
+
 def load_mnist(batch_size=128):
     transform = transforms.Compose([
         transforms.Grayscale(num_output_channels=3),  
         transforms.ToTensor(),
         transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5)) 
     ])
-    trainset = torchvision.datasets.MNIST(root='./data', train=True, download=True, transform=transform)
-    testset = torchvision.datasets.MNIST(root='./data', train=False, download=True, transform=transform)
+    trainset = torchvision.datasets.MNIST(root='./data', train=True, download=download_enabled(), transform=transform)
+    testset = torchvision.datasets.MNIST(root='./data', train=False, download=download_enabled(), transform=transform)
     train_loader = DataLoader(trainset, batch_size=batch_size, shuffle=True)
     test_loader = DataLoader(testset, batch_size=batch_size, shuffle=False)
     return train_loader, test_loader, len(trainset)
@@ -290,6 +346,32 @@ def load_imagenet(batch_size=16):
 
     ##TODO: download imagenet
 
+def load_imagenet_shards(shard_dir, batch_size=16, num_workers=4, survivor_skipping=False, return_index=False):
+    """
+    Streams ImageNet from tar shards written by shard_dataset.py instead of 1.28M small files.
+    With ``return_index`` (or survivor skipping) the train loader yields (image, label, sample id).
+    """
+    mean = (0.485, 0.456, 0.406)
+    std = (0.229, 0.224, 0.225)
+    transform = transforms.Compose(
+                [
+                    transforms.Resize(256),
+                    transforms.CenterCrop(224),
+                    transforms.ToTensor(),
+                    transforms.Normalize(mean, std),
+                ]
+            )
+    # under DDP every rank takes the same number of training steps (evaluation reads every record)
+    trainset = ShardedImageDataset(shard_dir, prefix="train", transform=transform, shuffle=True,
+                                   survivor_skipping=survivor_skipping,
+                                   return_index=return_index or survivor_skipping,
+                                   num_workers=num_workers, even_ranks=True)
+    valset = ShardedImageDataset(shard_dir, prefix="val", transform=transform, shuffle=False)
+    train_loader = DataLoader(trainset, batch_size=batch_size, num_workers=num_workers)
+    test_loader = DataLoader(valset, batch_size=batch_size, num_workers=num_workers)
+    # len(trainset) is this rank's share, the data size is the whole split
+    return train_loader, test_loader, trainset.num_records
+
 def load_cityscapes(data_dir="D:\\LearningWithRevision\\mmsegmentation\\data\\cityscapes", batch_size=8):
     transform = transforms.Compose([
         transforms.Resize((512, 1024)),  # Resize to a common size
@@ -326,22 +408,27 @@ def load_cityscapes(data_dir="D:\\LearningWithRevision\\mmsegmentation\\data\\ci
     return train_loader, test_loader
 
 def load_medmnist3D(batch_size=128):
+    import medmnist
+    from medmnist import INFO
+
     data_flag = "organmnist3d"
     info = INFO[data_flag]
     DataClass = getattr(medmnist, info['python_class'])
-    train_dataset = DataClass(split='train', download=True, size=64)
+    train_dataset = DataClass(split='train', download=download_enabled(), size=64)
     train_loader = data.DataLoader(dataset=train_dataset, batch_size=batch_size, shuffle=True, num_workers=0)
-    test_dataset = DataClass(split="test", download=True, size=64)
+    test_dataset = DataClass(split="test", download=download_enabled(), size=64)
     test_loader = data.DataLoader(dataset=test_dataset, batch_size=batch_size, shuffle=True, num_workers=0)
 
     return train_loader, test_loader, len(train_dataset)
 
-def load_noisy(batch_size):
+def load_noisy(batch_size=128, image_size=224):
+    from noisy_data.datasets import input_dataset
+
     noise_type='random_label1'
     noise_path = r'D:\LearningWithRevision\training_models\noisy_data\CIFAR-10_human.pt'
     is_human = False
     print("Loading noisy dataset")
-    trainset,testset,num_classes,num_training_samples = input_dataset('cifar10',noise_type, noise_path, is_human)
+    trainset,testset,num_classes,num_training_samples = input_dataset('cifar10',noise_type, noise_path, is_human, image_size)
     train_loader = DataLoader(trainset, batch_size=batch_size, shuffle=True)
     test_loader = DataLoader(testset, batch_size=batch_size, shuffle=False)
     print(num_classes)
@@ -365,6 +452,7 @@ def load_cub2011(batch_size=128, root='./data', download=True):
         transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
     ])
     
+    download = download_enabled(download)
     trainset = Cub2011(root=root, train=True, transform=transform, download=download)
     testset = Cub2011(root=root, train=False, transform=transform, download=download)
     
@@ -382,6 +470,7 @@ def load_aircraft(batch_size=128, class_type='variant', root='./data', download=
         transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
     ])
     
+    download = download_enabled(download)
     trainset = Aircraft(root=root, train=True, class_type=class_type, transform=transform, download=download)
     testset = Aircraft(root=root, train=False, class_type=class_type, transform=transform, download=download)
     
@@ -481,7 +570,6 @@ class Flowers102(VisionDataset):
             return
         
         import tarfile
-        from torchvision.datasets.utils import check_integrity
 
         for id in ['image', 'label', 'setid']:
             filename, md5 = self._file_dict[id]
@@ -490,7 +578,8 @@ class Flowers102(VisionDataset):
             
             os.makedirs(self._base_folder, exist_ok=True)
             
-            if not check_integrity(fpath, md5):
+            if not check_integrity_cached(fpath, md5):
+                require_online(url)
                 print(f'Downloading {url}...')
                 download_url(url, root=self._base_folder, filename=filename, md5=md5)
 
@@ -519,6 +608,7 @@ def load_flowers(batch_size=128, split='train', root='./data', download=True):
     ])
     
 
+    download = download_enabled(download)
     original_trainset = Flowers102(root=root, split='train', transform=train_transform, download=download)
     original_valset = Flowers102(root=root, split='val', transform=train_transform, download=download)
     testset = Flowers102(root=root, split='test', transform=test_transform, download=download)
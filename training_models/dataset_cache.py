@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import pickle
+import zipfile
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+MANIFEST_NAME = ".integrity_manifest.json"
+# Derived artifacts (split memmaps, label arrays, subset indices) live in this folder next to the data
+ARTIFACT_DIR = "derived"
+
+# Offline mode: never try to download, missing or corrupted datasets fail immediately
+_offline = False
+
+
+def set_offline(offline: bool):
+    global _offline
+    _offline = offline
+
+
+def is_offline() -> bool:
+    return _offline
+
+
+def download_enabled(requested: bool = True) -> bool:
+    """Value to pass as ``download=`` to dataset constructors."""
+    return requested and not _offline
+
+
+def require_online(what: str):
+    if _offline:
+        raise RuntimeError(f"Offline mode: {what} is missing or corrupted and would have to be downloaded")
+
+
+def _stat_key(path: str) -> dict:
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _load_manifest(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _record(directory: str, name: str, entry: dict):
+    # Concurrent runs may race here; a lost update only means the file is hashed once more
+    manifest = _load_manifest(directory)
+    manifest[name] = entry
+    tmp_path = os.path.join(directory, f"{MANIFEST_NAME}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(directory, MANIFEST_NAME))
+    except OSError as e:
+        print(f"Warning: could not update integrity manifest in '{directory}': {e}")
+
+
+def _md5(path: str) -> str:
+    md5o = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            md5o.update(chunk)
+    return md5o.hexdigest()
+
+
+def check_integrity_cached(fpath: str, md5: Optional[str] = None) -> bool:
+    """
+    Drop-in for ``torchvision.datasets.utils.check_integrity``.
+
+    A file whose size and mtime match the manifest entry written by an earlier successful check
+    is trusted without re-hashing. The manifest lives next to the file.
+    """
+    if not os.path.isfile(fpath):
+        return False
+    directory, name = os.path.split(os.path.abspath(fpath))
+    key = _stat_key(fpath)
+    entry = _load_manifest(directory).get(name)
+    if entry is not None and entry.get("md5") == md5 and all(entry.get(k) == v for k, v in key.items()):
+        return True
+    if md5 is not None and _md5(fpath) != md5:
+        return False
+    _record(directory, name, dict(key, md5=md5))
+    return True
+
+
+def cached_verdict(directory: str, name: str, key_paths: Sequence[str], check: Callable[[], bool]) -> bool:
+    """
+    Caches the outcome of an expensive dataset check (e.g. one ``isfile`` per image) under
+    ``name``, keyed by the size and mtime of ``key_paths``. Only successful checks are cached.
+    """
+    if not all(os.path.exists(p) for p in key_paths):
+        return check()
+    key = {os.path.basename(p): _stat_key(p) for p in key_paths}
+    if _load_manifest(directory).get(name) == key:
+        return True
+    if not check():
+        return False
+    _record(directory, name, key)
+    return True
+
+
+def file_key(path: str) -> dict:
+    """Identifies an input file in a fingerprint without hashing its contents."""
+    return dict(_stat_key(path), name=os.path.basename(path))
+
+
+def fingerprint(*parts) -> str:
+    blob = json.dumps(parts, sort_keys=True, default=str).encode()
+    return hashlib.sha1(blob).hexdigest()[:16]
+
+
+def _save_atomic(path: str, save: Callable[[str], None], suffix: str):
+    tmp_path = f"{path[:-len(suffix)]}.{os.getpid()}.tmp{suffix}"
+    save(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def cached_arrays(cache_dir: str, name: str, parts: Sequence, compute: Callable[[], Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """
+    Loads ``<name>-<fingerprint(parts)>.npz`` from ``cache_dir``, or runs ``compute`` and stores its
+    arrays there. ``parts`` must cover every input of ``compute`` (use ``file_key`` for files and a
+    version tag for the algorithm), a changed input then simply maps to a new file.
+    """
+    path = os.path.join(cache_dir, f"{name}-{fingerprint(*parts)}.npz")
+    try:
+        with np.load(path, allow_pickle=False) as f:
+            return {k: f[k] for k in f.files}
+    except (OSError, ValueError, zipfile.BadZipFile):
+        pass
+    arrays = compute()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _save_atomic(path, lambda tmp: np.savez(tmp, **arrays), ".npz")
+    except OSError as e:
+        print(f"Warning: could not cache {name} in '{cache_dir}': {e}")
+    return arrays
+
+
+def cifar_split_arrays(root: str, base_folder: str, file_list: List[List[str]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Images (N, 32, 32, 3) and int64 labels of a pickled CIFAR split. The batches are unpickled once
+    and stored as ``.npy`` files, later runs memory-map the images instead of rebuilding the array.
+    """
+    folder = os.path.join(root, base_folder)
+    paths = [os.path.join(folder, entry[0]) for entry in file_list]
+    cache_dir = os.path.join(folder, ARTIFACT_DIR)
+    fp = fingerprint("cifar-split-v1", [file_key(p) for p in paths])
+    data_path = os.path.join(cache_dir, f"images-{fp}.npy")
+    labels_path = os.path.join(cache_dir, f"labels-{fp}.npy")
+    try:
+        return np.load(data_path, mmap_mode="r"), np.load(labels_path)
+    except (OSError, ValueError):
+        pass
+
+    data, labels = [], []
+    for path in paths:
+        with open(path, "rb") as f:
+            entry = pickle.load(f, encoding="latin1")
+        data.append(entry["data"])
+        labels.extend(entry["labels"] if "labels" in entry else entry["fine_labels"])
+    data = np.ascontiguousarray(np.vstack(data).reshape(-1, 3, 32, 32).transpose((0, 2, 3, 1)))
+    labels = np.asarray(labels, dtype=np.int64)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # labels last: their presence marks a complete pair
+        _save_atomic(data_path, lambda tmp: np.save(tmp, data), ".npy")
+        _save_atomic(labels_path, lambda tmp: np.save(tmp, labels), ".npy")
+        return np.load(data_path, mmap_mode="r"), labels
+    except OSError as e:
+        print(f"Warning: could not cache CIFAR split in '{cache_dir}': {e}")
+        return data, labels
+
+
+class CachedIntegrityMixin:
+    """
+    For torchvision CIFAR-style datasets (``train_list``/``test_list``/``base_folder``): integrity
+    checks go through the manifest cache and offline mode fails before any download attempt.
+    Must come before the torchvision class in the bases.
+    """
+
+    def _check_integrity(self) -> bool:
+        for filename, md5 in self.train_list + self.test_list:
+            fpath = os.path.join(self.root, self.base_folder, filename)
+            if not check_integrity_cached(fpath, md5):
+                return False
+        return True
+
+    def download(self):
+        if self._check_integrity():
+            return
+        require_online(self.filename)
+        super().download()
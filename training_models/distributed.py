@@ -0,0 +1,229 @@
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, DistributedSampler, IterableDataset
+
+# Multi-process data parallel training. Launch with torchrun, e.g.
+#   torchrun --nproc_per_node=4 main.py --mode train_with_revision ...
+# Every rank scores its own shard of each batch; the DBPD survivors are then redistributed so
+# that all ranks train on the same number of samples per step and none of them waits at the
+# gradient allreduce.
+
+
+def init_distributed(device: torch.device) -> torch.device:
+    """Joins the process group described by the torchrun environment, returns this rank's device."""
+    if int(os.environ.get("WORLD_SIZE", "1")) <= 1 or is_distributed():
+        return device
+    if torch.cuda.is_available():
+        local_rank = int(os.environ.get("LOCAL_RANK", "0"))
+        torch.cuda.set_device(local_rank)
+        device = torch.device("cuda", local_rank)
+        dist.init_process_group(backend="nccl")
+    else:
+        dist.init_process_group(backend="gloo")
+    print(f"Rank {get_rank()}/{get_world_size()} running on {device}")
+    return device
+
+
+def cleanup():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank() -> int:
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process() -> bool:
+    return get_rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def wrap_model(model: torch.nn.Module, device: torch.device) -> torch.nn.Module:
+    if not is_distributed():
+        return model
+    # Scoring and evaluation forwards differ between ranks; without buffer broadcasts a forward
+    # is rank-local and only the backward of the training step synchronizes.
+    device_ids = [device.index] if device.type == "cuda" else None
+    return DistributedDataParallel(model, device_ids=device_ids, broadcast_buffers=False)
+
+
+def unwrap_model(model: torch.nn.Module) -> torch.nn.Module:
+    return model.module if isinstance(model, DistributedDataParallel) else model
+
+
+class EpochDistributedSampler(DistributedSampler):
+    """``DistributedSampler`` that advances its epoch itself, so the training loops need no ``set_epoch``."""
+
+    def __iter__(self):
+        indices = super().__iter__()
+        self.set_epoch(self.epoch + 1)
+        return indices
+
+
+def distribute_loader(loader: DataLoader, shuffle: bool = True) -> DataLoader:
+    """
+    Rebuilds ``loader`` so that each rank iterates over its own shard of the dataset. Iterable
+    datasets (the ImageNet shards) split their shards across ranks themselves.
+    """
+    if not is_distributed() or isinstance(loader.dataset, IterableDataset):
+        return loader
+    sampler = EpochDistributedSampler(loader.dataset, shuffle=shuffle)
+    return DataLoader(loader.dataset, batch_size=loader.batch_size, sampler=sampler,
+                      num_workers=loader.num_workers, collate_fn=loader.collate_fn,
+                      pin_memory=loader.pin_memory, drop_last=loader.drop_last)
+
+
+def reduce_sum(value: float) -> float:
+    """Sum of a per-rank scalar (e.g. the number of trained samples) over all ranks."""
+    if not is_distributed():
+        return value
+    t = torch.tensor([float(value)], dtype=torch.float64)
+    if dist.get_backend() == "nccl":
+        t = t.cuda()
+    dist.all_reduce(t)
+    return t.item()
+
+
+def _rebalance_plan(counts: List[int]) -> Tuple[List[int], List[List[List[int]]]]:
+    """
+    (rows each rank keeps, ``sends[src][dst]`` = row indices of ``src`` that move to ``dst``),
+    computed identically on every rank from the survivor counts alone.
+    """
+    world, total = len(counts), sum(counts)
+    if total >= world:
+        base, extra = divmod(total, world)
+        # the remainder goes to the ranks that already hold the most rows, so fewer rows move
+        targets = [base] * world
+        for r in sorted(range(world), key=lambda r: (-counts[r], r))[:extra]:
+            targets[r] += 1
+    else:
+        targets = [1] * world
+    keep = [min(c, t) for c, t in zip(counts, targets)]
+    # ranks above their share give away their last rows
+    surplus = [(src, i) for src in range(world) for i in range(keep[src], counts[src])]
+    needed = sum(t - k for t, k in zip(targets, keep))
+    if len(surplus) < needed:
+        # fewer survivors than ranks: the missing rows are duplicates
+        rows = [(src, i) for src in range(world) for i in range(counts[src])]
+        surplus += [rows[j % total] for j in range(needed - len(surplus))]
+    sends: List[List[List[int]]] = [[[] for _ in range(world)] for _ in range(world)]
+    sources = iter(surplus)
+    for dst in range(world):
+        for _ in range(targets[dst] - keep[dst]):
+            src, i = next(sources)
+            sends[src][dst].append(i)
+    return keep, sends
+
+
+def _exchange(t: torch.Tensor, send_splits: List[int], recv_splits: List[int]) -> torch.Tensor:
+    out = t.new_empty((sum(recv_splits),) + tuple(t.shape[1:]))
+    dist.all_to_all_single(out, t.contiguous(), recv_splits, send_splits)
+    return out
+
+
+def rebalance(inputs: torch.Tensor, labels: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Redistributes this step's survivors so every rank gets an equal share (sizes differ by at
+    most one). Only the counts are gathered; ranks above their share send their surplus rows
+    straight to the ranks below it (one all_to_all per tensor), every other row stays put.
+    With fewer survivors than ranks, ranks without one train on a duplicate, so that all of
+    them still take part in the backward. Returns empty tensors on every rank if no rank has
+    survivors, in which case the step must be skipped everywhere.
+    """
+    if not is_distributed():
+        return inputs, labels
+    world, rank = get_world_size(), get_rank()
+    count = torch.tensor([inputs.size(0)], device=inputs.device)
+    counts = [torch.zeros_like(count) for _ in range(world)]
+    dist.all_gather(counts, count)
+    counts = [int(c.item()) for c in counts]
+    if sum(counts) == 0:
+        return inputs[:0], labels[:0]
+    keep, sends = _rebalance_plan(counts)
+    kept_inputs, kept_labels = inputs[:keep[rank]], labels[:keep[rank]]
+    if not any(rows for per_src in sends for rows in per_src):  # already balanced
+        return kept_inputs, kept_labels
+    send_splits = [len(sends[rank][dst]) for dst in range(world)]
+    recv_splits = [len(sends[src][rank]) for src in range(world)]
+    rows = torch.tensor([i for dst in range(world) for i in sends[rank][dst]], dtype=torch.long, device=inputs.device)
+    received_inputs = _exchange(inputs[rows], send_splits, recv_splits)
+    received_labels = _exchange(labels[rows], send_splits, recv_splits)
+    return torch.cat([kept_inputs, received_inputs]), torch.cat([kept_labels, received_labels])
+
+
+def all_gather_indices(indices: Sequence[int]) -> List[int]:
+    """Union of the sample ids selected on every rank (used for epoch-level hard sets)."""
+    if not is_distributed():
+        return list(indices)
+    gathered: List[Optional[List[int]]] = [None] * get_world_size()
+    dist.all_gather_object(gathered, list(indices))
+    return sorted(set(i for part in gathered for i in part))
+
+
+def gather_log(log: Dict) -> Dict:
+    """Merges per-rank survival/label logs (lists are concatenated, counts summed)."""
+    if not is_distributed():
+        return log
+    gathered: List[Optional[Dict]] = [None] * get_world_size()
+    dist.all_gather_object(gathered, dict(log))
+    merged: Dict = {}
+    for part in gathered:
+        for key, value in part.items():
+            if isinstance(value, list):
+                merged.setdefault(key, []).extend(value)
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def _smoke_check(rank: int, world_size: int, port: int):
+    os.environ.update(MASTER_ADDR="127.0.0.1", MASTER_PORT=str(port), RANK=str(rank), WORLD_SIZE=str(world_size))
+    dist.init_process_group(backend="gloo", rank=rank, world_size=world_size)
+    torch.manual_seed(rank)
+    # ranks have very different survivor counts, including none at all
+    for n in ([0, 7, 1], [0, 0, 0], [1, 0, 0], [5, 5, 5], [9, 2, 2, 0]):
+        local = n[rank % len(n)]
+        inputs = torch.full((local, 2), float(rank))
+        labels = torch.arange(local) + 100 * rank
+        out_inputs, out_labels = rebalance(inputs, labels)
+        sizes = [None] * world_size
+        dist.all_gather_object(sizes, out_labels.size(0))
+        total = sum(n[r % len(n)] for r in range(world_size))
+        assert max(sizes) - min(sizes) <= 1 and (total == 0 or min(sizes) >= 1), sizes
+        trained = [None] * world_size
+        dist.all_gather_object(trained, out_labels.tolist())
+        # every survivor is trained on (duplicates only when there are fewer survivors than ranks)
+        assert set(l for part in trained for l in part) == set(l for r in range(world_size) for l in range(100 * r, 100 * r + n[r % len(n)])), trained
+        assert all(int(x) == l // 100 for x, l in zip(out_inputs[:, 0].tolist(), out_labels.tolist()))
+        if rank == 0:
+            print(f"survivors per rank {[n[r % len(n)] for r in range(world_size)]} -> trained per rank {sizes}")
+    assert all_gather_indices([rank, rank + 10]) == sorted([r for r in range(world_size)] + [r + 10 for r in range(world_size)])
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    import argparse
+    import torch.multiprocessing as mp
+
+    parser = argparse.ArgumentParser(description="Check survivor rebalancing with local gloo processes")
+    parser.add_argument("--world-size", dest="world_size", type=int, default=3)
+    parser.add_argument("--port", type=int, default=29512)
+    args = parser.parse_args()
+    mp.spawn(_smoke_check, args=(args.world_size, args.port), nprocs=args.world_size)
+    print("Survivor rebalancing OK")
@@ -0,0 +1,156 @@
+from typing import List, Sequence, Tuple
+
+import torch
+import torch.nn as nn
+
+# Auxiliary classifiers at intermediate stages of a ModelZoo network, trained jointly with the
+# final head. DBPD scoring runs the network stage by stage and stops for every sample as soon as
+# an exit is confident, so clearly easy (or clearly wrong) samples cost a fraction of a forward.
+
+
+class _ViTStem(nn.Module):
+    """Patch embedding, class token and position embedding of a torchvision ViT."""
+
+    def __init__(self, vit: nn.Module):
+        super().__init__()
+        self.conv_proj = vit.conv_proj
+        self.class_token = vit.class_token
+        self.pos_embedding = vit.encoder.pos_embedding
+        self.dropout = vit.encoder.dropout
+        self.hidden_dim = vit.hidden_dim
+
+    def forward(self, x):
+        n = x.shape[0]
+        x = self.conv_proj(x).reshape(n, self.hidden_dim, -1).permute(0, 2, 1)
+        x = torch.cat([self.class_token.expand(n, -1, -1), x], dim=1)
+        return self.dropout(x + self.pos_embedding)
+
+
+class _TokenHead(nn.Module):
+    """Classifier on the class token: final ``ln`` + ``heads`` of the ViT, or an auxiliary exit."""
+
+    def __init__(self, norm: nn.Module, head: nn.Module):
+        super().__init__()
+        self.norm = norm
+        self.head = head
+
+    def forward(self, x):
+        return self.head(self.norm(x)[:, 0])
+
+
+def _conv_exit(stage: nn.Module, num_classes: int) -> nn.Module:
+    # blocks of the conv models end with a BatchNorm, its width is the stage output width
+    norm = [m for m in stage.modules() if isinstance(m, (nn.BatchNorm2d, nn.BatchNorm3d))][-1]
+    pool = nn.AdaptiveAvgPool3d(1) if isinstance(norm, nn.BatchNorm3d) else nn.AdaptiveAvgPool2d(1)
+    return nn.Sequential(pool, nn.Flatten(1), nn.Linear(norm.num_features, num_classes))
+
+
+def _segments(model: nn.Module) -> Tuple[nn.Module, List[nn.Module], nn.Module, str]:
+    """(stem, stages, tail, kind) with ``tail(stage_n(...stage_1(stem(x))))== model(x)``."""
+    if hasattr(model, "layer4") and hasattr(model, "fc"):
+        children = list(model.named_children())
+        first = [name for name, _ in children].index("layer1")
+        stem = nn.Sequential(*[m for _, m in children[:first]])
+        stages = [m for name, m in children if name.startswith("layer")]
+        return stem, stages, nn.Sequential(model.avgpool, nn.Flatten(1), model.fc), "conv"
+    if hasattr(model, "features") and hasattr(model, "classifier"):
+        # MobileNetV2 pools functionally in forward()
+        pool = model.avgpool if hasattr(model, "avgpool") else nn.AdaptiveAvgPool2d(1)
+        return nn.Identity(), list(model.features), nn.Sequential(pool, nn.Flatten(1), model.classifier), "conv"
+    if hasattr(model, "encoder") and hasattr(model, "heads"):
+        return _ViTStem(model), list(model.encoder.layers), _TokenHead(model.encoder.ln, model.heads), "tokens"
+    raise ValueError(f"Early exits are not supported for {type(model).__name__}")
+
+
+class EarlyExitModel(nn.Module):
+    """
+    ``model`` with auxiliary classifiers after the stages at the relative depths ``exits``.
+
+    In training mode ``forward`` keeps the auxiliary logits for ``aux_loss``; the returned
+    logits are always those of the original head. ``early_exit`` is the scoring forward.
+    """
+
+    def __init__(self, model: nn.Module, num_classes: int, exits: Sequence[float] = (0.25, 0.5, 0.75),
+                 aux_weight: float = 0.3):
+        super().__init__()
+        stem, stages, tail, kind = _segments(model)
+        self.stem = stem
+        self.stages = nn.ModuleList(stages)
+        self.tail = tail
+        self.aux_weight = aux_weight
+        positions = sorted(set(max(0, min(len(stages) - 2, round(f * len(stages)) - 1)) for f in exits))
+        self.exit_heads = nn.ModuleDict()
+        for i in positions:
+            if kind == "conv":
+                self.exit_heads[str(i)] = _conv_exit(stages[i], num_classes)
+            else:
+                width = self.stem.hidden_dim
+                self.exit_heads[str(i)] = _TokenHead(nn.LayerNorm(width), nn.Linear(width, num_classes))
+        # samples decided at each exit (last entry: the full network), for the cost report
+        self.register_buffer("exit_counts", torch.zeros(len(positions) + 1, dtype=torch.long), persistent=False)
+        self.aux_logits: List[torch.Tensor] = []
+
+    def forward(self, x):
+        collect = self.training and torch.is_grad_enabled()
+        aux = []
+        x = self.stem(x)
+        for i, stage in enumerate(self.stages):
+            x = stage(x)
+            if collect and str(i) in self.exit_heads:
+                aux.append(self.exit_heads[str(i)](x))
+        self.aux_logits = aux
+        return self.tail(x)
+
+    def aux_loss(self, criterion, labels: torch.Tensor):
+        """Weighted mean loss of the auxiliary exits of the last training forward."""
+        aux, self.aux_logits = self.aux_logits, []
+        if not aux:
+            return 0.0
+        return self.aux_weight * sum(criterion(logits, labels) for logits in aux) / len(aux)
+
+    @torch.no_grad()
+    def early_exit(self, x: torch.Tensor, confidence: float) -> torch.Tensor:
+        """
+        Logits of every sample from the first exit whose top-class probability reaches
+        ``confidence``, undecided samples continue to the next stage without the others.
+        Runs in eval mode, BatchNorm statistics of the shrinking subsets would be noisy (and are
+        undefined for a single sample).
+        """
+        was_training = self.training
+        self.eval()
+        try:
+            return self._early_exit(x, confidence)
+        finally:
+            self.train(was_training)
+
+    def _early_exit(self, x: torch.Tensor, confidence: float) -> torch.Tensor:
+        logits = None
+        remaining = torch.arange(x.size(0), device=x.device)
+        exit_idx = 0
+        x = self.stem(x)
+        for i, stage in enumerate(self.stages):
+            x = stage(x)
+            if str(i) not in self.exit_heads:
+                continue
+            out = self.exit_heads[str(i)](x)
+            if logits is None:
+                logits = out.new_empty((remaining.numel(), out.size(1)))
+            decided = out.softmax(dim=1).amax(dim=1) >= confidence
+            logits[remaining[decided]] = out[decided].to(logits.dtype)
+            self.exit_counts[exit_idx] += decided.sum()
+            exit_idx += 1
+            remaining, x = remaining[~decided], x[~decided]
+            if remaining.numel() == 0:
+                return logits
+        out = self.tail(x)
+        if logits is None:
+            return out
+        logits[remaining] = out.to(logits.dtype)
+        self.exit_counts[-1] += remaining.numel()
+        return logits
+
+    def exit_summary(self) -> str:
+        counts = self.exit_counts.tolist()
+        total = max(1, sum(counts))
+        names = [f"stage {int(k) + 1}/{len(self.stages)}" for k in self.exit_heads] + ["final"]
+        return "Early exits: " + ", ".join(f"{name} {c / total:.1%}" for name, c in zip(names, counts))
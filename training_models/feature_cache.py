@@ -0,0 +1,181 @@
+import os
+from typing import Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Dataset, IterableDataset
+from tqdm import tqdm
+
+from dataset_cache import ARTIFACT_DIR, _save_atomic, fingerprint
+from distributed import barrier, is_main_process
+
+# Linear probe / head-only fine-tuning on a frozen pretrained backbone. The backbone output never
+# changes, so it is computed once per split into a memmap and DBPD scores and trains the small
+# head on the cached features. ``trainable_blocks`` moves the cache boundary down the network for
+# partial unfreezing: 0 caches the penultimate features, K caches the input of the last K blocks
+# (residual stages, ``features`` blocks or transformer encoder layers).
+
+
+class _ViTTokens(nn.Module):
+    """Torchvision ViT up to (excluding) encoder layer ``upto``; the CLS feature if ``upto`` is the last."""
+
+    def __init__(self, vit: nn.Module, upto: int):
+        super().__init__()
+        self.vit = vit
+        self.upto = upto
+
+    def forward(self, x):
+        vit = self.vit
+        x = vit._process_input(x)
+        x = torch.cat([vit.class_token.expand(x.shape[0], -1, -1), x], dim=1)
+        x = vit.encoder.dropout(x + vit.encoder.pos_embedding)
+        x = vit.encoder.layers[:self.upto](x)
+        if self.upto == len(vit.encoder.layers):
+            return vit.encoder.ln(x)[:, 0]
+        return x
+
+
+class _ViTHead(nn.Module):
+    def __init__(self, layers: nn.Module, ln: nn.Module, heads: nn.Module):
+        super().__init__()
+        self.layers = layers
+        self.ln = ln
+        self.heads = heads
+
+    def forward(self, x):
+        return self.heads(self.ln(self.layers(x))[:, 0])
+
+
+def split_model(model: nn.Module, trainable_blocks: int = 0) -> Tuple[nn.Module, nn.Module]:
+    """
+    Splits a ``ModelZoo`` classifier into (frozen backbone, trainable head) such that
+    ``head(backbone(x)) == model(x)``. Supports the ResNets, the ``features``/``classifier``
+    models (MobileNet, EfficientNet) and torchvision ViTs including the MAE checkpoint.
+    """
+    if trainable_blocks < 0:
+        raise ValueError("trainable_blocks must be >= 0")
+    if hasattr(model, "layer4") and hasattr(model, "fc"):
+        children = list(model.named_children())
+        stages = [name for name, _ in children if name.startswith("layer")]
+        if trainable_blocks > len(stages):
+            raise ValueError(f"{type(model).__name__} has only {len(stages)} residual stages")
+        if trainable_blocks:
+            cut = [name for name, _ in children].index(stages[len(stages) - trainable_blocks])
+            backbone = nn.Sequential(*[m for _, m in children[:cut]])
+            head = nn.Sequential(*[m for name, m in children[cut:] if name != "fc"], nn.Flatten(1), model.fc)
+        else:
+            # pooled penultimate vectors, not the (channels x 7 x 7) maps before avgpool
+            cut = [name for name, _ in children].index("avgpool") + 1
+            backbone = nn.Sequential(*[m for _, m in children[:cut]], nn.Flatten(1))
+            head = model.fc
+    elif hasattr(model, "features") and hasattr(model, "classifier"):
+        blocks = len(model.features)
+        if trainable_blocks > blocks:
+            raise ValueError(f"{type(model).__name__} has only {blocks} feature blocks")
+        # MobileNetV2 pools functionally in forward()
+        pool = model.avgpool if hasattr(model, "avgpool") else nn.AdaptiveAvgPool2d(1)
+        if trainable_blocks:
+            backbone = model.features[:blocks - trainable_blocks]
+            head = nn.Sequential(model.features[blocks - trainable_blocks:], pool, nn.Flatten(1), model.classifier)
+        else:
+            backbone = nn.Sequential(model.features, pool, nn.Flatten(1))
+            head = model.classifier
+    elif hasattr(model, "encoder") and hasattr(model, "heads"):
+        layers = len(model.encoder.layers)
+        if trainable_blocks > layers:
+            raise ValueError(f"{type(model).__name__} has only {layers} encoder layers")
+        backbone = _ViTTokens(model, layers - trainable_blocks)
+        if trainable_blocks:
+            head = _ViTHead(model.encoder.layers[layers - trainable_blocks:], model.encoder.ln, model.heads)
+        else:
+            head = model.heads
+    else:
+        raise ValueError(f"Feature caching does not support {type(model).__name__}")
+    # the ViT backbone wraps the whole model, so only freeze what the head does not use
+    head_params = set(id(p) for p in head.parameters())
+    for p in backbone.parameters():
+        p.requires_grad_(id(p) in head_params)
+    for p in head.parameters():
+        p.requires_grad_(True)
+    return backbone.eval(), head
+
+
+class CachedFeatureDataset(Dataset):
+    """Backbone features of one split, yields (feature, label, sample id)."""
+
+    def __init__(self, features_path: str, labels: np.ndarray):
+        self.features_path = features_path
+        self.labels = labels
+        self._features = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        # Opened lazily so that DataLoader workers each map the file themselves
+        if self._features is None:
+            self._features = np.load(self.features_path, mmap_mode="r")
+        return torch.from_numpy(np.array(self._features[index])), int(self.labels[index]), index
+
+
+@torch.no_grad()
+def _extract(backbone: nn.Module, loader: DataLoader, features_path: str, labels_path: str, device: torch.device):
+    features, labels, offset = None, None, 0
+    for batch in tqdm(loader, desc=f"Caching features ({os.path.basename(features_path)})"):
+        out = backbone(batch[0].to(device)).float().cpu().numpy()
+        if features is None:
+            n = len(loader.dataset)
+            size_gb = n * out[0].nbytes / 1e9
+            print(f"Feature cache: {n} x {tuple(out.shape[1:])} float32 ({size_gb:.2f} GB)")
+            tmp_path = f"{features_path[:-4]}.{os.getpid()}.tmp.npy"
+            features = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(n,) + out.shape[1:])
+            labels = np.empty(n, dtype=np.int64)
+        features[offset:offset + len(out)] = out
+        labels[offset:offset + len(out)] = batch[1].numpy()
+        offset += len(out)
+    features.flush()
+    del features
+    os.replace(tmp_path, features_path)
+    # labels last: their presence marks a complete pair
+    _save_atomic(labels_path, lambda tmp: np.save(tmp, labels), ".npy")
+
+
+def cache_features(backbone: nn.Module, loader: DataLoader, cache_dir: str, split: str, parts: Sequence,
+                   device: torch.device) -> CachedFeatureDataset:
+    """
+    Backbone features of ``loader.dataset`` in dataset order, computed once and memory-mapped
+    afterwards. ``parts`` must identify the backbone weights, the cache boundary and the dataset
+    (see ``dataset_cache.cached_arrays``). Under DDP the main process fills the cache.
+    """
+    if isinstance(loader.dataset, IterableDataset):
+        raise ValueError("Feature caching needs a map-style dataset")
+    cache_dir = os.path.join(cache_dir, ARTIFACT_DIR)
+    fp = fingerprint("feature-cache-v2", split, len(loader.dataset), *parts)
+    features_path = os.path.join(cache_dir, f"features-{split}-{fp}.npy")
+    labels_path = os.path.join(cache_dir, f"labels-{split}-{fp}.npy")
+    if is_main_process() and not os.path.exists(labels_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        # dataset order, so that the row of a feature is its sample id
+        ordered = DataLoader(loader.dataset, batch_size=loader.batch_size, shuffle=False,
+                             num_workers=loader.num_workers, collate_fn=loader.collate_fn)
+        _extract(backbone.to(device), ordered, features_path, labels_path, device)
+    barrier()
+    print(f"Using cached {split} features {features_path}")
+    return CachedFeatureDataset(features_path, np.load(labels_path))
+
+
+def feature_loaders(model: nn.Module, train_loader: DataLoader, test_loader: DataLoader, cache_dir: str,
+                    trainable_blocks: int, parts: Sequence, device: torch.device):
+    """
+    Returns (backbone, head, train_loader, test_loader), the loaders iterate over cached features
+    with the original batch sizes. Augmentation is frozen into the cache, every epoch sees the
+    same features.
+    """
+    backbone, head = split_model(model, trainable_blocks)
+    parts = list(parts) + [trainable_blocks]
+    train_set = cache_features(backbone, train_loader, cache_dir, "train", parts, device)
+    test_set = cache_features(backbone, test_loader, cache_dir, "test", parts, device)
+    train_loader = DataLoader(train_set, batch_size=train_loader.batch_size, shuffle=True)
+    test_loader = DataLoader(test_set, batch_size=test_loader.batch_size, shuffle=False)
+    return backbone, head, train_loader, test_loader
@@ -0,0 +1,113 @@
+import copy
+import json
+import os
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+import torch
+
+from distributed import is_main_process, reduce_sum, unwrap_model
+
+try:
+    from torch.utils.flop_counter import FlopCounterMode
+except ImportError:  # torch < 2.1
+    FlopCounterMode = None
+
+# Compute accounting that includes the passes "effective epochs" ignore: the no-grad scoring
+# forward over every batch, the extra statistics forwards and evaluation. FLOPs per sample are
+# measured once per input shape with FlopCounterMode (a multiply-add counts as 2 FLOPs, so
+# MACs = FLOPs / 2), then every pass is charged by its batch size; nothing is counted per step.
+
+# pass kind -> whether it includes a backward
+KINDS = {"score": False, "train": True, "extra": False, "eval": False}
+
+
+class FlopAccountant:
+    """
+    Per-epoch and cumulative FLOPs of a training run. ``add(kind, inputs)`` charges one pass of
+    ``kind`` (see ``KINDS``) over the batch ``inputs``; ``end_epoch`` sums the counts over ranks.
+    """
+
+    def __init__(self, model: torch.nn.Module, dataset_size: Optional[int] = None):
+        self.model = model
+        self.dataset_size = dataset_size
+        self.enabled = FlopCounterMode is not None
+        if not self.enabled:
+            print("FLOP accounting needs torch >= 2.1 (torch.utils.flop_counter), skipping")
+        self._per_sample: Dict[Tuple[Tuple[int, ...], bool], float] = {}
+        self._epoch: Dict[str, float] = defaultdict(float)
+        self._samples: Dict[str, int] = defaultdict(int)
+        self.records = []
+        self.cumulative = 0.0
+
+    def _measure(self, inputs: torch.Tensor, backward: bool) -> float:
+        # measured on a copy of the unwrapped model in eval mode (no BatchNorm statistic updates):
+        # a backward through the live parameters would fire the DDP reducer's hooks of the step
+        # in flight and leave gradients behind
+        net = copy.deepcopy(unwrap_model(self.model))
+        net.eval()
+        for p in net.parameters():
+            p.grad = None
+        x = torch.zeros((2,) + tuple(inputs.shape[1:]), dtype=inputs.dtype, device=inputs.device)
+        counter = FlopCounterMode(display=False)
+        with counter:
+            if backward:
+                net(x).float().sum().backward()
+            else:
+                with torch.no_grad():
+                    net(x)
+        del net
+        return counter.get_total_flops() / 2
+
+    def per_sample(self, inputs: torch.Tensor, backward: bool = False) -> float:
+        """FLOPs of one forward (+ backward) for a sample shaped like ``inputs[0]``."""
+        key = (tuple(inputs.shape[1:]), backward)
+        if key not in self._per_sample:
+            self._per_sample[key] = self._measure(inputs, backward)
+        return self._per_sample[key]
+
+    def add(self, kind: str, inputs: torch.Tensor):
+        if not self.enabled or inputs.size(0) == 0:
+            return
+        self._epoch[kind] += self.per_sample(inputs, KINDS[kind]) * inputs.size(0)
+        self._samples[kind] += inputs.size(0)
+
+    def end_epoch(self, epoch: int, **extra) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        flops = {kind: reduce_sum(self._epoch.get(kind, 0.0)) for kind in KINDS}
+        samples = {kind: int(reduce_sum(self._samples.get(kind, 0))) for kind in KINDS}
+        total = sum(flops.values())
+        self.cumulative += total
+        record = dict(epoch=epoch, forward_flops=total - flops["train"], forward_backward_flops=flops["train"],
+                      total_flops=total, cumulative_flops=self.cumulative, flops=flops, samples=samples, **extra)
+        self.records.append(record)
+        print(f"Epoch {epoch + 1} FLOPs: {total:.3e} total ({flops['train']:.3e} training, {flops['score']:.3e} scoring, "
+              f"{flops['extra'] + flops['eval']:.3e} statistics/eval), cumulative {self.cumulative:.3e}")
+        self._epoch = defaultdict(float)
+        self._samples = defaultdict(int)
+        return record
+
+    def summary(self) -> Dict:
+        """Totals and compute-equivalent epochs (total FLOPs / one full forward+backward epoch)."""
+        train = sum(r["forward_backward_flops"] for r in self.records)
+        out = dict(total_flops=self.cumulative, total_macs=self.cumulative / 2, training_flops=train,
+                   per_sample_flops={f"{'x'.join(map(str, shape))}{'+backward' if bwd else ''}": v
+                                     for (shape, bwd), v in self._per_sample.items()})
+        full = [v for (_, bwd), v in self._per_sample.items() if bwd]
+        if self.dataset_size and full:
+            epoch_flops = full[0] * self.dataset_size
+            out.update(training_equivalent_epochs=train / epoch_flops, compute_equivalent_epochs=self.cumulative / epoch_flops)
+        return out
+
+    def save(self, path: str):
+        if not self.enabled or not is_main_process():
+            return
+        summary = self.summary()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(dict(summary, epochs=self.records), f, indent=2)
+        if "compute_equivalent_epochs" in summary:
+            print(f"Compute-equivalent epochs: {summary['compute_equivalent_epochs']:.2f} "
+                  f"(training passes only: {summary['training_equivalent_epochs']:.2f})")
+        print(f"FLOP accounting saved to {path}")
@@ -1,21 +1,70 @@
 import torch
 import torchvision
 import torchvision.transforms as transforms
+import os
 import numpy as np
+from PIL import Image
+from dataset_cache import ARTIFACT_DIR, CachedIntegrityMixin, cached_arrays, cifar_split_arrays, file_key
 
-class IMBALANCECIFAR10(torchvision.datasets.CIFAR10):
+class IMBALANCECIFAR10(CachedIntegrityMixin, torchvision.datasets.CIFAR10):
+    """
+    Long-tailed CIFAR-10. The balanced split is memory-mapped from ``cifar_split_arrays`` and the
+    imbalanced subset is kept as indices into it (cached as ``.npz``), nothing is copied per run.
+    """
     cls_num = 10
 
     def __init__(self, root, imb_type='exp', imb_factor=0.01, rand_number=0, train=True,
                  transform=None, target_transform=None,
                  download=False):
-        super(IMBALANCECIFAR10, self).__init__(root, train, transform, target_transform, download)
+        # torchvision's CIFAR10.__init__ would unpickle and copy the whole split on every run
+        torchvision.datasets.VisionDataset.__init__(self, root, transform=transform, target_transform=target_transform)
+        self.train = train
+        if download:
+            self.download()
+        if not self._check_integrity():
+            raise RuntimeError("Dataset not found or corrupted. You can use download=True to download it")
+        self.base_data, base_targets = cifar_split_arrays(self.root, self.base_folder,
+                                                          self.train_list if train else self.test_list)
+        self._load_meta()
+        self._data = None
+
         np.random.seed(rand_number)
-        img_num_list = self.get_img_num_per_cls(self.cls_num, imb_type, imb_factor)
-        self.gen_imbalanced_data(img_num_list)
+        img_max = len(self.base_data) / self.cls_num
+        parts = ["imbalance-v1", self.base_folder, train, imb_type, imb_factor, rand_number,
+                 [file_key(os.path.join(self.root, self.base_folder, f)) for f, _ in (self.train_list if train else self.test_list)]]
+        cache_dir = os.path.join(self.root, self.base_folder, ARTIFACT_DIR)
+
+        def compute():
+            img_num_list = self.get_img_num_per_cls(self.cls_num, imb_type, imb_factor, img_max)
+            indices = self.gen_imbalanced_data(img_num_list, base_targets)
+            return {"indices": indices, "cls_num_list": np.asarray(img_num_list, dtype=np.int64)}
+
+        # On a cache hit the global numpy RNG is left freshly seeded rather than after the shuffles
+        arrays = cached_arrays(cache_dir, "imbalance", parts, compute)
+        self.indices = arrays["indices"]
+        self.targets = base_targets[self.indices].tolist()
+        self.num_per_cls_dict = {i: int(n) for i, n in enumerate(arrays["cls_num_list"])}
 
-    def get_img_num_per_cls(self, cls_num, imb_type, imb_factor):
-        img_max = len(self.data) / cls_num
+    @property
+    def data(self):
+        # Only materialized when something needs the subset as one array (e.g. hard-set compaction)
+        if self._data is None:
+            self._data = np.asarray(self.base_data[self.indices])
+        return self._data
+
+    def __getitem__(self, index):
+        img, target = self.base_data[self.indices[index]], self.targets[index]
+        img = Image.fromarray(np.asarray(img))
+        if self.transform is not None:
+            img = self.transform(img)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return img, target
+
+    def __len__(self):
+        return len(self.indices)
+
+    def get_img_num_per_cls(self, cls_num, imb_type, imb_factor, img_max):
         img_num_per_cls = []
         if imb_type == 'exp':
             for cls_idx in range(cls_num):
@@ -30,24 +79,17 @@ class IMBALANCECIFAR10(torchvision.datasets.CIFAR10):
             img_num_per_cls.extend([int(img_max)] * cls_num)
         return img_num_per_cls
 
-    def gen_imbalanced_data(self, img_num_per_cls):
-        new_data = []
-        new_targets = []
-        targets_np = np.array(self.targets, dtype=np.int64)
+    def gen_imbalanced_data(self, img_num_per_cls, targets_np):
+        """Indices into the balanced split, grouped by class, ``img_num_per_cls[c]`` per class."""
+        selected = []
         classes = np.unique(targets_np)
         # np.random.shuffle(classes)
-        self.num_per_cls_dict = dict()
         for the_class, the_img_num in zip(classes, img_num_per_cls):
-            self.num_per_cls_dict[the_class] = the_img_num
             idx = np.where(targets_np == the_class)[0]
             np.random.shuffle(idx)
-            selec_idx = idx[:the_img_num]
-            new_data.append(self.data[selec_idx, ...])
-            new_targets.extend([the_class, ] * the_img_num)
-        new_data = np.vstack(new_data)
-        self.data = new_data
-        self.targets = new_targets
-        
+            selected.append(idx[:the_img_num])
+        return np.concatenate(selected).astype(np.int64)
+
     def get_cls_num_list(self):
         cls_num_list = []
         for i in range(self.cls_num):
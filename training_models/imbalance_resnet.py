@@ -21,6 +21,8 @@ Reference:
 If you use this implementation in you work, please don't forget to mention the
 author, Yerlan Idelbayev.
 '''
+from functools import partial
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -45,6 +47,10 @@ class NormedLinear(nn.Module):
         out = F.normalize(x, dim=1).mm(F.normalize(self.weight, dim=0))
         return out
 
+def _shortcut_a(x, pad):
+    # module-level (not a lambda) so that whole models can be pickled by torch.save
+    return F.pad(x[:, :, ::2, ::2], (0, 0, 0, 0, pad, pad), "constant", 0)
+
 class LambdaLayer(nn.Module):
 
     def __init__(self, lambd):
@@ -71,8 +77,7 @@ class BasicBlock(nn.Module):
                 """
                 For CIFAR10 ResNet paper uses option A.
                 """
-                self.shortcut = LambdaLayer(lambda x:
-                                            F.pad(x[:, :, ::2, ::2], (0, 0, 0, 0, planes//4, planes//4), "constant", 0))
+                self.shortcut = LambdaLayer(partial(_shortcut_a, pad=planes//4))
             elif option == 'B':
                 self.shortcut = nn.Sequential(
                      nn.Conv2d(in_planes, self.expansion * planes, kernel_size=1, stride=stride, bias=False),
@@ -0,0 +1,284 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable, List, Optional
+
+import torch
+from torch.profiler import record_function
+
+# Hot-path timing of the training loops. A ``Timeline`` splits every step into phases (data,
+# score, select, forward, backward, optimizer, eval), counts samples and survivors, and appends
+# one JSON line per step and per epoch. A disabled timeline hands out a shared no-op context and
+# returns iterables unchanged, so leaving the calls in the loops costs next to nothing.
+# ``MemoryTracker`` keeps per-epoch memory peaks (host RSS, CUDA allocator, optionally Python
+# allocations) for the coarser score / train / eval phases.
+
+_NOOP = nullcontext()
+
+# while a torch.profiler capture is running (profiling.py) phases are also emitted as
+# ``phase::<name>`` ranges, so the trace and the operator tables can be grouped by phase
+PHASE_PREFIX = "phase::"
+_annotate = False
+
+
+def set_annotate(enabled: bool):
+    global _annotate
+    _annotate = enabled
+
+
+def annotate(name: str):
+    """Profiler range for phase ``name``, a no-op unless a capture is running."""
+    return record_function(PHASE_PREFIX + name) if _annotate else _NOOP
+
+
+class Timeline:
+    """
+    ``path`` None and no ``exporter`` disables recording. With ``sync`` CUDA work is synchronized
+    at every phase boundary, so that asynchronous kernels are charged to the phase that launched
+    them (at the cost of the overlap they would otherwise have). Records also go to
+    ``exporter.observe`` (metrics_exporter.py).
+    """
+
+    def __init__(self, path: Optional[str] = None, device: Optional[torch.device] = None, sync: bool = False,
+                 exporter=None):
+        self.enabled = path is not None or exporter is not None
+        self.path = path
+        self.exporter = exporter
+        self.sync = sync and device is not None and device.type == "cuda"
+        self.device = device
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "w", buffering=1) if path is not None else None
+        self._step_phases: Dict[str, float] = defaultdict(float)
+        self._epoch_phases: Dict[str, float] = defaultdict(float)
+        self._epoch_counts: Dict[str, int] = defaultdict(int)
+        self._epoch_start = time.perf_counter()
+        self._steps = 0
+
+    def _now(self) -> float:
+        if self.sync:
+            torch.cuda.synchronize(self.device)
+        return time.perf_counter()
+
+    def phase(self, name: str):
+        """Context manager charging the enclosed time to ``name``."""
+        if not self.enabled:
+            return annotate(name)
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name: str):
+        t0 = self._now()
+        try:
+            with annotate(name):
+                yield
+        finally:
+            self._step_phases[name] += self._now() - t0
+
+    def timed(self, iterable: Iterable, name: str = "data") -> Iterable:
+        """Charges the time spent waiting for each item of ``iterable`` to ``name``."""
+        if not self.enabled:
+            return iterable
+        return self._timed_iter(iterable, name)
+
+    def _timed_iter(self, iterable: Iterable, name: str):
+        it = iter(iterable)
+        while True:
+            t0 = self._now()
+            try:
+                item = next(it)
+            except StopIteration:
+                self._step_phases[name] += self._now() - t0
+                return
+            self._step_phases[name] += self._now() - t0
+            yield item
+
+    def step(self, epoch: int, samples: int = 0, survivors: int = 0, **extra):
+        """Closes the current step: ``samples`` scored, ``survivors`` trained on."""
+        if not self.enabled:
+            return
+        phases, self._step_phases = self._step_phases, defaultdict(float)
+        for name, seconds in phases.items():
+            self._epoch_phases[name] += seconds
+        self._epoch_counts["samples"] += samples
+        self._epoch_counts["survivors"] += survivors
+        self._epoch_counts["steps"] += 1
+        self._write(dict(type="step", epoch=epoch, step=self._steps, phases=dict(phases), samples=samples,
+                         survivors=survivors, survivor_fraction=survivors / samples if samples else None, **extra))
+        self._steps += 1
+
+    def end_epoch(self, epoch: int, **extra):
+        """Writes the epoch totals; phases recorded outside a step (e.g. eval) are included."""
+        if not self.enabled:
+            return
+        for name, seconds in self._step_phases.items():
+            self._epoch_phases[name] += seconds
+        self._step_phases = defaultdict(float)
+        now = time.perf_counter()
+        counts = dict(self._epoch_counts)
+        samples = counts.get("samples", 0)
+        self._write(dict(type="epoch", epoch=epoch, wall=now - self._epoch_start, phases=dict(self._epoch_phases),
+                         survivor_fraction=counts.get("survivors", 0) / samples if samples else None, **counts, **extra))
+        self._epoch_phases = defaultdict(float)
+        self._epoch_counts = defaultdict(int)
+        self._epoch_start = now
+
+    def _write(self, record: Dict):
+        if self._file is not None:
+            self._file.write(json.dumps(record) + "\n")
+        if self.exporter is not None:
+            self.exporter.observe(record)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            print(f"Timeline saved to {self.path}")
+
+
+def container_bytes(obj) -> int:
+    """Approximate bytes held by nested dicts / lists / tuples of Python scalars (e.g. the survival log)."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(container_bytes(k) + container_bytes(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(container_bytes(v) for v in obj)
+    return size
+
+
+class MemoryTracker:
+    """
+    Per-epoch memory peaks, attributed to coarse phases (``score``, ``train``, ``eval``; time
+    outside a phase is ``other``): host RSS sampled by a background thread every ``interval``
+    seconds, CUDA allocator peaks (allocated and reserved) and, with ``trace_python``,
+    tracemalloc peaks of Python allocations (slow, off by default). Epoch records also go to
+    ``exporter.observe``. A disabled tracker starts no thread and hands out the shared no-op context.
+    """
+
+    def __init__(self, device: Optional[torch.device] = None, interval: float = 0.05, trace_python: bool = False,
+                 exporter=None, enabled: bool = True):
+        self.enabled = enabled
+        self.exporter = exporter
+        self.records: List[Dict] = []
+        if not enabled:
+            return
+        self.cuda = device is not None and device.type == "cuda" and torch.cuda.is_available()
+        self.device = device
+        self.trace_python = trace_python
+        self._phase = "other"
+        self._peaks: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        try:
+            import psutil
+            self._process = psutil.Process(os.getpid())
+        except ImportError:
+            self._process = None
+            print("psutil is not installed, host RSS peaks are not tracked")
+        if self._process is not None:
+            self._sampler = threading.Thread(target=self._sample, args=(interval,), daemon=True)
+            self._sampler.start()
+        if trace_python and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats(device)
+
+    def _record(self, phase: str, key: str, value: float):
+        with self._lock:
+            peaks = self._peaks[phase]
+            peaks[key] = max(peaks[key], value)
+
+    def _sample(self, interval: float):
+        while not self._stop.wait(interval):
+            self._record(self._phase, "rss_mb", self._process.memory_info().rss / 2 ** 20)
+
+    def phase(self, name: str):
+        """Context manager attributing the enclosed peaks to ``name``."""
+        if not self.enabled:
+            return _NOOP
+        return self._tracked(name)
+
+    @contextmanager
+    def _tracked(self, name: str):
+        previous, self._phase = self._phase, name
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats(self.device)
+        if self.trace_python:
+            tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            if self.cuda:
+                self._record(name, "cuda_allocated_mb", torch.cuda.max_memory_allocated(self.device) / 2 ** 20)
+                self._record(name, "cuda_reserved_mb", torch.cuda.max_memory_reserved(self.device) / 2 ** 20)
+            if self.trace_python:
+                self._record(name, "python_mb", tracemalloc.get_traced_memory()[1] / 2 ** 20)
+            if self._process is not None:
+                self._record(name, "rss_mb", self._process.memory_info().rss / 2 ** 20)
+            self._phase = previous
+
+    def end_epoch(self, epoch: int, **logs) -> Optional[Dict]:
+        """Closes the epoch; ``logs`` are containers whose size is reported (see ``container_bytes``)."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            phases = {name: dict(peaks) for name, peaks in self._peaks.items()}
+            self._peaks = defaultdict(lambda: defaultdict(float))
+        overall: Dict[str, float] = defaultdict(float)
+        for peaks in phases.values():
+            for key, value in peaks.items():
+                overall[key] = max(overall[key], value)
+        record = dict(epoch=epoch, peak=dict(overall), phases=phases,
+                      log_bytes={name: container_bytes(obj) for name, obj in logs.items()})
+        self.records.append(record)
+        if self.exporter is not None:
+            self.exporter.observe(dict(record, type="memory"))
+        print(f"Epoch {epoch + 1} memory peaks: " + ", ".join(f"{k} {v:.1f}" for k, v in overall.items()))
+        return record
+
+    def peaks(self, key: str) -> List[Optional[float]]:
+        """Per-epoch overall peak of ``key`` (e.g. ``rss_mb``), None where it was not measured."""
+        return [record["peak"].get(key) for record in self.records]
+
+    def close(self, path: Optional[str] = None):
+        if not self.enabled:
+            return
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        if self.trace_python:
+            tracemalloc.stop()
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(self.records, f, indent=2)
+            print(f"Memory peaks saved to {path}")
+
+
+def summarize(path: str) -> Dict[str, float]:
+    """Share of the recorded time per phase over all epochs of a timeline file."""
+    totals: Dict[str, float] = defaultdict(float)
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["type"] == "epoch":
+                for name, seconds in record["phases"].items():
+                    totals[name] += seconds
+    total = sum(totals.values()) or 1.0
+    return {name: seconds / total for name, seconds in sorted(totals.items(), key=lambda kv: -kv[1])}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarize a timeline.jsonl written with --timeline")
+    parser.add_argument("path", type=str)
+    args = parser.parse_args()
+    for name, share in summarize(args.path).items():
+        print(f"{name:<12} {share:6.1%}")
@@ -0,0 +1,76 @@
+from functools import lru_cache
+from typing import Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# Long-tail losses (LDAM, focal) and class-balanced DRW weights. Nothing here assumes CUDA: the
+# margins and weights are buffers that follow the module to whatever device it is moved to.
+
+DRW_BETAS = (0, 0.9999)
+
+
+@lru_cache(maxsize=None)
+def _class_balanced(cls_num_list: Tuple[int, ...], beta: float) -> torch.Tensor:
+    # "Class-Balanced Loss Based on Effective Number of Samples", normalized to sum to #classes
+    effective_num = 1.0 - np.power(beta, cls_num_list)
+    weights = (1.0 - beta) / np.array(effective_num)
+    weights = weights / np.sum(weights) * len(cls_num_list)
+    return torch.tensor(weights, dtype=torch.float32)
+
+
+def drw_weights(cls_num_list: Sequence[int], epoch: int, drw_epoch: int = 160, device=None,
+                betas: Sequence[float] = DRW_BETAS) -> torch.Tensor:
+    """
+    Per-class weights of the deferred re-weighting (DRW) phase ``epoch // drw_epoch``: uniform
+    before ``drw_epoch``, class-balanced afterwards. Weights are computed once per phase and
+    later phases keep the last beta. Called every epoch, so that the loss switches phase.
+    """
+    beta = betas[min(epoch // drw_epoch, len(betas) - 1)]
+    # a copy, callers own the result and must not write into the cache
+    return _class_balanced(tuple(int(n) for n in cls_num_list), float(beta)).to(device).clone()
+
+
+class LDAMLoss(nn.Module):
+    """Label-distribution-aware margin loss: the true-class logit is reduced by ``m_c ~ n_c^(-1/4)``."""
+
+    def __init__(self, cls_num_list, max_m=0.5, weight=None, s=30):
+        super(LDAMLoss, self).__init__()
+        m_list = 1.0 / np.sqrt(np.sqrt(cls_num_list))
+        m_list = m_list * (max_m / np.max(m_list))
+        self.register_buffer("m_list", torch.tensor(m_list, dtype=torch.float32))
+        self.register_buffer("weight", weight)
+        assert s > 0
+        self.s = s
+
+    def margin_logits(self, x, target):
+        """Scaled logits with the class margin subtracted at the target, one gather and one scatter."""
+        batch_m = self.m_list.gather(0, target).to(x.dtype)
+        return self.s * x.scatter_add(1, target.view(-1, 1), -batch_m.view(-1, 1))
+
+    def forward(self, x, target):
+        losses = F.cross_entropy(self.margin_logits(x, target), target, weight=self.weight, reduction="none")
+        # same reduction as F.cross_entropy with class weights
+        if self.weight is None:
+            return losses.mean()
+        return losses.sum() / self.weight.gather(0, target).sum()
+
+
+def focal_loss(input_values, gamma):
+    """Computes the focal loss"""
+    p = torch.exp(-input_values)
+    loss = (1 - p) ** gamma * input_values
+    return loss.mean()
+
+
+class FocalLoss(nn.Module):
+    def __init__(self, weight=None, gamma=0.):
+        super(FocalLoss, self).__init__()
+        assert gamma >= 0
+        self.gamma = gamma
+        self.register_buffer("weight", weight)
+
+    def forward(self, input, target):
+        return focal_loss(F.cross_entropy(input, target, reduction='none', weight=self.weight), self.gamma)
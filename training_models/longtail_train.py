@@ -1,42 +1,17 @@
-import math
+import os
 import torch
-import torch.nn as nn
-import torch.nn.functional as F
-import numpy as np
 import torch.optim as optim
 from torch.optim.lr_scheduler import ReduceLROnPlateau, StepLR
 import time
-from utils import log_memory, plot_metrics, plot_metrics_test, plot_accuracy_time_multi, plot_accuracy_time_multi_test
+from utils import log_memory, log_results, record_accuracy_time
+from flops import FlopAccountant
 from tqdm import tqdm
 from imbalance_cifar import IMBALANCECIFAR100
+from longtail_loss import LDAMLoss, drw_weights
+from selection import criterion_for
 
 # cls_num_list = IMBALANCECIFAR100.get_cls_num_list()
 
-class LDAMLoss(nn.Module):
-    
-    def __init__(self, cls_num_list, max_m=0.5, weight=None, s=30):
-        super(LDAMLoss, self).__init__()
-        m_list = 1.0 / np.sqrt(np.sqrt(cls_num_list))
-        m_list = m_list * (max_m / np.max(m_list))
-        m_list = torch.cuda.FloatTensor(m_list)
-        self.m_list = m_list
-        assert s > 0
-        self.s = s
-        self.weight = weight
-
-    def forward(self, x, target):
-        index = torch.zeros_like(x, dtype=torch.uint8)
-        index.scatter_(1, target.data.view(-1, 1), 1)
-        
-        index_float = index.type(torch.cuda.FloatTensor)
-        batch_m = torch.matmul(self.m_list[None, :], index_float.transpose(0,1))
-        batch_m = batch_m.view((-1, 1))
-        x_m = x - batch_m
-    
-        output = torch.where(index, x_m, x)
-        return F.cross_entropy(self.s*output, target, weight=self.weight)
-    
-
 def train_with_revision_longtail(model_name, model, train_loader, test_loader, device, epochs, save_path, threshold, start_revision, task, cls_num_list, threshold_scheduler=None, threshold_method: str = "fixed"):
 
     save_path = save_path
@@ -44,13 +19,8 @@ def train_with_revision_longtail(model_name, model, train_loader, test_loader, d
     
     # criterion = nn.CrossEntropyLoss()
     train_sampler = None
-    idx = epochs // 24
-    betas = [0, 0.9999]
-    effective_num = 1.0 - np.power(betas[idx], cls_num_list)
-    per_cls_weights = (1.0 - betas[idx]) / np.array(effective_num)
-    per_cls_weights = per_cls_weights / np.sum(per_cls_weights) * len(cls_num_list)
-    per_cls_weights = torch.FloatTensor(per_cls_weights).cuda()
-    criterion = LDAMLoss(cls_num_list=cls_num_list, max_m=0.5, s=30, weight=per_cls_weights).cuda()
+    per_cls_weights = drw_weights(cls_num_list, 0, 24, device)
+    criterion = LDAMLoss(cls_num_list=cls_num_list, max_m=0.5, s=30, weight=per_cls_weights).to(device)
     optimizer = optim.SGD(model.parameters(), lr=0.1, momentum=0.9, weight_decay=0.0001)
     #as per implementation LR=0.045, they use 16 GPU. https://discuss.pytorch.org/t/training-mobilenet-on-imagenet/174391/6 from this blog
     #we use the idea to divide the learning rate by the number of GPUs. 
@@ -64,11 +34,14 @@ def train_with_revision_longtail(model_name, model, train_loader, test_loader, d
     epoch_test_losses = []
     time_per_epoch = []
     start_time = time.time()
+    flops = FlopAccountant(model, len(train_loader.dataset))
     val_loss_hist = []
     grad_norm_hist = []
     # initialize with starting tau so history is non-empty
     tau_hist = [threshold]
     for epoch in range(epochs):
+        # deferred re-weighting: class-balanced weights from epoch 24 on
+        criterion.weight = drw_weights(cls_num_list, epoch, 24, device)
         # update dynamic tau if provided
         if threshold_scheduler is not None:
             state = {
@@ -91,31 +64,15 @@ def train_with_revision_longtail(model_name, model, train_loader, test_loader, d
             epoch_grad_sq = 0.0
             epoch_grad_count = 0
             
-            for batch_idx, (inputs, labels) in progress_bar:
+            for batch_idx, (inputs, labels, *_) in progress_bar:
                 inputs, labels = inputs.to(device), labels.to(device)
                 
                 with torch.no_grad():
                     outputs = model(inputs)
+                    flops.add("score", inputs)
                     # if task == "segmentation":
                     #     outputs = outputs['out']
-                    preds = torch.argmax(outputs, dim=1)
-                    if threshold_method == "relative":
-                        prob = torch.softmax(outputs, dim=1)
-                        top2_prob, top2_idx = torch.topk(prob, k=2, dim=1)
-                        top1_prob = top2_prob[:, 0]
-                        top2_prob_val = top2_prob[:, 1]
-                        miscls_mask = preds != labels
-                        correct_top1_mask = preds == labels
-                        margin = top1_prob - top2_prob_val
-                        rel_mask = correct_top1_mask & (margin < threshold)
-                        mask = miscls_mask | rel_mask
-                    else:
-                        if threshold == 0:
-                            mask = preds != labels
-                        else:
-                            prob = torch.softmax(outputs, dim=1)
-                            correct_class = prob[torch.arange(labels.size(0)), labels]
-                            mask = correct_class < threshold
+                    mask, preds = criterion_for(threshold_method)(outputs, labels, threshold)
 
                 if not mask.any():
                     continue
@@ -138,6 +95,7 @@ def train_with_revision_longtail(model_name, model, train_loader, test_loader, d
                 optimizer.zero_grad()
 
                 outputs_misclassified = model(inputs_misclassified)
+                flops.add("train", inputs_misclassified)
                 # if task == "segmentation":
                 #     outputs_misclassified = outputs_misclassified['out']
                 # outputs_misclassified = outputs[mask]
@@ -186,6 +144,7 @@ def train_with_revision_longtail(model_name, model, train_loader, test_loader, d
                     inputs = batch[0].to(device)
                     labels = batch[1].to(device)
                     outputs = model(inputs)
+                    flops.add("eval", inputs)
                     # if task == "segmentation":
                     #     outputs = outputs['out']
 
@@ -217,12 +176,13 @@ def train_with_revision_longtail(model_name, model, train_loader, test_loader, d
             progress_bar = tqdm(enumerate(train_loader), total=len(train_loader), desc="Training")
 
 
-            for batch_idx, (inputs, labels) in progress_bar:
+            for batch_idx, (inputs, labels, *_) in progress_bar:
                 inputs, labels = inputs.to(device), labels.to(device)
 
                 optimizer.zero_grad()
 
                 outputs = model(inputs)
+                flops.add("train", inputs)
                 # if task == "segmentation":
                 #     outputs = outputs['out']
                 loss = criterion(outputs, labels)
@@ -232,6 +192,7 @@ def train_with_revision_longtail(model_name, model, train_loader, test_loader, d
                 running_loss += loss.item()
                 
                 outputs = model(inputs)
+                flops.add("extra", inputs)
                 # if task == "segmentation":
                 #     outputs = outputs['out']
                 preds = torch.argmax(outputs, dim=1)
@@ -257,6 +218,7 @@ def train_with_revision_longtail(model_name, model, train_loader, test_loader, d
                     inputs = batch[0].to(device)
                     labels = batch[1].to(device)
                     outputs = model(inputs)
+                    flops.add("eval", inputs)
                     # if task == "segmentation":
                     #     outputs = outputs['out']
 
@@ -274,25 +236,25 @@ def train_with_revision_longtail(model_name, model, train_loader, test_loader, d
             epoch_test_accuracies.append(accuracy)
             epoch_test_losses.append(val_loss)
 
+        flops.end_epoch(epoch, test_accuracy=accuracy)
 
     end_time = time.time()
     log_memory(start_time, end_time)
+    flops.save(os.path.join(os.path.dirname(save_path), "flops.json"))
 
-    plot_metrics(epoch_losses, epoch_accuracies, "Revision")
-    plot_metrics_test(epoch_test_accuracies, "Revisiong Test")
-    # plot_accuracy_time(epoch_accuracies, time_per_epoch, title="Accuracy and Time per Epoch", save_path=save_path)
-    plot_accuracy_time_multi(
-    model_name=model_name,  
-    accuracy=epoch_accuracies,
-    time_per_epoch=time_per_epoch,  
-    save_path=save_path,
-    data_file=save_path
+    log_results(model_name, "train", save_path, loss=epoch_losses, flops=[r["total_flops"] for r in flops.records])
+    record_accuracy_time(
+        model_name=model_name,
+        split="train",
+        accuracy=epoch_accuracies,
+        time_per_epoch=time_per_epoch,
+        data_file=save_path
     )
-    plot_accuracy_time_multi_test(
-        model_name = model_name,
+    record_accuracy_time(
+        model_name=model_name,
+        split="test",
         accuracy=epoch_test_accuracies,
         time_per_epoch=time_per_epoch,
-        save_path=save_path,
         data_file=save_path
     )
 
@@ -303,13 +265,8 @@ def train_baseline_longtail(model_name, model, train_loader, test_loader, device
     
     # criterion = nn.CrossEntropyLoss()
     train_sampler = None
-    idx = epoch // 160
-    betas = [0, 0.9999]
-    effective_num = 1.0 - np.power(betas[idx], cls_num_list)
-    per_cls_weights = (1.0 - betas[idx]) / np.array(effective_num)
-    per_cls_weights = per_cls_weights / np.sum(per_cls_weights) * len(cls_num_list)
-    per_cls_weights = torch.FloatTensor(per_cls_weights).cuda()
-    criterion = LDAMLoss(cls_num_list=cls_num_list, max_m=0.5, s=30, weight=per_cls_weights).cuda()
+    per_cls_weights = drw_weights(cls_num_list, 0, 160, device)
+    criterion = LDAMLoss(cls_num_list=cls_num_list, max_m=0.5, s=30, weight=per_cls_weights).to(device)
     optimizer = optim.SGD(model.parameters(), lr=0.1, momentum=0.9, weight_decay=0.0001)
     
     # scheduler = ReduceLROnPlateau(optimizer, mode='min', factor=0.1, patience=2, verbose=True)
@@ -321,8 +278,11 @@ def train_baseline_longtail(model_name, model, train_loader, test_loader, device
     epoch_test_losses = []
     time_per_epoch = []
     start_time = time.time()
+    flops = FlopAccountant(model, len(train_loader.dataset))
 
     for epoch in range(epochs):
+        # deferred re-weighting: class-balanced weights from epoch 160 on
+        criterion.weight = drw_weights(cls_num_list, epoch, 160, device)
         model.train()
         epoch_start_time = time.time()
         running_loss = 0.0
@@ -333,12 +293,13 @@ def train_baseline_longtail(model_name, model, train_loader, test_loader, device
         progress_bar = tqdm(enumerate(train_loader), total=len(train_loader), desc="Training")
 
 
-        for batch_idx, (inputs, labels) in progress_bar:
+        for batch_idx, (inputs, labels, *_) in progress_bar:
             inputs, labels = inputs.to(device), labels.to(device)
 
             optimizer.zero_grad()
 
             outputs = model(inputs)
+            flops.add("train", inputs)
             loss = criterion(outputs, labels)
             loss.backward()
             optimizer.step()
@@ -346,6 +307,7 @@ def train_baseline_longtail(model_name, model, train_loader, test_loader, device
             running_loss += loss.item()
             
             outputs = model(inputs)
+            flops.add("extra", inputs)
             preds = torch.argmax(outputs, dim=1)
             correct += (preds == labels).sum().item()
             total += labels.size(0)
@@ -369,6 +331,7 @@ def train_baseline_longtail(model_name, model, train_loader, test_loader, device
                 inputs = batch[0].to(device)
                 labels = batch[1].to(device)
                 outputs = model(inputs)
+                flops.add("eval", inputs)
                 batch_loss = criterion(outputs, labels)
                 test_loss+=batch_loss.item()
                 predictions = torch.argmax(outputs, dim=-1)
@@ -381,24 +344,25 @@ def train_baseline_longtail(model_name, model, train_loader, test_loader, device
         scheduler.step(val_loss)
         epoch_test_accuracies.append(accuracy)
         epoch_test_losses.append(val_loss)
+        flops.end_epoch(epoch, test_accuracy=accuracy)
 
     end_time = time.time()
     log_memory(start_time, end_time)
+    flops.save(os.path.join(os.path.dirname(save_path), "flops.json"))
 
-    plot_metrics(epoch_losses, epoch_accuracies, "Baseline Training")
-    plot_metrics_test(epoch_test_accuracies, "Baseline Training")
-    plot_accuracy_time_multi(
-    model_name=model_name,  
-    accuracy=epoch_accuracies,
-    time_per_epoch=time_per_epoch,  
-    save_path=save_path,
-    data_file=save_path
+    log_results(model_name, "train", save_path, loss=epoch_losses, flops=[r["total_flops"] for r in flops.records])
+    record_accuracy_time(
+        model_name=model_name,
+        split="train",
+        accuracy=epoch_accuracies,
+        time_per_epoch=time_per_epoch,
+        data_file=save_path
     )
-    plot_accuracy_time_multi_test(
-        model_name = model_name,
+    record_accuracy_time(
+        model_name=model_name,
+        split="test",
         accuracy=epoch_test_accuracies,
         time_per_epoch=time_per_epoch,
-        save_path=save_path,
         data_file=save_path
     )
     return model
\ No newline at end of file
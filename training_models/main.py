@@ -1,11 +1,19 @@
 import argparse
+import os
 import torch
-from model import resnet18, efficientnet_b0
-from model_zoo import ModelZoo
-from data import load_cifar100, load_mnist, load_imagenet, load_cityscapes, load_cifar10, load_medmnist3D, load_noisy
-from data import load_cifar100, load_mnist, load_imagenet, load_cityscapes, load_cifar10, load_medmnist3D, load_cub2011, load_aircraft, load_flowers
+import torchvision
+from registry import CIFAR_NATIVE, DATASETS, MODELS, build_model, load_dataset
+from dataset_cache import file_key, set_offline
+from feature_cache import feature_loaders
+from early_exit import EarlyExitModel
+from profiling import TraceProfiler, parse_steps
+from metrics_exporter import MetricsExporter
+from results_store import configure_run
+from distributed import cleanup, distribute_loader, get_rank, init_distributed, is_distributed, is_main_process, reduce_sum, unwrap_model, wrap_model
 from baseline import train_baseline, train_baseline_noisy
 from selective_gradient import TrainRevision
+from scoring_model import SCORE_MODELS
+from selection import SELECTION_CRITERIA
 from threshold_scheduler import get_threshold_scheduler
 from test import test_model
 from longtail_train import train_baseline_longtail, train_with_revision_longtail
@@ -19,8 +27,9 @@ def main():
                         help="Number of epochs to train for")
     parser.add_argument("--task", type=str, required=True, default="classification",
                         help="segmentation or classification or longtail")
-    parser.add_argument("--model", type=str, choices=["resnet18", "resnet_3d", "resnet34", "resnet50", "resnet101", "efficientnet_b0","efficientnet_b7", "efficientnet_b4", "mobilenet_v2", "mobilenet_v3", "vit_b_16", "mae_vit_b_16", "efficientformer", "segformer_b2"], required=True,
-                        help="Choose the model: 'resnet18', 'resnet34', 'resnet50', 'resnet101', 'mobilenet_v2', 'mobilenet_v3', 'efficientnet_b0', 'vit_b_16', 'mae_vit_b_16'")
+    parser.add_argument("--model", type=str, choices=list(MODELS), required=True,
+                        help="Choose the model: 'resnet18', 'resnet34', 'resnet50', 'resnet101', 'mobilenet_v2', 'mobilenet_v3', 'efficientnet_b0', 'vit_b_16', 'mae_vit_b_16', "
+                             "or a CIFAR-native 'resnet32', 'resnet18_cifar', 'efficientnet_b0_cifar' (32x32 inputs, no resize)")
     parser.add_argument("--pretrained", action="store_true", help="Use pretrained versions (applies to torchvision models, not MAE)")
     parser.add_argument("--mae_checkpoint", type=str, default=None, help="Path to MAE pretrained checkpoint file (used with --model mae_vit_b_16)")
     parser.add_argument("--save_path", type=str, help="to save graphs")
@@ -38,7 +47,7 @@ def main():
     parser.add_argument("--exp-k", dest="exp_k", type=float, default=5.0,
                         help="Exponential scheduler sharpness")
     parser.add_argument("--epoch_threshold", type=int, help="threshold to reintroduce correct samples in epoch")
-    parser.add_argument("--dataset", type=str, help="CIFAR or MNIST")
+    parser.add_argument("--dataset", type=str, choices=list(DATASETS), help="CIFAR or MNIST")
     parser.add_argument("--batch_size", type=int, help="32,64,128 etc.")
     parser.add_argument("--start_revision", type=int, help="Start revision after the given epoch")
     parser.add_argument("--long_tail", action="store_true", help="LongTail CIFAR100 or native version")
@@ -47,113 +56,121 @@ def main():
     parser.add_argument("--interval", type=int, default=50)
     parser.add_argument("--increment", type=float, default=0.1)
     parser.add_argument("--download", action="store_true", help="Download dataset if not exists (for aircraft and cub2011 datasets)")
+    parser.add_argument("--offline", action="store_true",
+                        help="Never download datasets; fail immediately if files are missing or corrupted")
+    parser.add_argument("--imagenet-shards", dest="imagenet_shards", type=str, default=None,
+                        help="Directory of ImageNet tar shards written by shard_dataset.py (streams shards instead of small files)")
+    parser.add_argument("--num-workers", dest="num_workers", type=int, default=4,
+                        help="DataLoader workers for sharded datasets")
+    parser.add_argument("--compact-dir", dest="compact_dir", type=str, default=None,
+                        help="Directory for contiguous hard-set segments rewritten in the background (train_with_alternative)")
+    parser.add_argument("--survivor-skipping", dest="survivor_skipping", action="store_true",
+                        help="Sharded datasets only read the previous epoch's DBPD survivors (train_with_revision)")
+    parser.add_argument("--async-scoring", dest="async_scoring", action="store_true",
+                        help="Score batches in a background thread with a weight snapshot, overlapping selection with training (train_with_revision)")
+    parser.add_argument("--score-refresh-steps", dest="score_refresh_steps", type=int, default=50,
+                        help="Optimizer steps between refreshes of the async scoring snapshot")
+    parser.add_argument("--score-queue-size", dest="score_queue_size", type=int, default=4,
+                        help="Scored batches the async scorer may run ahead of the trainer")
+    parser.add_argument("--score-model", dest="score_model", type=str, choices=list(SCORE_MODELS), default="live",
+                        help="Weights used to compute DBPD masks: the live model, an EMA of it or a periodic snapshot (train_with_revision)")
+    parser.add_argument("--score-ema-decay", dest="score_ema_decay", type=float, default=0.999,
+                        help="Per-step decay of the EMA scoring model")
+    parser.add_argument("--score-snapshot-steps", dest="score_snapshot_steps", type=int, default=100,
+                        help="Optimizer steps between refreshes of the snapshot scoring model")
+    parser.add_argument("--score-probe-steps", dest="score_probe_steps", type=int, default=50,
+                        help="Steps between mask-agreement probes against the live model when masks are stale (0 disables)")
+    parser.add_argument("--score-batch-size", dest="score_batch_size", type=int, default=None,
+                        help="Rows per no-grad scoring forward (train_with_revision, train_with_alternative); survivors are still trained on at --batch_size")
+    parser.add_argument("--feature-cache", dest="feature_cache", type=str, default=None,
+                        help="Freeze the pretrained backbone, cache its features in this directory and train only the head")
+    parser.add_argument("--trainable-blocks", dest="trainable_blocks", type=int, default=0,
+                        help="With --feature-cache: last blocks (residual stages, feature blocks, encoder layers) kept trainable, 0 is a linear probe")
+    parser.add_argument("--early-exit", dest="early_exit", action="store_true",
+                        help="Attach auxiliary exit heads at intermediate stages, trained jointly (train_with_revision)")
+    parser.add_argument("--exit-threshold", dest="exit_threshold", type=float, default=0.9,
+                        help="Top-class probability at which DBPD scoring stops at an exit")
+    parser.add_argument("--exit-aux-weight", dest="exit_aux_weight", type=float, default=0.3,
+                        help="Weight of the auxiliary exit losses")
+    parser.add_argument("--selection-criterion", dest="selection_criterion", type=str, choices=list(SELECTION_CRITERIA), default=None,
+                        help="DBPD selection rule (selection.py); default follows --threshold-method (train_with_revision)")
+    parser.add_argument("--timeline", action="store_true",
+                        help="Write per-step phase timings (data, score, select, forward, backward, optimizer, eval) to timeline.jsonl next to --save_path (train_with_revision)")
+    parser.add_argument("--timeline-sync", dest="timeline_sync", action="store_true",
+                        help="Synchronize CUDA at phase boundaries so kernel time is charged to the right phase")
+    parser.add_argument("--profile-epochs", dest="profile_epochs", type=int, nargs="+", default=None,
+                        help="Capture these epochs (0-based passes over the training data) with torch.profiler")
+    parser.add_argument("--profile-steps", dest="profile_steps", type=str, default=None,
+                        help="Restrict the capture to optimizer steps N (first N) or A:B of each profiled epoch (default: the whole epoch, eval included)")
+    parser.add_argument("--track-memory", dest="track_memory", action="store_true",
+                        help="Track per-epoch and per-phase memory peaks in memory.json next to --save_path and in the results store (train_with_revision)")
+    parser.add_argument("--trace-malloc", dest="trace_malloc", action="store_true",
+                        help="Also track Python allocation peaks with tracemalloc in memory.json (slow, implies --track-memory)")
+    parser.add_argument("--score-histogram-bins", dest="score_histogram_bins", type=int, default=20,
+                        help="Bins of the per-epoch, per-class histograms of correct-class probability and margin from the scoring pass, saved in the results store (train_with_revision, 0 disables)")
+    parser.add_argument("--metrics-port", dest="metrics_port", type=int, default=None,
+                        help="Serve live training metrics for Prometheus on this port (+ rank under DDP) at /metrics (train_with_revision)")
+    parser.add_argument("--metrics-host", dest="metrics_host", type=str, default="127.0.0.1",
+                        help="Address the metrics endpoint binds to (0.0.0.0 to let other hosts scrape it)")
+    parser.add_argument("--metrics-textfile", dest="metrics_textfile", type=str, default=None,
+                        help="Rewrite live training metrics to this .prom file every 10 s, for the node_exporter textfile collector (train_with_revision)")
     args = parser.parse_args()
+    set_offline(args.offline)
+    # under torchrun every rank joins the process group and gets its own device
+    device = init_distributed(torch.device("cuda" if torch.cuda.is_available() else "cpu"))
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    pretrained = False
-    if args.dataset == "mnist":
-        num_classes = 10
-        train_loader, test_loader = load_mnist()
-    elif args.dataset == "cifar":
-        if args.batch_size:
-            train_loader, test_loader, cls_num_list, data_size = load_cifar100(args.long_tail, args.batch_size)
-        else:
-            train_loader, test_loader, cls_num_list, data_size = load_cifar100(args.long_tail)
+    if args.model == "mae_vit_b_16" and not args.mae_checkpoint:
+        parser.error("--mae_checkpoint is required when using --model mae_vit_b_16")
+    if args.pretrained and args.model in CIFAR_NATIVE:
+        parser.error(f"--pretrained has no weights for the CIFAR-native model {args.model}")
+    if args.feature_cache and not (args.pretrained or args.mae_checkpoint):
+        parser.error("--feature-cache needs a pretrained backbone (--pretrained or --mae_checkpoint)")
+    if args.early_exit and args.feature_cache:
+        parser.error("--early-exit and --feature-cache cannot be combined")
+    if args.early_exit and args.mode != "train_with_revision":
+        # only train_with_revision trains the exit heads, elsewhere they would stay untrained (and unused under DDP)
+        parser.error("--early-exit is only supported with --mode train_with_revision")
+    if (args.metrics_port is not None or args.metrics_textfile) and args.mode != "train_with_revision":
+        parser.error("--metrics-port and --metrics-textfile are only supported with --mode train_with_revision")
+    # results store key: run id + hash of the options (before args.model gets its tags appended)
+    run_id = configure_run(vars(args))
+    if is_main_process():
+        print(f"Run {run_id}")
+    if args.save_path:
+        # results, timelines, FLOP and memory reports all go next to --save_path
+        os.makedirs(os.path.dirname(args.save_path) or ".", exist_ok=True)
+    metrics_exporter = None
+    if args.metrics_port is not None or args.metrics_textfile:
+        rank = get_rank()
+        textfile = args.metrics_textfile
+        if textfile and is_distributed():
+            textfile = f"{os.path.splitext(textfile)[0]}_rank{rank}{os.path.splitext(textfile)[1]}"
+        metrics_exporter = MetricsExporter(args.metrics_port + rank if args.metrics_port is not None else None, textfile,
+                                           host=args.metrics_host,
+                                           labels={"run_id": run_id, "model": args.model, "mode": args.mode, "rank": str(rank)})
 
-        num_classes = 100
-    elif args.dataset == "cifar10":
-        if args.noisy:
-            train_loader, test_loader, data_size = load_noisy(args.batch_size)
-        else:
-            train_loader, test_loader, cls_num_list, data_size = load_cifar10(args.long_tail, args.batch_size)
-        num_classes = 10
-    elif args.dataset == "imagenet":
-        num_classes = 1000
-        train_loader, test_loader, data_size = load_imagenet(args.batch_size)
-    elif args.dataset == "cityscapes":
-        num_classes = 19
-        train_loader, test_loader = load_cityscapes()
-    elif args.dataset == "organ_medmnist3d":
-        num_classes = 11
-        train_loader, test_loader, data_size = load_medmnist3D(args.batch_size)
+    # Only the selected loader and builder (and their dependencies) get imported
+    num_classes, train_loader, test_loader, cls_num_list, data_size = load_dataset(args)
+    model = build_model(args.model, num_classes, args.pretrained, args)
+    backbone = None
+    if args.feature_cache:
+        # the frozen backbone runs once per split, DBPD scores and trains the head on cached features
+        cache_key = [args.model, args.pretrained, file_key(args.mae_checkpoint) if args.mae_checkpoint else None,
+                     torchvision.__version__, args.dataset, args.long_tail, args.noisy,
+                     repr(getattr(train_loader.dataset, "transform", None)), repr(getattr(test_loader.dataset, "transform", None))]
+        backbone, model, train_loader, test_loader = feature_loaders(model, train_loader, test_loader, args.feature_cache,
+                                                                     args.trainable_blocks, cache_key, device)
+    if args.early_exit:
+        model = EarlyExitModel(model, num_classes, aux_weight=args.exit_aux_weight)
     
-    if not args.long_tail:
-        cls_num_list = None
-    elif args.dataset == "aircraft":
-        num_classes = 100  # FGVC-Aircraft variant 有 100 个类别
-        if args.batch_size:
-            train_loader, test_loader, data_size = load_aircraft(args.batch_size, root='/root/autodl-tmp/project/training_models/dataset', download=args.download)
-        else:
-            train_loader, test_loader, data_size = load_aircraft(download=args.download)
-    elif args.dataset == "cub2011":
-        num_classes = 200  # CUB-200-2011 有 200 个类别
-        if args.batch_size:
-            train_loader, test_loader, data_size = load_cub2011(args.batch_size, root='/root/autodl-tmp/project/training_models/dataset', download=args.download)
-        else:
-            train_loader, test_loader, data_size = load_cub2011(root='/root/autodl-tmp/project/training_models/dataset', download=args.download)
-    elif args.dataset == "flowers":
-        num_classes = 102  # Oxford 102 Category Flower 有 102 个类别
-        if args.batch_size:
-            train_loader, val_loader, test_loader, data_size = load_flowers(args.batch_size, root='/root/autodl-tmp/project/training_models/dataset', download=args.download)
-        else:
-            train_loader, val_loader, test_loader, data_size = load_flowers(root='/root/autodl-tmp/project/training_models/dataset', download=args.download)
-
-
-    if args.pretrained:
-        pretrained = True
-    
-    if args.task == "classification" or args.task=="longtail":
-        mz = ModelZoo(num_classes, pretrained)
-    elif args.task == "segmentation":
-        mz = ModelZoo(num_classes, pretrained)
-
-    ###Models From Scratch###
-    if args.model == "resnet18":
-        # model = resnet18(num_classes=100)
-        model = mz.resnet18()
-    elif args.model == "efficientnet_b0":
-        # model = efficientnet_b0(num_classes=100)
-        model = mz.efficientnet_b0()
-
-    ###PyTorch Models###
-    elif args.model == "mobilenet_v2":
-        model = mz.mobilenet_v2()
-    elif args.model == "mobilenet_v3":
-        model = mz.mobilenet_v3()
-    elif args.model == "resnet34":
-        model = mz.resnet34()
-    elif args.model == "resnet50":
-        model = mz.resnet50()
-    elif args.model == "resnet101":
-        model = mz.resnet101()
-    elif args.model == "vit_b_16":
-        model = mz.vit_b_16()
-    elif args.model == "mae_vit_b_16":
-        if not args.mae_checkpoint:
-            parser.error("--mae_checkpoint is required when using --model mae_vit_b_16")
-        # The 'pretrained' flag for ModelZoo is not directly used by mae_vit_b_16,
-        # as it loads weights from the checkpoint_path.
-        # However, ModelZoo still needs to be initialized.
-        # We can pass False for pretrained here, or adjust ModelZoo if needed.
-        # For simplicity, let's assume ModelZoo's pretrained flag is for its other models.
-        model = mz.mae_vit_b_16(checkpoint_path=args.mae_checkpoint)
-    elif args.model == "efficientformer":
-        model = mz.efficientformer()
-    elif args.model == "efficientnet_b7":
-        model = mz.efficientnet_b7()
-    elif args.model == "efficientnet_b4":
-        model = mz.efficientnet_b4()
-    elif args.model == "segformer_b2":
-        # model = mz.segformer_b2()
-        # model = mz.mmseg_model()
-        # model = mz.lraspp_mobilenet_v3_large()
-        model = mz.segformer()
-    elif args.model == "resnet_3d":
-        model = mz.resnet18_3d()
-
-    
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     model = model.to(device)
+    model = wrap_model(model, device)
+    train_loader = distribute_loader(train_loader)
+    profiler = None
+    if args.profile_epochs or args.profile_steps:
+        trace_dir = os.path.join(os.path.dirname(args.save_path) or ".", "profile")
+        profiler = TraceProfiler(trace_dir, args.profile_epochs or [0], parse_steps(args.profile_steps), device)
+        train_loader = profiler.wrap(train_loader)
 
     # Model naming: reflect threshold schedule config
     threshold_tag = f"{args.threshold_method}_{args.tau_min}-{args.tau_max}"
@@ -189,7 +206,15 @@ def main():
             trained_model = train_revision.train_selective_epoch()
         elif args.mode == "train_with_revision":
             threshold_scheduler = get_threshold_scheduler(args, args.epoch)
-            train_revision = TrainRevision(args.model, model, train_loader, test_loader, device, args.epoch, args.save_path, args.tau_min, threshold_scheduler=threshold_scheduler, threshold_method=args.threshold_method)
+            train_revision = TrainRevision(args.model, model, train_loader, test_loader, device, args.epoch, args.save_path, args.tau_min, threshold_scheduler=threshold_scheduler, threshold_method=args.threshold_method,
+                                           async_scoring=args.async_scoring, score_refresh_steps=args.score_refresh_steps, score_queue_size=args.score_queue_size,
+                                           score_model=args.score_model, score_ema_decay=args.score_ema_decay,
+                                           score_snapshot_steps=args.score_snapshot_steps, score_probe_steps=args.score_probe_steps,
+                                           score_batch_size=args.score_batch_size,
+                                           early_exit_threshold=args.exit_threshold if args.early_exit else None,
+                                           selection_criterion=args.selection_criterion,
+                                           timeline=args.timeline, timeline_sync=args.timeline_sync, track_memory=args.track_memory, trace_malloc=args.trace_malloc,
+                                           metrics_exporter=metrics_exporter, score_histogram_bins=args.score_histogram_bins)
             print(f"Training {args.mode}, will start revision after {args.start_revision}")
             if args.noisy:
                 trained_model, num_step = train_revision.train_with_noisy_revision(args.start_revision, args.task, cls_num_list)
@@ -234,12 +259,20 @@ def main():
             trained_model, num_step = train_revision.train_with_adaptive(args.start_revision, args.task, cls_num_list, args.interval, args.increment)
             print("Number of steps : ", num_step)
         elif args.mode == "train_with_alternative":
-            train_revision = TrainRevision(args.model, model, train_loader, test_loader, device, args.epoch, args.save_path, args.tau_min)
+            train_revision = TrainRevision(args.model, model, train_loader, test_loader, device, args.epoch, args.save_path, args.tau_min, compact_dir=args.compact_dir,
+                                           score_batch_size=args.score_batch_size)
             trained_model, num_step = train_revision.train_with_alternative(args.start_revision, args.task, cls_num_list)
             print("Number of steps : ", num_step)
+    if profiler is not None:
+        profiler.close()
+    if metrics_exporter is not None:
+        metrics_exporter.close()
     
     if args.mode == "baseline":
         num_step = data_size
+    else:
+        # ranks count only the samples they trained on
+        num_step = reduce_sum(num_step)
     eff_epoch = int(num_step/data_size)
 
     print("Effective Epochs: ", eff_epoch)
@@ -249,7 +282,12 @@ def main():
         print("Effective Epochs: ", eff_epoch)
     else:
         print("Training completed in baseline mode")
-    torch.save(trained_model, "trained_model.pth")
+    if is_main_process():
+        trained_model = unwrap_model(trained_model)
+        if backbone is not None:
+            trained_model = torch.nn.Sequential(backbone, trained_model)
+        torch.save(trained_model, "trained_model.pth")
+    cleanup()
     
 if __name__ == "__main__":
     main()
@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+import torch
+
+# Live training metrics in the Prometheus text format, for dashboards that scrape long runs.
+# The training loop only hands over the records it already produces (``Timeline`` steps and
+# epochs, ``MemoryTracker`` epochs); ``observe`` updates a few counters under a lock and returns.
+# Formatting happens when the metrics are read: by the HTTP server thread (``port``, GET /metrics)
+# or by a writer thread that replaces ``textfile`` every ``interval`` seconds (for the
+# node_exporter textfile collector).
+
+PREFIX = "dbpd_"
+# steps used for the samples/s and seconds/step gauges
+WINDOW = 50
+
+# name -> (type, help)
+METRICS = {
+    "epoch": ("gauge", "Current epoch (0-based)"),
+    "steps_total": ("counter", "Training steps taken"),
+    "samples_total": ("counter", "Samples scored (seen) by training steps"),
+    "survivors_total": ("counter", "Samples trained on"),
+    "samples_per_second": ("gauge", f"Samples seen per second over the last {WINDOW} steps"),
+    "step_seconds": ("gauge", f"Mean step time over the last {WINDOW} steps"),
+    "phase_seconds_total": ("counter", "Time spent per step phase"),
+    "survivor_fraction": ("gauge", "Share of the samples of the current (or last) epoch trained on"),
+    "tau": ("gauge", "DBPD threshold of the last epoch"),
+    "train_loss": ("gauge", "Training loss of the last epoch"),
+    "test_accuracy": ("gauge", "Test accuracy of the last evaluation"),
+    "memory_peak_mb": ("gauge", "Memory peaks of the last epoch"),
+    "rss_bytes": ("gauge", "Resident set size of the training process"),
+    "cuda_allocated_bytes": ("gauge", "CUDA memory allocated by tensors"),
+}
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsExporter:
+    """``port`` serves GET /metrics on ``host``, ``textfile`` is rewritten atomically; either may be None."""
+
+    def __init__(self, port: Optional[int] = None, textfile: Optional[str] = None, host: str = "127.0.0.1",
+                 interval: float = 10.0, labels: Optional[Dict[str, str]] = None):
+        self.labels = dict(labels or {})
+        self.textfile = textfile
+        self._lock = threading.Lock()
+        self._values: Dict[str, float] = {}
+        self._phases: Dict[str, float] = defaultdict(float)
+        self._epoch_phases: Dict[str, float] = defaultdict(float)
+        self._peaks: Dict[str, float] = {}
+        self._window = deque(maxlen=WINDOW + 1)
+        self._epoch_counts = [0, 0]
+        self._stop = threading.Event()
+        self._server = None
+        self._writer = None
+        try:
+            import psutil
+            self._process = psutil.Process(os.getpid())
+        except ImportError:
+            self._process = None
+        if port is not None:
+            self._server = ThreadingHTTPServer((host, port), self._handler())
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+            print(f"Serving training metrics on http://{host}:{port}/metrics")
+        if textfile is not None:
+            self._writer = threading.Thread(target=self._write_loop, args=(interval,), name="metrics-textfile", daemon=True)
+            self._writer.start()
+
+    def observe(self, record: Dict):
+        """Takes a ``Timeline`` step / epoch record or a ``MemoryTracker`` epoch record (``type`` "memory")."""
+        kind = record.get("type")
+        with self._lock:
+            values = self._values
+            if kind == "step":
+                values["epoch"] = record["epoch"]
+                values["steps_total"] = values.get("steps_total", 0) + 1
+                values["samples_total"] = values.get("samples_total", 0) + record["samples"]
+                values["survivors_total"] = values.get("survivors_total", 0) + record["survivors"]
+                for name, seconds in record["phases"].items():
+                    self._phases[name] += seconds
+                    self._epoch_phases[name] += seconds
+                self._window.append((time.perf_counter(), record["samples"]))
+                self._epoch_counts[0] += record["samples"]
+                self._epoch_counts[1] += record["survivors"]
+            elif kind == "epoch":
+                # epoch totals include the steps; only add what ran outside of them (e.g. eval)
+                for name, seconds in record["phases"].items():
+                    self._phases[name] += max(0.0, seconds - self._epoch_phases.get(name, 0.0))
+                self._epoch_phases = defaultdict(float)
+                for name in ("tau", "train_loss", "test_accuracy", "survivor_fraction"):
+                    if record.get(name) is not None:
+                        values[name] = record[name]
+                self._epoch_counts = [0, 0]
+            elif kind == "memory":
+                self._peaks = dict(record["peak"])
+
+    def _snapshot(self):
+        with self._lock:
+            values = dict(self._values)
+            phases = dict(self._phases)
+            peaks = dict(self._peaks)
+            window = list(self._window)
+            samples, survivors = self._epoch_counts
+        if len(window) > 1:
+            elapsed = window[-1][0] - window[0][0]
+            if elapsed > 0:
+                values["samples_per_second"] = sum(s for _, s in window[1:]) / elapsed
+                values["step_seconds"] = elapsed / (len(window) - 1)
+        if samples:
+            values["survivor_fraction"] = survivors / samples
+        if self._process is not None:
+            values["rss_bytes"] = self._process.memory_info().rss
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            values["cuda_allocated_bytes"] = torch.cuda.memory_allocated()
+        return values, phases, peaks
+
+    def render(self) -> str:
+        """Current metrics in the Prometheus text exposition format."""
+        values, phases, peaks = self._snapshot()
+        series = {name: [({}, value)] for name, value in values.items()}
+        if phases:
+            series["phase_seconds_total"] = [({"phase": name}, seconds) for name, seconds in sorted(phases.items())]
+        if peaks:
+            series["memory_peak_mb"] = [({"kind": name}, value) for name, value in sorted(peaks.items())]
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            if name not in series:
+                continue
+            lines.append(f"# HELP {PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            for extra, value in series[name]:
+                labels = ",".join(f'{k}="{_escape(v)}"' for k, v in {**self.labels, **extra}.items())
+                lines.append(f"{PREFIX}{name}{{{labels}}} {float(value)!r}" if labels else f"{PREFIX}{name} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+    def _handler(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # no access log in the training output
+                pass
+
+        return Handler
+
+    def write_textfile(self):
+        # written next to the target and renamed, so the collector never reads a partial file
+        tmp = f"{self.textfile}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, self.textfile)
+
+    def _write_loop(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.write_textfile()
+            except OSError as e:
+                print(f"Warning: could not write metrics to {self.textfile}: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.join()
+            self.write_textfile()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
@@ -2,10 +2,10 @@ import torch
 import torch.nn as nn
 import torchvision.models as models
 from torchvision.models import ViT_B_16_Weights
-import timm
 import torchvision.models.segmentation as seg_models
 
-from transformers import GPT2LMHeadModel, GPT2Tokenizer, GPT2Config
+# timm and transformers are only imported by the builders that need them, importing them at
+# module level costs seconds and a few hundred MB for every run.
 
 class ModelZoo:
     def __init__(self, num_classes, pretrained):
@@ -186,6 +186,8 @@ class ModelZoo:
 
 
     def efficientformer(self):
+        import timm
+
         if self.pretrained:
             model = timm.create_model('efficientformer_l1', pretrained=self.pretrained)
         else:
@@ -199,6 +201,8 @@ class ModelZoo:
         Load a GPT-2 model with a language modeling head.
         `model_name`: one of "gpt2", "gpt2-medium", etc.
         """
+        from transformers import GPT2LMHeadModel, GPT2Config
+
         if self.pretrained:
             model = GPT2LMHeadModel.from_pretrained(model_name)
         else:
@@ -3,14 +3,10 @@ from PIL import Image
 import os
 import os.path
 import numpy as np
-import sys
-if sys.version_info[0] == 2:
-    import cPickle as pickle
-else:
-    import pickle
 import torch
 import torch.utils.data as data
-from .utils import download_url, check_integrity, multiclass_noisify
+from .utils import download_url, check_integrity, multiclass_noisify, transition_matrix
+from dataset_cache import ARTIFACT_DIR, cached_arrays, cifar_split_arrays, file_key
 
 class CIFAR10(data.Dataset):
     """`CIFAR10 <https://www.cs.toronto.edu/~kriz/cifar.html>`_ Dataset.
@@ -57,79 +53,53 @@ class CIFAR10(data.Dataset):
         self.noise_type=noise_type
         self.nb_classes=10
         self.noise_path = noise_path
-        idx_each_class_noisy = [[] for i in range(10)]
         if download:
            self.download()
 
+        self._load_split(is_human)
 
-        # now load the picked numpy arrays
+    def _load_split(self, is_human):
+        # images are memory-mapped from a cached .npy copy of the pickled batches
         if self.train:
-            self.train_data = []
-            self.train_labels = []
-            for fentry in self.train_list:
-                f = fentry[0]
-                file = os.path.join(self.root, self.base_folder, f)
-                fo = open(file, 'rb')
-                if sys.version_info[0] == 2:
-                    entry = pickle.load(fo)
-                else:
-                    entry = pickle.load(fo, encoding='latin1')
-                self.train_data.append(entry['data'])
-                if 'labels' in entry:
-                    self.train_labels += entry['labels']
-                else:
-                    self.train_labels += entry['fine_labels']
-                fo.close()
-
-            self.train_data = np.concatenate(self.train_data)
-            self.train_data = self.train_data.reshape((50000, 3, 32, 32))
-            self.train_data = self.train_data.transpose((0, 2, 3, 1))  # convert to HWC
+            self.train_data, train_labels = cifar_split_arrays(self.root, self.base_folder, self.train_list)
+            self.train_labels = train_labels.tolist()
             #if noise_type is not None:
-            if noise_type !='clean':
-                # Load human noisy labels
-                train_noisy_labels = self.load_label()
-                self.train_noisy_labels = train_noisy_labels.tolist()
-                print(f'noisy labels loaded from {self.noise_path}')
-
-                if not is_human:
-                    T = np.zeros((self.nb_classes,self.nb_classes))
-                    for i in range(len(self.train_noisy_labels)):
-                        T[self.train_labels[i]][self.train_noisy_labels[i]] += 1
-                    T = T/np.sum(T,axis=1)
-                    print(f'Noise transition matrix is \n{T}')
-                    train_noisy_labels = multiclass_noisify(y=np.array(self.train_labels), P=T,
-                                        random_state=0) #np.random.randint(1,10086)
-                    self.train_noisy_labels = train_noisy_labels.tolist()
-                    T = np.zeros((self.nb_classes,self.nb_classes))
-                    for i in range(len(self.train_noisy_labels)):
-                        T[self.train_labels[i]][self.train_noisy_labels[i]] += 1
-                    T = T/np.sum(T,axis=1)
-                    print(f'New synthetic noise transition matrix is \n{T}')
-
-                for i in range(len(self.train_noisy_labels)):
-                    idx_each_class_noisy[self.train_noisy_labels[i]].append(i)
-                class_size_noisy = [len(idx_each_class_noisy[i]) for i in range(10)]
-                self.noise_prior = np.array(class_size_noisy)/sum(class_size_noisy)
-                print(f'The noisy data ratio in each class is {self.noise_prior}')
-                self.noise_or_not = np.transpose(self.train_noisy_labels)!=np.transpose(self.train_labels)
-                self.actual_noise_rate = np.sum(self.noise_or_not)/50000
-                print('over all noise rate is ', self.actual_noise_rate)
+            if self.noise_type !='clean':
+                self._load_noisy_labels(is_human)
         else:
-            f = self.test_list[0][0]
-            file = os.path.join(self.root, self.base_folder, f)
-            fo = open(file, 'rb')
-            if sys.version_info[0] == 2:
-                entry = pickle.load(fo)
-            else:
-                entry = pickle.load(fo, encoding='latin1')
-            self.test_data = entry['data']
-            if 'labels' in entry:
-                self.test_labels = entry['labels']
-            else:
-                self.test_labels = entry['fine_labels']
-            fo.close()
-            self.test_data = self.test_data.reshape((10000, 3, 32, 32))
-            self.test_data = self.test_data.transpose((0, 2, 3, 1))  # convert to HWC
+            self.test_data, test_labels = cifar_split_arrays(self.root, self.base_folder, self.test_list)
+            self.test_labels = test_labels.tolist()
+
+    def _load_noisy_labels(self, is_human):
+        """Noisy labels plus per-class index lists, computed once and cached as a fingerprinted .npz."""
+        parts = ["noisy-labels-v1", self.dataset, self.noise_type, bool(is_human), file_key(self.noise_path),
+                 [file_key(os.path.join(self.root, self.base_folder, f)) for f, _ in self.train_list]]
+
+        def compute():
+            # Load human noisy labels
+            train_noisy_labels = np.asarray(self.load_label(), dtype=np.int64).reshape(-1)
+            print(f'noisy labels loaded from {self.noise_path}')
+            if not is_human:
+                T = transition_matrix(self.train_labels, train_noisy_labels, self.nb_classes)
+                print(f'Noise transition matrix is \n{T}')
+                train_noisy_labels = multiclass_noisify(y=np.array(self.train_labels), P=T,
+                                    random_state=0) #np.random.randint(1,10086)
+                T = transition_matrix(self.train_labels, train_noisy_labels, self.nb_classes)
+                print(f'New synthetic noise transition matrix is \n{T}')
+            return {"train_noisy_labels": train_noisy_labels,
+                    "class_order": np.argsort(train_noisy_labels, kind='stable'),
+                    "class_counts": np.bincount(train_noisy_labels, minlength=self.nb_classes)}
+
+        arrays = cached_arrays(os.path.join(self.root, self.base_folder, ARTIFACT_DIR), "noisy-labels", parts, compute)
+        train_noisy_labels = arrays["train_noisy_labels"]
+        class_size_noisy = arrays["class_counts"]
+        self.train_noisy_labels = train_noisy_labels.tolist()
+        self.idx_each_class_noisy = np.split(arrays["class_order"], np.cumsum(class_size_noisy)[:-1])
+        self.noise_prior = class_size_noisy/class_size_noisy.sum()
+        print(f'The noisy data ratio in each class is {self.noise_prior}')
+        self.noise_or_not = train_noisy_labels != np.asarray(self.train_labels)
+        self.actual_noise_rate = np.sum(self.noise_or_not)/len(self.train_labels)
+        print('over all noise rate is ', self.actual_noise_rate)
 
     def load_label(self):
         #NOTE only load manual training label
@@ -261,7 +231,6 @@ class CIFAR100(CIFAR10):
         self.noise_type=noise_type
         self.nb_classes=100
         self.noise_path = noise_path
-        idx_each_class_noisy = [[] for i in range(100)]
 
         if download:
             self.download()
@@ -270,68 +239,4 @@ class CIFAR100(CIFAR10):
             raise RuntimeError('Dataset not found or corrupted.' +
                                ' You can use download=True to download it')
 
-        # now load the picked numpy arrays
-        if self.train:
-            self.train_data = []
-            self.train_labels = []
-            for fentry in self.train_list:
-                f = fentry[0]
-                file = os.path.join(self.root, self.base_folder, f)
-                fo = open(file, 'rb')
-                if sys.version_info[0] == 2:
-                    entry = pickle.load(fo)
-                else:
-                    entry = pickle.load(fo, encoding='latin1')
-                self.train_data.append(entry['data'])
-                if 'labels' in entry:
-                    self.train_labels += entry['labels']
-                else:
-                    self.train_labels += entry['fine_labels']
-                fo.close()
-
-            self.train_data = np.concatenate(self.train_data)
-            self.train_data = self.train_data.reshape((50000, 3, 32, 32))
-            self.train_data = self.train_data.transpose((0, 2, 3, 1))  # convert to HWC
-            if noise_type !='clean':
-                # load noise label
-                train_noisy_labels = self.load_label()
-                self.train_noisy_labels = train_noisy_labels.tolist()
-                print(f'noisy labels loaded from {self.noise_type}')
-                if not is_human:
-                    T = np.zeros((self.nb_classes,self.nb_classes))
-                    for i in range(len(self.train_noisy_labels)):
-                        T[self.train_labels[i]][self.train_noisy_labels[i]] += 1
-                    T = T/np.sum(T,axis=1)
-                    print(f'Noise transition matrix is \n{T}')
-                    train_noisy_labels = multiclass_noisify(y=np.array(self.train_labels), P=T,
-                                        random_state=0) #np.random.randint(1,10086)
-                    self.train_noisy_labels = train_noisy_labels.tolist()
-                    T = np.zeros((self.nb_classes,self.nb_classes))
-                    for i in range(len(self.train_noisy_labels)):
-                        T[self.train_labels[i]][self.train_noisy_labels[i]] += 1
-                    T = T/np.sum(T,axis=1)
-                    print(f'New synthetic noise transition matrix is \n{T}')
-                for i in range(len(self.train_labels)):
-                    idx_each_class_noisy[self.train_noisy_labels[i]].append(i)
-                class_size_noisy = [len(idx_each_class_noisy[i]) for i in range(100)]
-                self.noise_prior = np.array(class_size_noisy)/sum(class_size_noisy)
-                print(f'The noisy data ratio in each class is {self.noise_prior}')
-                self.noise_or_not = np.transpose(self.train_noisy_labels)!=np.transpose(self.train_labels)
-                self.actual_noise_rate = np.sum(self.noise_or_not)/50000
-                print('over all noise rate is ', self.actual_noise_rate)
-        else:
-            f = self.test_list[0][0]
-            file = os.path.join(self.root, self.base_folder, f)
-            fo = open(file, 'rb')
-            if sys.version_info[0] == 2:
-                entry = pickle.load(fo)
-            else:
-                entry = pickle.load(fo, encoding='latin1')
-            self.test_data = entry['data']
-            if 'labels' in entry:
-                self.test_labels = entry['labels']
-            else:
-                self.test_labels = entry['fine_labels']
-            fo.close()
-            self.test_data = self.test_data.reshape((10000, 3, 32, 32))
-            self.test_data = self.test_data.transpose((0, 2, 3, 1))  # convert to HWC
+        self._load_split(is_human)
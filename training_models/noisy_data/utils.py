@@ -1,25 +1,16 @@
 import os
 import os.path
 import copy
-import hashlib
 import errno
 import numpy as np
 from numpy.testing import assert_array_almost_equal
 import torch
 import torch.nn.functional as F 
+from dataset_cache import check_integrity_cached, require_online
 
 def check_integrity(fpath, md5):
-    if not os.path.isfile(fpath):
-        return False
-    md5o = hashlib.md5()
-    with open(fpath, 'rb') as f:
-        # read in 1MB chunks
-        for chunk in iter(lambda: f.read(1024 * 1024), b''):
-            md5o.update(chunk)
-    md5c = md5o.hexdigest()
-    if md5c != md5:
-        return False
-    return True
+    # hashes are cached by file size and mtime, see dataset_cache.py
+    return check_integrity_cached(fpath, md5)
 
 
 def download_url(url, root, filename, md5):
@@ -40,6 +31,7 @@ def download_url(url, root, filename, md5):
     if os.path.isfile(fpath) and check_integrity(fpath, md5):
         print('Using downloaded and verified file: ' + fpath)
     else:
+        require_online(url)
         try:
             print('Downloading ' + url + ' to ' + fpath)
             urllib.request.urlretrieve(url, fpath)
@@ -97,9 +89,15 @@ def list_files(root, suffix, prefix=False):
     return files
 
 # basic function#
-def multiclass_noisify(y, P, random_state=0):
+def multiclass_noisify(y, P, random_state=0, legacy=False):
     """ Flip classes according to transition probability matrix T.
     It expects a number between 0 and the number of classes - 1.
+
+    Labels are drawn by inverse-CDF sampling: one uniform per sample is looked up in the
+    cumulative row ``P[y]``, done class by class so memory stays O(m). For a given
+    ``random_state`` the flips follow the same distribution as the original per-sample
+    ``multinomial`` loop but are NOT the same draws; pass ``legacy=True`` to reproduce
+    label sets generated before the vectorized version.
     """
     #print np.max(y), P.shape[0]
     assert P.shape[0] == P.shape[1]
@@ -115,15 +113,33 @@ def multiclass_noisify(y, P, random_state=0):
     flipper = np.random.RandomState(random_state)
     print(f'flip with random seed {random_state}')
 
-    for idx in np.arange(m):
-        i = y[idx]
-        # draw a vector with only an 1
-        flipped = flipper.multinomial(1, P[i, :], 1)[0]
-        new_y[idx] = np.where(flipped == 1)[0]
+    if legacy:
+        for idx in np.arange(m):
+            i = y[idx]
+            # draw a vector with only an 1
+            flipped = flipper.multinomial(1, P[i, :], 1)[0]
+            new_y[idx] = np.where(flipped == 1)[0][0]
+        return new_y
+
+    u = flipper.random_sample(m)
+    cdf = np.cumsum(P, axis=1)
+    for i in np.unique(y):
+        rows = np.flatnonzero(y == i)
+        # clip guards against a last cumulative value slightly below 1
+        new_y[rows] = np.minimum(np.searchsorted(cdf[i], u[rows], side='right'), P.shape[1] - 1)
 
     return new_y
 
 
+def transition_matrix(y, y_noisy, nb_classes):
+    """Row-normalized noise transition matrix, ``T[i, j]`` = P(noisy label j | clean label i)."""
+    y = np.asarray(y, dtype=np.int64)
+    y_noisy = np.asarray(y_noisy, dtype=np.int64)
+    T = np.bincount(y * nb_classes + y_noisy, minlength=nb_classes * nb_classes)
+    T = T.reshape(nb_classes, nb_classes).astype(np.float64)
+    return T / np.maximum(T.sum(axis=1, keepdims=True), 1)
+
+
 # noisify_pairflip call the function "multiclass_noisify"
 def noisify_pairflip(y_train, noise, random_state=None, nb_classes=10):
     """mistakes:
@@ -181,33 +197,46 @@ def noisify(dataset='mnist', nb_classes=10, train_labels=None, noise_type=None,
         train_noisy_labels, actual_noise_rate = noisify_multiclass_symmetric(train_labels, noise_rate, random_state=0, nb_classes=nb_classes)
     return train_noisy_labels, actual_noise_rate
 
-def noisify_instance(train_data,train_labels,noise_rate):
+def noisify_instance(train_data,train_labels,noise_rate,chunk_size=8192):
+    """Instance-dependent noise: flip probabilities come from a random linear map of each image.
+
+    Batched over ``chunk_size`` samples at a time (one matrix multiply and one softmax per chunk).
+    The random stream is consumed exactly as in the former per-sample loop, so for the same data
+    the labels match it up to floating-point rounding of the batched matmul.
+    """
     if max(train_labels)>10:
         num_class = 100
     else:
         num_class = 10
     np.random.seed(0)
-
-    q_ = np.random.normal(loc=noise_rate,scale=0.1,size=1000000)
-    q = []
-    for pro in q_:
-        if 0 < pro < 1:
-            q.append(pro)
-        if len(q)==50000:
-            break
-
-    w = np.random.normal(loc=0,scale=1,size=(32*32*3,num_class))
-
-    noisy_labels = []
-    for i, sample in enumerate(train_data):
-        sample = sample.flatten()
-        p_all = np.matmul(sample,w)
-        p_all[train_labels[i]] = -1000000
-        p_all = q[i]* F.softmax(torch.tensor(p_all),dim=0).numpy()
-        p_all[train_labels[i]] = 1 - q[i]
-        noisy_labels.append(np.random.choice(np.arange(num_class),p=p_all/sum(p_all)))
-    over_all_noise_rate = 1 - float(torch.tensor(train_labels).eq(torch.tensor(noisy_labels)).sum())/50000
-    return noisy_labels, over_all_noise_rate
+    train_labels = np.asarray(train_labels, dtype=np.int64)
+    n = len(train_labels)
+    flat = np.asarray(train_data).reshape(n, -1)
+
+    q_ = np.random.normal(loc=noise_rate,scale=0.1,size=max(1000000, 2 * n))
+    q = q_[(q_ > 0) & (q_ < 1)][:n]
+
+    w = np.random.normal(loc=0,scale=1,size=(flat.shape[1],num_class))
+    # np.random.choice(p=...) draws one uniform per call, drawing them up front keeps the stream
+    u = np.random.random_sample(n)
+
+    noisy_labels = np.empty(n, dtype=np.int64)
+    for start in range(0, n, chunk_size):
+        rows = np.arange(start, min(start + chunk_size, n))
+        labels = train_labels[rows]
+        p_all = np.matmul(flat[rows], w)
+        p_all[rows - start, labels] = -1000000
+        p_all = q[rows, None] * F.softmax(torch.from_numpy(p_all), dim=1).numpy()
+        p_all[rows - start, labels] = 1 - q[rows]
+        # sequential row sum, cumsum and renormalization mirror np.random.choice(p=p/sum(p))
+        total = np.zeros(len(rows))
+        for k in range(num_class):
+            total += p_all[:, k]
+        cdf = np.cumsum(p_all / total[:, None], axis=1)
+        cdf /= cdf[:, -1:]
+        noisy_labels[rows] = (cdf <= u[rows, None]).sum(axis=1)
+    over_all_noise_rate = 1 - float(np.mean(train_labels == noisy_labels))
+    return noisy_labels.tolist(), over_all_noise_rate
 '''
 def noisify_instance(train_data,train_labels,noise_rate):
     if max(train_labels)>10:
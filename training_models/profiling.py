@@ -0,0 +1,168 @@
+import os
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import torch
+from torch.optim.optimizer import register_optimizer_step_post_hook
+from torch.profiler import ProfilerActivity, profile
+
+from distributed import get_rank, is_distributed
+from instrumentation import PHASE_PREFIX, set_annotate
+
+# torch.profiler captures of selected epochs / optimizer steps of any training mode. Epochs are
+# the passes over the training loader (main.py wraps it), steps are counted with a global
+# optimizer hook, so the training loops themselves need no changes. Each capture is exported as a
+# Chrome trace (chrome://tracing, Perfetto) together with an operator table grouped by the phases
+# the loops annotate (see instrumentation.py).
+
+# profiler ranges that identify a phase when the loop did not annotate one
+_IMPLICIT_PHASES = (
+    ("enumerate(DataLoader)", "data"),
+    ("Optimizer.", "optimizer"),
+    ("autograd::engine::evaluate_function", "backward"),
+)
+
+
+def parse_steps(spec: Optional[str]) -> Optional[Tuple[int, Optional[int]]]:
+    """``"N"`` -> the first N steps of the epoch, ``"A:B"`` -> steps A..B-1, None -> whole epoch."""
+    if spec is None:
+        return None
+    if ":" in spec:
+        start, end = spec.split(":", 1)
+        return int(start or 0), int(end) if end else None
+    return 0, int(spec)
+
+
+def _phase_of(event) -> str:
+    while event is not None:
+        if event.name.startswith(PHASE_PREFIX):
+            return event.name[len(PHASE_PREFIX):]
+        for prefix, phase in _IMPLICIT_PHASES:
+            if event.name.startswith(prefix):
+                return phase
+        event = event.cpu_parent
+    return "other"
+
+
+def _device_time(event) -> float:
+    # renamed from *_cuda_* in torch 2.4
+    return getattr(event, "self_device_time_total", None) or getattr(event, "self_cuda_time_total", 0)
+
+
+def phase_table(events, top: int = 10) -> str:
+    """Self CPU / device time per phase and the ``top`` operators of each phase."""
+    ops: Dict[str, Dict[str, list]] = defaultdict(lambda: defaultdict(lambda: [0, 0.0, 0.0]))
+    for event in events:
+        if event.name.startswith(PHASE_PREFIX):
+            continue
+        entry = ops[_phase_of(event)][event.name]
+        entry[0] += 1
+        entry[1] += event.self_cpu_time_total
+        entry[2] += _device_time(event)
+    totals = {phase: (sum(e[1] for e in names.values()), sum(e[2] for e in names.values())) for phase, names in ops.items()}
+    on_device = any(device for _, device in totals.values())
+    key = 2 if on_device else 1
+    lines = [f"{'phase / operator':<60} {'calls':>7} {'self CPU ms':>12} {'self device ms':>15}"]
+    for phase in sorted(ops, key=lambda p: -totals[p][key - 1]):
+        cpu, device = totals[phase]
+        lines.append(f"{phase:<60} {'':>7} {cpu / 1e3:>12.2f} {device / 1e3:>15.2f}")
+        for name, (calls, op_cpu, op_device) in sorted(ops[phase].items(), key=lambda kv: -kv[1][key])[:top]:
+            lines.append(f"  {name[:58]:<58} {calls:>7} {op_cpu / 1e3:>12.2f} {op_device / 1e3:>15.2f}")
+    return "\n".join(lines)
+
+
+class EpochLoader:
+    """Transparent proxy of the training loader that calls ``listener.next_epoch()`` on every new pass."""
+
+    def __init__(self, loader, listener):
+        self._loader = loader
+        self._listener = listener
+
+    def __iter__(self):
+        self._listener.next_epoch()
+        return iter(self._loader)
+
+    def __len__(self):
+        return len(self._loader)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class TraceProfiler:
+    """
+    Captures the epochs in ``epochs`` (0-based) with torch.profiler, restricted to the optimizer
+    steps ``steps`` of each epoch when given (see ``parse_steps``). A whole-epoch capture also
+    covers that epoch's evaluation.
+    """
+
+    def __init__(self, trace_dir: str, epochs: Sequence[int], steps: Optional[Tuple[int, Optional[int]]] = None,
+                 device: Optional[torch.device] = None, record_shapes: bool = True, with_stack: bool = False):
+        self.trace_dir = trace_dir
+        self.epochs = set(epochs)
+        self.steps = steps
+        self.activities = [ProfilerActivity.CPU]
+        if device is not None and device.type == "cuda":
+            self.activities.append(ProfilerActivity.CUDA)
+        self.record_shapes = record_shapes
+        self.with_stack = with_stack
+        self.epoch = -1
+        self.step = 0
+        self._prof = None
+        self._first_step = 0
+        self._hook = register_optimizer_step_post_hook(self._after_step)
+        os.makedirs(trace_dir, exist_ok=True)
+
+    def wrap(self, loader) -> Iterable:
+        return EpochLoader(loader, self)
+
+    def _capturing_epoch(self) -> bool:
+        return self.epoch in self.epochs
+
+    def next_epoch(self):
+        self._stop()
+        self.epoch += 1
+        self.step = 0
+        if self._capturing_epoch() and (self.steps is None or self.steps[0] == 0):
+            self._start()
+
+    def _after_step(self, optimizer, args, kwargs):
+        self.step += 1
+        if not self._capturing_epoch() or self.steps is None:
+            return
+        start, end = self.steps
+        if self.step == start:
+            self._start()
+        elif end is not None and self.step == end:
+            self._stop()
+
+    def _start(self):
+        if self._prof is not None:
+            return
+        self._prof = profile(activities=self.activities, record_shapes=self.record_shapes, with_stack=self.with_stack)
+        self._prof.__enter__()
+        set_annotate(True)
+        self._first_step = self.step
+
+    def _stop(self):
+        if self._prof is None:
+            return
+        set_annotate(False)
+        prof, self._prof = self._prof, None
+        prof.__exit__(None, None, None)
+        name = f"epoch{self.epoch}_steps{self._first_step}-{self.step}"
+        if is_distributed():
+            name += f"_rank{get_rank()}"
+        trace_path = os.path.join(self.trace_dir, f"trace_{name}.json")
+        prof.export_chrome_trace(trace_path)
+        table = phase_table(prof.events())
+        with open(os.path.join(self.trace_dir, f"ops_{name}.txt"), "w") as f:
+            f.write(table + "\n\n")
+            sort_by = "self_cuda_time_total" if ProfilerActivity.CUDA in self.activities else "self_cpu_time_total"
+            f.write(prof.key_averages().table(sort_by=sort_by, row_limit=50))
+        print(f"Profiler trace saved to {trace_path}")
+        print(table)
+
+    def close(self):
+        self._stop()
+        self._hook.remove()
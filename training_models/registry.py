@@ -0,0 +1,170 @@
+import importlib
+from typing import Callable, Dict, Tuple
+
+# Dataset loaders and model builders are looked up by name and their modules are only imported
+# once selected, so e.g. a CIFAR run never imports medmnist, pandas, timm or transformers.
+
+DATASET_ROOT = '/root/autodl-tmp/project/training_models/dataset'
+
+
+def _resolve(spec: str):
+    """Imports ``"module:attr"`` on first use."""
+    module_name, attr = spec.split(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+# Models built for 32x32 inputs; CIFAR is fed to them without the 224x224 resize
+CIFAR_NATIVE = {"resnet32", "resnet18_cifar", "efficientnet_b0_cifar"}
+
+
+def _batch_kwargs(args) -> dict:
+    # Loaders keep their own default batch size when --batch_size is not given
+    return {"batch_size": args.batch_size} if args.batch_size else {}
+
+
+def _image_size(args) -> int:
+    return 32 if args.model in CIFAR_NATIVE else 224
+
+
+# Every adapter returns (train_loader, test_loader, cls_num_list, data_size)
+
+def _cifar100(args):
+    return _resolve("data:load_cifar100")(args.long_tail, image_size=_image_size(args), **_batch_kwargs(args))
+
+
+def _cifar10(args):
+    if args.noisy:
+        train_loader, test_loader, data_size = _resolve("data:load_noisy")(image_size=_image_size(args), **_batch_kwargs(args))
+        return train_loader, test_loader, None, data_size
+    return _resolve("data:load_cifar10")(args.long_tail, image_size=_image_size(args), **_batch_kwargs(args))
+
+
+def _mnist(args):
+    train_loader, test_loader, data_size = _resolve("data:load_mnist")(**_batch_kwargs(args))
+    return train_loader, test_loader, None, data_size
+
+
+def _imagenet(args):
+    if args.imagenet_shards:
+        train_loader, test_loader, data_size = _resolve("data:load_imagenet_shards")(
+            args.imagenet_shards, num_workers=args.num_workers, survivor_skipping=args.survivor_skipping,
+            # sample ids are only consumed by train_with_revision (survival log, survivor skipping)
+            return_index=args.mode == "train_with_revision", **_batch_kwargs(args))
+    else:
+        train_loader, test_loader, data_size = _resolve("data:load_imagenet")(**_batch_kwargs(args))
+    return train_loader, test_loader, None, data_size
+
+
+def _cityscapes(args):
+    train_loader, test_loader = _resolve("data:load_cityscapes")(**_batch_kwargs(args))
+    return train_loader, test_loader, None, None
+
+
+def _medmnist3d(args):
+    train_loader, test_loader, data_size = _resolve("data:load_medmnist3D")(**_batch_kwargs(args))
+    return train_loader, test_loader, None, data_size
+
+
+def _aircraft(args):
+    train_loader, test_loader, data_size = _resolve("data:load_aircraft")(
+        root=DATASET_ROOT, download=args.download, **_batch_kwargs(args))
+    return train_loader, test_loader, None, data_size
+
+
+def _cub2011(args):
+    train_loader, test_loader, data_size = _resolve("data:load_cub2011")(
+        root=DATASET_ROOT, download=args.download, **_batch_kwargs(args))
+    return train_loader, test_loader, None, data_size
+
+
+def _flowers(args):
+    train_loader, _, test_loader, data_size = _resolve("data:load_flowers")(
+        root=DATASET_ROOT, download=args.download, **_batch_kwargs(args))
+    return train_loader, test_loader, None, data_size
+
+
+def _synthetic(args):
+    # generated data for benchmarks and smoke tests (see data.SyntheticImages)
+    train_loader, test_loader, data_size = _resolve("data:load_synthetic")(image_size=_image_size(args), **_batch_kwargs(args))
+    return train_loader, test_loader, None, data_size
+
+
+# name -> (num_classes, adapter)
+DATASETS: Dict[str, Tuple[int, Callable]] = {
+    "mnist": (10, _mnist),
+    "cifar": (100, _cifar100),
+    "cifar10": (10, _cifar10),
+    "imagenet": (1000, _imagenet),
+    "cityscapes": (19, _cityscapes),
+    "organ_medmnist3d": (11, _medmnist3d),
+    "aircraft": (100, _aircraft),  # FGVC-Aircraft variant 有 100 个类别
+    "cub2011": (200, _cub2011),  # CUB-200-2011 有 200 个类别
+    "flowers": (102, _flowers),  # Oxford 102 Category Flower 有 102 个类别
+    "synthetic": (10, _synthetic),
+}
+
+
+def load_dataset(args):
+    """Returns (num_classes, train_loader, test_loader, cls_num_list, data_size) for ``args.dataset``."""
+    if args.dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset '{args.dataset}', choose from {sorted(DATASETS)}")
+    num_classes, adapter = DATASETS[args.dataset]
+    train_loader, test_loader, cls_num_list, data_size = adapter(args)
+    if not args.long_tail:
+        cls_num_list = None
+    return num_classes, train_loader, test_loader, cls_num_list, data_size
+
+
+def _zoo(method: str) -> Callable:
+    def build(num_classes, pretrained, args):
+        model_zoo = _resolve("model_zoo:ModelZoo")(num_classes, pretrained)
+        return getattr(model_zoo, method)()
+    return build
+
+
+def _mae_vit_b_16(num_classes, pretrained, args):
+    # Weights come from the MAE checkpoint, ``pretrained`` only applies to the other builders
+    model_zoo = _resolve("model_zoo:ModelZoo")(num_classes, pretrained)
+    return model_zoo.mae_vit_b_16(checkpoint_path=args.mae_checkpoint)
+
+
+def _resnet32(num_classes, pretrained, args):
+    # LDAM-DRW uses the cosine classifier (NormedLinear); no pretrained weights exist
+    return _resolve("imbalance_resnet:resnet32")(num_classes=num_classes, use_norm=args.ldam)
+
+
+def _cifar_model(name: str) -> Callable:
+    def build(num_classes, pretrained, args):
+        return _resolve(f"model:{name}")(num_classes=num_classes)
+    return build
+
+
+# name -> builder(num_classes, pretrained, args)
+MODELS: Dict[str, Callable] = {
+    "resnet18": _zoo("resnet18"),
+    "resnet_3d": _zoo("resnet18_3d"),
+    "resnet34": _zoo("resnet34"),
+    "resnet50": _zoo("resnet50"),
+    "resnet101": _zoo("resnet101"),
+    "efficientnet_b0": _zoo("efficientnet_b0"),
+    "efficientnet_b7": _zoo("efficientnet_b7"),
+    "efficientnet_b4": _zoo("efficientnet_b4"),
+    "mobilenet_v2": _zoo("mobilenet_v2"),
+    "mobilenet_v3": _zoo("mobilenet_v3"),
+    "vit_b_16": _zoo("vit_b_16"),
+    "mae_vit_b_16": _mae_vit_b_16,
+    "efficientformer": _zoo("efficientformer"),
+    "segformer_b2": _zoo("segformer"),
+    # CIFAR-native (see CIFAR_NATIVE), trained from scratch
+    "resnet32": _resnet32,
+    "resnet18_cifar": _cifar_model("resnet18"),
+    "efficientnet_b0_cifar": _cifar_model("efficientnet_b0"),
+}
+
+
+def build_model(name: str, num_classes: int, pretrained: bool, args):
+    if name not in MODELS:
+        raise ValueError(f"Unknown model '{name}', choose from {sorted(MODELS)}")
+    if pretrained and name in CIFAR_NATIVE:
+        raise ValueError(f"No pretrained weights exist for the CIFAR-native model '{name}', drop --pretrained")
+    return MODELS[name](num_classes, pretrained, args)
@@ -0,0 +1,141 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+from results_store import DB_NAME, ResultsStore
+
+# Offline figures for the results store: accuracy vs time (train and test), samples used per
+# epoch and the tau schedule, per results group, for any subset of models or runs. Training only
+# records results (utils.record_accuracy_time), so matplotlib never enters the training process.
+# Figures are rendered in parallel processes; a figure whose data did not change since the last
+# report is not rendered again (digests in .report_cache.json next to the figures).
+
+CACHE_NAME = ".report_cache.json"
+# bump when the rendering changes, so cached figures are redrawn
+STYLE_VERSION = 1
+
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def _series(curves: Dict[str, Dict[str, List[float]]], x: Optional[str], y: str) -> Dict[str, List[List[float]]]:
+    out = {}
+    for name, data in curves.items():
+        points = [(i + 1 if x is None else data[x][i], v) for i, v in enumerate(data[y])
+                  if v is not None and (x is None or data[x][i] is not None)]
+        if points:
+            out[name] = [[p[0] for p in points], [p[1] for p in points]]
+    return out
+
+
+def figure_specs(store: ResultsStore, groups: Sequence[str], models: Optional[Sequence[str]] = None,
+                 run_ids: Optional[Sequence[str]] = None) -> List[Dict]:
+    """One spec (file name, labels, series) per figure; a spec fully determines its figure."""
+    specs = []
+    for group in groups:
+        train = store.curves(group, "train", ("cumulative_time", "accuracy", "tau"), models, run_ids)
+        test = store.curves(group, "test", ("cumulative_time", "accuracy", "samples_used"), models, run_ids)
+        figures = [
+            (f"{group}_accuracy_time.png", "Accuracy vs Time for Multiple Models", "Time (seconds)", "Accuracy",
+             _series(train, "cumulative_time", "accuracy")),
+            (f"{group}_test_accuracy_time.png", "Test Accuracy vs Time for Multiple Models", "Time (seconds)", "Accuracy",
+             _series(test, "cumulative_time", "accuracy")),
+            (f"{group}_samples_per_epoch.png", "Number of Samples Used Per Epoch", "Epoch", "Number of Samples Used",
+             _series(test, None, "samples_used")),
+            (f"{group}_tau.png", "DBPD threshold (tau) per epoch", "Epoch", "tau", _series(train, None, "tau")),
+        ]
+        for filename, title, xlabel, ylabel, series in figures:
+            if series:
+                specs.append(dict(filename=filename, title=title, xlabel=xlabel, ylabel=ylabel, series=series))
+    return specs
+
+
+def spec_digest(spec: Dict) -> str:
+    return hashlib.sha1(json.dumps([STYLE_VERSION, spec], sort_keys=True).encode()).hexdigest()
+
+
+def render(spec: Dict, path: str) -> str:
+    plt = _pyplot()
+    plt.figure(figsize=(8, 6))
+    colors = plt.cm.tab10.colors
+    for idx, (name, (x, y)) in enumerate(spec["series"].items()):
+        plt.plot(x, y, label=name, color=colors[idx % len(colors)], marker="o")
+    plt.xlabel(spec["xlabel"])
+    plt.ylabel(spec["ylabel"])
+    plt.title(spec["title"])
+    plt.legend()
+    plt.grid(visible=True, which="both", linestyle="--", linewidth=0.5)
+    plt.savefig(path)
+    plt.close()
+    return path
+
+
+def generate(db_path: str, out_dir: str, groups: Optional[Sequence[str]] = None, models: Optional[Sequence[str]] = None,
+             run_ids: Optional[Sequence[str]] = None, jobs: Optional[int] = None, force: bool = False) -> Dict[str, int]:
+    """Renders the changed figures of ``groups`` (default: all) into ``out_dir``."""
+    store = ResultsStore(db_path)
+    specs = figure_specs(store, groups or store.groups(), models, run_ids)
+    os.makedirs(out_dir, exist_ok=True)
+    cache_path = os.path.join(out_dir, CACHE_NAME)
+    cache = {}
+    if os.path.exists(cache_path) and not force:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    todo = []
+    for spec in specs:
+        path = os.path.join(out_dir, spec["filename"])
+        digest = spec_digest(spec)
+        if cache.get(spec["filename"]) != digest or not os.path.exists(path):
+            todo.append((spec, path, digest))
+    if todo:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for path in pool.map(render, [t[0] for t in todo], [t[1] for t in todo]):
+                print(f"Info: Plot saved to '{path}'.")
+    cache.update({spec["filename"]: digest for spec, _, digest in todo})
+    with open(cache_path, "w") as f:
+        json.dump(cache, f, indent=2)
+    return {"figures": len(specs), "rendered": len(todo), "cached": len(specs) - len(todo)}
+
+
+def plot_training_time(times_dict, save_path="training_time.png"):
+    """
+    Plot a bar chart comparing total training time for different experiments.
+    Args:
+        times_dict (dict): Dictionary with experiment names as keys and training time (in seconds) as values.
+        save_path (str): File path to save the plot.
+    """
+    plt = _pyplot()
+    plot_output_dir = os.path.dirname(save_path)
+    if plot_output_dir and not os.path.exists(plot_output_dir):
+        os.makedirs(plot_output_dir, exist_ok=True)
+    plt.figure(figsize=(8, 6))
+    plt.bar(times_dict.keys(), times_dict.values(), color=['blue', 'orange'])
+    plt.xlabel("Experiments")
+    plt.ylabel("Training Time (seconds)")
+    plt.title("Total Training Time Comparison")
+    plt.savefig(save_path)
+    print(f"Training time plot saved to {save_path}")
+    plt.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render accuracy/time, samples and tau figures from the results store")
+    parser.add_argument("results", type=str, help=f"Results directory (containing {DB_NAME}) or database file")
+    parser.add_argument("--out", type=str, default=None, help="Figure directory (default: <results dir>/report)")
+    parser.add_argument("--groups", nargs="+", default=None, help="Results groups, e.g. mobilenet_v2 (default: all)")
+    parser.add_argument("--models", nargs="+", default=None, help="Only these model names")
+    parser.add_argument("--runs", nargs="+", default=None, help="Only these run ids")
+    parser.add_argument("--jobs", type=int, default=None, help="Rendering processes (default: one per CPU)")
+    parser.add_argument("--force", action="store_true", help="Ignore the figure cache")
+    args = parser.parse_args()
+    db_path = os.path.join(args.results, DB_NAME) if os.path.isdir(args.results) else args.results
+    out_dir = args.out or os.path.join(os.path.dirname(db_path) or ".", "report")
+    counts = generate(db_path, out_dir, args.groups, args.models, args.runs, args.jobs, args.force)
+    print(f"{counts['figures']} figures in {out_dir}: {counts['rendered']} rendered, {counts['cached']} unchanged")
@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+import zlib
+from array import array
+from contextlib import closing
+from typing import Dict, List, Optional, Sequence
+
+# Append-only store of per-epoch run results, one SQLite database (WAL mode) per results
+# directory. Every training process is a run (``configure_run``), keyed by a run id and the hash
+# of its configuration; each (run, results group, model name) gets one row per epoch and split.
+# Concurrent sweep workers only ever insert or fill in their own rows, so nothing they write
+# can be clobbered, and the plots query the latest run of every model instead of rewriting a
+# shared JSON file (report.py renders the figures offline).
+
+DB_NAME = "results.sqlite"
+# per-epoch columns; writers may fill them in separately (NULL = not recorded)
+COLUMNS = ("accuracy", "loss", "time", "cumulative_time", "samples_used", "tau", "flops", "rss_peak_mb", "cuda_peak_mb")
+# options that only control instrumentation or output locations, not the result
+_UNHASHED = {"save_path", "timeline", "timeline_sync", "profile_epochs", "profile_steps", "track_memory", "trace_malloc",
+             "metrics_port", "metrics_host", "metrics_textfile", "score_histogram_bins"}
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    run_key INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    config_hash TEXT,
+    group_name TEXT NOT NULL,
+    model_name TEXT NOT NULL,
+    created REAL NOT NULL,
+    config TEXT,
+    UNIQUE (run_id, group_name, model_name)
+);
+CREATE INDEX IF NOT EXISTS runs_group ON runs (group_name, model_name, created);
+CREATE INDEX IF NOT EXISTS runs_config ON runs (config_hash);
+CREATE TABLE IF NOT EXISTS epochs (
+    run_key INTEGER NOT NULL REFERENCES runs (run_key),
+    split TEXT NOT NULL,
+    epoch INTEGER NOT NULL,
+    {", ".join(f"{c} REAL" for c in COLUMNS)},
+    PRIMARY KEY (run_key, split, epoch)
+);
+CREATE TABLE IF NOT EXISTS histograms (
+    run_key INTEGER NOT NULL REFERENCES runs (run_key),
+    epoch INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    low REAL NOT NULL,
+    high REAL NOT NULL,
+    bins INTEGER NOT NULL,
+    classes INTEGER NOT NULL,
+    counts BLOB NOT NULL,
+    PRIMARY KEY (run_key, epoch, kind)
+);
+"""
+
+_run = {"run_id": None, "config": {}, "config_hash": None}
+
+
+def config_hash(config: Dict) -> str:
+    relevant = {k: v for k, v in config.items() if k not in _UNHASHED}
+    return hashlib.sha1(json.dumps(relevant, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def configure_run(config: Dict, run_id: Optional[str] = None) -> str:
+    """Names the run of this process; ``RUN_ID`` in the environment takes precedence."""
+    _run["run_id"] = run_id or os.environ.get("RUN_ID") or f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    _run["config"] = dict(config)
+    _run["config_hash"] = config_hash(config)
+    return _run["run_id"]
+
+
+def current_run() -> str:
+    if _run["run_id"] is None:
+        configure_run({})
+    return _run["run_id"]
+
+
+def store_location(data_file: str):
+    """(database path, group name) replacing the legacy per-group JSON file ``data_file``."""
+    if os.path.isdir(data_file):
+        return os.path.join(data_file, DB_NAME), "model_data.json"
+    return os.path.join(os.path.dirname(data_file) or ".", DB_NAME), os.path.basename(data_file)
+
+
+class ResultsStore:
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(_SCHEMA)
+            # databases written before a column was added get it as all NULL
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(epochs)")}
+            for column in COLUMNS:
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE epochs ADD COLUMN {column} REAL")
+
+    def _connect(self) -> sqlite3.Connection:
+        # used as ``with closing(self._connect()) as conn, conn:`` (commit, then close)
+        conn = sqlite3.connect(self.path, timeout=60)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _run_key(self, conn, group: str, model_name: str, run_id: Optional[str], config: Optional[Dict]) -> int:
+        if run_id is None:
+            run_id, config, digest = current_run(), _run["config"], _run["config_hash"]
+        else:
+            digest = config_hash(config) if config is not None else None
+        conn.execute("INSERT OR IGNORE INTO runs (run_id, config_hash, group_name, model_name, created, config) "
+                     "VALUES (?, ?, ?, ?, ?, ?)",
+                     (run_id, digest, group, model_name, time.time(), json.dumps(config or {}, default=str)))
+        return conn.execute("SELECT run_key FROM runs WHERE run_id = ? AND group_name = ? AND model_name = ?",
+                            (run_id, group, model_name)).fetchone()[0]
+
+    def log_epochs(self, group: str, model_name: str, split: str, run_id: Optional[str] = None,
+                   config: Optional[Dict] = None, **columns: Sequence[float]):
+        """
+        Records per-epoch values (``columns``: lists indexed by epoch, see ``COLUMNS``) of
+        ``model_name`` for the current run. Values already recorded for other columns are kept.
+        """
+        unknown = set(columns) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown result columns {sorted(unknown)}, choose from {COLUMNS}")
+        names = list(columns)
+        rows = []
+        for epoch in range(max((len(v) for v in columns.values()), default=0)):
+            rows.append([epoch] + [float(columns[c][epoch]) if epoch < len(columns[c]) and columns[c][epoch] is not None
+                                   else None for c in names])
+        updates = ", ".join(f"{c} = COALESCE(excluded.{c}, {c})" for c in names)
+        with closing(self._connect()) as conn, conn:
+            run_key = self._run_key(conn, group, model_name, run_id, config)
+            conn.executemany(f"INSERT INTO epochs (run_key, split, epoch, {', '.join(names)}) "
+                             f"VALUES (?, ?, ?, {', '.join('?' * len(names))}) "
+                             f"ON CONFLICT (run_key, split, epoch) DO UPDATE SET {updates}",
+                             [[run_key, split] + row for row in rows])
+
+    def log_histograms(self, group: str, model_name: str, records: Sequence[Dict], run_id: Optional[str] = None,
+                       config: Optional[Dict] = None):
+        """
+        Records per-epoch score histograms (``score_histograms.ScoreHistogram`` records) of
+        ``model_name``; the (classes x bins) counts are kept as zlib-compressed int64 arrays.
+        """
+        rows = []
+        for record in records:
+            for kind, counts in record["counts"].items():
+                flat = array("q", [c for row in counts for c in row])
+                low, high = record["ranges"][kind]
+                rows.append((record["epoch"], kind, low, high, record["bins"], record["classes"],
+                             zlib.compress(flat.tobytes())))
+        with closing(self._connect()) as conn, conn:
+            run_key = self._run_key(conn, group, model_name, run_id, config)
+            conn.executemany("INSERT OR REPLACE INTO histograms (run_key, epoch, kind, low, high, bins, classes, counts) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [(run_key,) + row for row in rows])
+
+    def histograms(self, group: str, model_name: str, run_id: Optional[str] = None) -> List[Dict]:
+        """Score histograms of the latest run (or ``run_id``) of ``model_name``, per epoch and kind."""
+        query = ("SELECT h.epoch, h.kind, h.low, h.high, h.bins, h.classes, h.counts FROM histograms h "
+                 "JOIN runs r ON r.run_key = h.run_key WHERE r.group_name = ? AND r.model_name = ? AND r.run_key = "
+                 "(SELECT run_key FROM runs q WHERE q.group_name = r.group_name AND q.model_name = r.model_name "
+                 "AND EXISTS (SELECT 1 FROM histograms e WHERE e.run_key = q.run_key)"
+                 + (" AND q.run_id = ?" if run_id is not None else "") + " ORDER BY q.created DESC LIMIT 1) "
+                 "ORDER BY h.epoch, h.kind")
+        params = [group, model_name] + ([run_id] if run_id is not None else [])
+        out = []
+        with closing(self._connect()) as conn, conn:
+            for epoch, kind, low, high, bins, classes, blob in conn.execute(query, params):
+                flat = array("q")
+                flat.frombytes(zlib.decompress(blob))
+                per_class = [flat[c * bins:(c + 1) * bins].tolist() for c in range(classes)]
+                out.append(dict(epoch=epoch, kind=kind, low=low, high=high, bins=bins, per_class=per_class,
+                                overall=[sum(column) for column in zip(*per_class)]))
+        return out
+
+    def groups(self) -> List[str]:
+        with closing(self._connect()) as conn, conn:
+            return [row[0] for row in conn.execute("SELECT DISTINCT group_name FROM runs ORDER BY group_name")]
+
+    def curves(self, group: str, split: str, columns: Sequence[str] = ("cumulative_time", "accuracy"),
+               models: Optional[Sequence[str]] = None,
+               run_ids: Optional[Sequence[str]] = None) -> Dict[str, Dict[str, List[float]]]:
+        """Per model name of ``group``: the columns of its latest run (among ``run_ids``) that recorded ``split``."""
+        query = ("SELECT r.model_name, r.run_key FROM runs r WHERE r.group_name = ? AND EXISTS "
+                 "(SELECT 1 FROM epochs e WHERE e.run_key = r.run_key AND e.split = ?)")
+        params = [group, split]
+        if run_ids is not None:
+            query += f" AND r.run_id IN ({', '.join('?' * len(run_ids))})"
+            params += list(run_ids)
+        out: Dict[str, Dict[str, List[float]]] = {}
+        with closing(self._connect()) as conn, conn:
+            latest: Dict[str, int] = {}
+            for model_name, run_key in conn.execute(query + " ORDER BY r.created", params):
+                latest[model_name] = run_key  # ordered by first appearance, last run wins
+            for model_name, run_key in latest.items():
+                if models is not None and model_name not in models:
+                    continue
+                rows = conn.execute(f"SELECT {', '.join(columns)} FROM epochs WHERE run_key = ? AND split = ? "
+                                    f"ORDER BY epoch", (run_key, split)).fetchall()
+                out[model_name] = {c: [row[i] for row in rows] for i, c in enumerate(columns)}
+        return out
+
+    def runs(self, group: Optional[str] = None, model_name: Optional[str] = None,
+             config_hash: Optional[str] = None) -> List[Dict]:
+        """Runs matching the filters with their epoch count and best / final test accuracy."""
+        where, params = [], []
+        for column, value in (("r.group_name", group), ("r.model_name", model_name), ("r.config_hash", config_hash)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        query = ("SELECT r.run_id, r.config_hash, r.group_name, r.model_name, r.created, "
+                 "COUNT(e.epoch), MAX(e.accuracy), "
+                 "(SELECT accuracy FROM epochs f WHERE f.run_key = r.run_key AND f.split = 'test' ORDER BY f.epoch DESC LIMIT 1) "
+                 "FROM runs r LEFT JOIN epochs e ON e.run_key = r.run_key AND e.split = 'test' "
+                 + (f"WHERE {' AND '.join(where)} " if where else "") + "GROUP BY r.run_key ORDER BY r.created")
+        keys = ("run_id", "config_hash", "group", "model_name", "created", "test_epochs", "best_test_accuracy",
+                "final_test_accuracy")
+        with closing(self._connect()) as conn, conn:
+            return [dict(zip(keys, row)) for row in conn.execute(query, params)]
+
+    def import_legacy_json(self, path: str) -> int:
+        """Imports a ``{model: {cumulative_time, accuracy}}`` file written by the old plot functions."""
+        with open(path) as f:
+            data = json.load(f)
+        name = os.path.basename(path)
+        group, split = (name[:-len("_test")], "test") if name.endswith("_test") else (name, "train")
+        run_id = "legacy-" + hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]
+        for model_name, curves in data.items():
+            cumulative = curves.get("cumulative_time", [])
+            epoch_time = [t - p for t, p in zip(cumulative, [0.0] + cumulative[:-1])]
+            self.log_epochs(group, model_name, split, run_id=run_id, config={"legacy_file": path},
+                            accuracy=curves.get("accuracy", []), cumulative_time=cumulative, time=epoch_time)
+        return len(data)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query or fill the per-directory results store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    runs_parser = sub.add_parser("runs", help="List runs with their best and final test accuracy")
+    runs_parser.add_argument("db", type=str, help=f"Path to a {DB_NAME} file")
+    runs_parser.add_argument("--group", type=str, default=None)
+    runs_parser.add_argument("--model", type=str, default=None)
+    runs_parser.add_argument("--config-hash", dest="config_hash", type=str, default=None)
+    hist_parser = sub.add_parser("histograms", help="Print the per-epoch score histograms of a model (train_with_revision)")
+    hist_parser.add_argument("db", type=str, help=f"Path to a {DB_NAME} file")
+    hist_parser.add_argument("--group", type=str, required=True)
+    hist_parser.add_argument("--model", type=str, required=True)
+    hist_parser.add_argument("--run", type=str, default=None, help="Run id (default: the latest run with histograms)")
+    hist_parser.add_argument("--kind", type=str, choices=["prob", "margin"], default="prob")
+    import_parser = sub.add_parser("import", help="Import legacy JSON result files (e.g. cifar10_results/mobilenet_v2_test)")
+    import_parser.add_argument("files", nargs="+", type=str)
+    args = parser.parse_args()
+
+    if args.command == "runs":
+        for run in ResultsStore(args.db).runs(args.group, args.model, args.config_hash):
+            best = f"{run['best_test_accuracy']:.4f}" if run["best_test_accuracy"] is not None else "-"
+            final = f"{run['final_test_accuracy']:.4f}" if run["final_test_accuracy"] is not None else "-"
+            print(f"{run['run_id']:<28} {run['config_hash'] or '-':<16} {run['group']:<24} {run['model_name']:<48} "
+                  f"epochs {run['test_epochs']:>4}  best {best}  final {final}")
+    elif args.command == "histograms":
+        for h in ResultsStore(args.db).histograms(args.group, args.model, args.run):
+            if h["kind"] != args.kind:
+                continue
+            total = sum(h["overall"]) or 1
+            print(f"epoch {h['epoch'] + 1:>3} [{h['low']:g}, {h['high']:g}] "
+                  + " ".join(f"{c / total:.3f}" for c in h["overall"]) + f"  ({total} samples)")
+    else:
+        for path in args.files:
+            db_path = os.path.join(os.path.dirname(path) or ".", DB_NAME)
+            count = ResultsStore(db_path).import_legacy_json(path)
+            print(f"Imported {count} models from {path} into {db_path}")
@@ -0,0 +1,70 @@
+from typing import Dict, List, Optional
+
+import torch
+import torch.distributed as dist
+
+from distributed import is_distributed
+
+# Per-epoch difficulty distributions for choosing --tau-min / --tau-max and the threshold
+# scheduler. The logits of the DBPD scoring pass are turned into the correct-class probability
+# p_y and the signed margin p_y - max_{j != y} p_j (negative = misclassified), which are binned
+# into fixed bins per true class with one bincount on the device. Nothing is copied to the host
+# before the end of the epoch, and no forward runs only for the histograms.
+
+# kind -> (low, high) of the bins
+RANGES = {"prob": (0.0, 1.0), "margin": (-1.0, 1.0)}
+
+
+def prob_and_margin(logits: torch.Tensor, labels: torch.Tensor):
+    """(p_y, p_y - max_{j != y} p_j) from the two largest logits, without a softmax matrix."""
+    logits = logits.float()
+    lse = torch.logsumexp(logits, dim=1)
+    true_logit = logits.gather(1, labels.view(-1, 1)).squeeze(1)
+    top2, top2_idx = torch.topk(logits, k=2, dim=1)
+    # the best other class is the runner-up when the true class is on top
+    other_logit = torch.where(top2_idx[:, 0] == labels, top2[:, 1], top2[:, 0])
+    prob = torch.exp(true_logit - lse)
+    return prob, prob - torch.exp(other_logit - lse)
+
+
+class ScoreHistogram:
+    """Fixed-bin histograms of p_y and of the margin per true class, sized on the first batch."""
+
+    def __init__(self, bins: int = 20):
+        self.bins = bins
+        self.records: List[Dict] = []
+        self._counts: Dict[str, torch.Tensor] = {}
+        self._classes = 0
+        self._scored = 0
+
+    def add(self, logits: torch.Tensor, labels: torch.Tensor):
+        if logits.dim() != 2 or logits.size(0) == 0:
+            return
+        if not self._counts:
+            self._classes = logits.size(1)
+            self._counts = {kind: torch.zeros(self._classes * self.bins, dtype=torch.long, device=logits.device)
+                            for kind in RANGES}
+        values = dict(zip(("prob", "margin"), prob_and_margin(logits.detach(), labels)))
+        offsets = labels * self.bins
+        for kind, (low, high) in RANGES.items():
+            index = ((values[kind] - low) / (high - low) * self.bins).long().clamp_(0, self.bins - 1)
+            self._counts[kind] += torch.bincount(offsets + index, minlength=self._classes * self.bins)
+        self._scored += labels.size(0)
+
+    def end_epoch(self, epoch: int) -> Optional[Dict]:
+        """Closes the epoch (summed over ranks); None if nothing was scored."""
+        if not self._scored:  # epochs without scoring (the same on every rank)
+            return None
+        self._scored = 0
+        record = dict(epoch=epoch, bins=self.bins, classes=self._classes, ranges=dict(RANGES), counts={})
+        for kind, counts in self._counts.items():
+            if is_distributed():
+                dist.all_reduce(counts)
+            record["counts"][kind] = counts.view(self._classes, self.bins).tolist()
+            counts.zero_()
+        self.records.append(record)
+        prob = [sum(column) for column in zip(*record["counts"]["prob"])]
+        total = sum(prob) or 1
+        print(f"Epoch {epoch + 1} p_y histogram ({self.bins} bins on [0, 1]): "
+              + " ".join(f"{c / total:.2f}" for c in prob))
+        return record
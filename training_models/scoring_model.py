@@ -0,0 +1,101 @@
+import copy
+from typing import Callable, Dict, List
+
+import torch
+
+from distributed import unwrap_model
+
+SCORE_MODELS = ("live", "ema", "snapshot")
+
+
+class ScoringModel:
+    """
+    Model used to compute the DBPD masks.
+
+    ``live`` scores with the training weights themselves. ``ema`` keeps an exponential moving
+    average of them (``decay`` per optimizer step) and ``snapshot`` a copy refreshed every
+    ``snapshot_steps`` steps. Both decouple selection from the latest optimizer step, which is
+    what makes asynchronous or batched scoring possible.
+    """
+
+    def __init__(self, model: torch.nn.Module, kind: str = "live", ema_decay: float = 0.999,
+                 snapshot_steps: int = 100):
+        if kind not in SCORE_MODELS:
+            raise ValueError(f"Unknown scoring model '{kind}', choose from {SCORE_MODELS}")
+        self.model = model
+        self.kind = kind
+        self.ema_decay = ema_decay
+        self.snapshot_steps = max(1, snapshot_steps)
+        self._steps = 0
+        self.copy = None if kind == "live" else copy.deepcopy(unwrap_model(model))
+
+    @property
+    def module(self) -> torch.nn.Module:
+        """The network that produces the scores."""
+        return self.model if self.copy is None else self.copy
+
+    def __call__(self, inputs: torch.Tensor) -> torch.Tensor:
+        if self.copy is not None:
+            # same BatchNorm behaviour as scoring with the live model
+            self.copy.train(self.model.training)
+        return self.module(inputs)
+
+    @torch.no_grad()
+    def step(self):
+        """Call after every optimizer step."""
+        self._steps += 1
+        if self.copy is not None:
+            self.copy.train(self.model.training)
+        if self.kind == "ema":
+            live = unwrap_model(self.model).state_dict()
+            for name, value in self.copy.state_dict().items():
+                if value.dtype.is_floating_point:
+                    value.lerp_(live[name], 1.0 - self.ema_decay)
+                else:
+                    value.copy_(live[name])
+        elif self.kind == "snapshot" and self._steps % self.snapshot_steps == 0:
+            self.copy.load_state_dict(unwrap_model(self.model).state_dict())
+
+    def describe(self) -> Dict:
+        return {"score_model": self.kind, "ema_decay": self.ema_decay, "snapshot_steps": self.snapshot_steps}
+
+
+class MaskAgreementProbe:
+    """
+    Every ``every`` steps, re-scores the current batch with the live weights and records how well
+    the stale mask agrees with it: the fraction of samples with the same decision and the Jaccard
+    overlap of the two survivor sets.
+    """
+
+    def __init__(self, every: int = 50):
+        self.every = every
+        self.records: List[Dict] = []
+        self._steps = 0
+
+    @torch.no_grad()
+    def maybe_probe(self, epoch: int, live_model: torch.nn.Module, compute_mask: Callable,
+                    inputs: torch.Tensor, labels: torch.Tensor, mask: torch.Tensor):
+        """Probes every ``every``-th call, returns whether it ran the extra live forward."""
+        self._steps += 1
+        if self.every <= 0 or self._steps % self.every != 0:
+            return False
+        live_mask, _ = compute_mask(live_model(inputs), labels)
+        union = (live_mask | mask).sum().item()
+        self.records.append({
+            "epoch": epoch,
+            "step": self._steps,
+            "agreement": (live_mask == mask).float().mean().item(),
+            "jaccard": (live_mask & mask).sum().item() / union if union else 1.0,
+            "stale_survivors": int(mask.sum().item()),
+            "live_survivors": int(live_mask.sum().item()),
+        })
+        return True
+
+    def summary(self) -> Dict:
+        if not self.records:
+            return {"probes": 0}
+        return {
+            "probes": len(self.records),
+            "mean_agreement": sum(r["agreement"] for r in self.records) / len(self.records),
+            "mean_jaccard": sum(r["jaccard"] for r in self.records) / len(self.records),
+        }
@@ -0,0 +1,75 @@
+from typing import Callable, Dict, Tuple
+
+import torch
+
+# DBPD selection criteria on raw logits. The probabilities they need (true class, top-2 margin)
+# come from one logsumexp and a gather/topk, so no (batch x classes) probability matrix is
+# allocated; with ImageNet-1k or GPT-2 sized label spaces that matrix dominates the scoring pass.
+# Every criterion maps (logits, labels, threshold) to (mask of samples to train on, predictions).
+
+
+def correct_class_prob(logits: torch.Tensor, labels: torch.Tensor) -> torch.Tensor:
+    """softmax(logits)[i, labels[i]] without materializing the softmax."""
+    true_logit = logits.gather(1, labels.view(-1, 1)).squeeze(1)
+    return torch.exp(true_logit - torch.logsumexp(logits, dim=1))
+
+
+def top2_margin(logits: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """(p_top1 - p_top2, argmax) computed from the two largest logits."""
+    top2, top2_idx = torch.topk(logits, k=2, dim=1)
+    p1 = torch.exp(top2[:, 0] - torch.logsumexp(logits, dim=1))
+    # p2 = p1 * exp(l2 - l1)
+    return p1 * (1 - torch.exp(top2[:, 1] - top2[:, 0])), top2_idx[:, 0]
+
+
+def misclassified(logits, labels, threshold):
+    preds = torch.argmax(logits, dim=1)
+    return preds != labels, preds
+
+
+def low_confidence(logits, labels, threshold):
+    """True-class probability below ``threshold`` (plain misclassification for threshold 0)."""
+    if threshold == 0:
+        return misclassified(logits, labels, threshold)
+    return correct_class_prob(logits, labels) < threshold, torch.argmax(logits, dim=1)
+
+
+def relative_margin(logits, labels, threshold):
+    """Misclassified, or correct with a top-1/top-2 probability margin below ``threshold``."""
+    margin, preds = top2_margin(logits)
+    correct = preds == labels
+    return ~correct | (margin < threshold), preds
+
+
+def low_confidence_softmax(logits, labels, threshold):
+    # reference implementation (former TrainRevision._compute_mask), kept for bench_selection.py
+    preds = torch.argmax(logits, dim=1)
+    if threshold == 0:
+        return preds != labels, preds
+    prob = torch.softmax(logits, dim=1)
+    return prob[torch.arange(labels.size(0)), labels] < threshold, preds
+
+
+def relative_margin_softmax(logits, labels, threshold):
+    preds = torch.argmax(logits, dim=1)
+    top2_prob, _ = torch.topk(torch.softmax(logits, dim=1), k=2, dim=1)
+    margin = top2_prob[:, 0] - top2_prob[:, 1]
+    return (preds != labels) | ((preds == labels) & (margin < threshold)), preds
+
+
+SELECTION_CRITERIA: Dict[str, Callable] = {
+    "low_confidence": low_confidence,
+    "relative_margin": relative_margin,
+    "misclassified": misclassified,
+    "low_confidence_softmax": low_confidence_softmax,
+    "relative_margin_softmax": relative_margin_softmax,
+}
+
+
+def criterion_for(threshold_method: str, name: str = None) -> Callable:
+    """Explicit criterion ``name``, or the one implied by the threshold method."""
+    if name is None:
+        name = "relative_margin" if threshold_method == "relative" else "low_confidence"
+    if name not in SELECTION_CRITERIA:
+        raise ValueError(f"Unknown selection criterion '{name}', choose from {sorted(SELECTION_CRITERIA)}")
+    return SELECTION_CRITERIA[name]
@@ -3,32 +3,31 @@ import torch.nn as nn
 import torch.optim as optim
 from torch.optim.lr_scheduler import ReduceLROnPlateau, StepLR
 import time
-from utils import log_memory, plot_metrics, plot_metrics_test, plot_accuracy_time_multi, plot_accuracy_time_multi_test
+from utils import log_histograms, log_memory, log_results, record_accuracy_time
 from tqdm import tqdm
 import json
 import os
 import numpy as np
 import torch.nn.functional as F
 from collections import defaultdict
-
-def focal_loss(input_values, gamma):
-    """Computes the focal loss"""
-    p = torch.exp(-input_values)
-    loss = (1 - p) ** gamma * input_values
-    return loss.mean()
-
-class FocalLoss(nn.Module):
-    def __init__(self, weight=None, gamma=0.):
-        super(FocalLoss, self).__init__()
-        assert gamma >= 0
-        self.gamma = gamma
-        self.weight = weight
-
-    def forward(self, input, target):
-        return focal_loss(F.cross_entropy(input, target, reduction='none', weight=self.weight), self.gamma)
+from compaction import SurvivorCompactor, CompactedDataset
+from async_scoring import AsyncScorer
+from scoring_model import MaskAgreementProbe, ScoringModel
+from early_exit import EarlyExitModel
+from longtail_loss import FocalLoss, drw_weights
+from selection import correct_class_prob, criterion_for
+from instrumentation import MemoryTracker, Timeline
+from score_histograms import ScoreHistogram
+from flops import FlopAccountant
+from distributed import all_gather_indices, distribute_loader, gather_log, get_rank, get_world_size, is_distributed, is_main_process, rebalance, reduce_sum, unwrap_model
 
 class TrainRevision:
-    def __init__(self, model_name, model, train_loader, test_loader, device, epochs, save_path, threshold, threshold_scheduler=None, threshold_method: str = "fixed"):
+    def __init__(self, model_name, model, train_loader, test_loader, device, epochs, save_path, threshold, threshold_scheduler=None, threshold_method: str = "fixed", compact_dir=None,
+                 async_scoring=False, score_refresh_steps=50, score_queue_size=4,
+                 score_model="live", score_ema_decay=0.999, score_snapshot_steps=100, score_probe_steps=50,
+                 score_batch_size=None, early_exit_threshold=None, selection_criterion=None,
+                 timeline=False, timeline_sync=False, track_memory=False, trace_malloc=False, metrics_exporter=None,
+                 score_histogram_bins=20):
         self.model_name = model_name
         self.model = model
         self.train_loader = train_loader
@@ -39,32 +38,132 @@ class TrainRevision:
         self.threshold = threshold
         self.threshold_scheduler = threshold_scheduler
         self.threshold_method = threshold_method
+        # directory for contiguous hard-set segments (train_with_alternative), None disables compaction
+        self.compact_dir = compact_dir
+        # score batches in a background thread with a weight snapshot (train_with_revision)
+        self.async_scoring = async_scoring
+        self.score_refresh_steps = score_refresh_steps
+        self.score_queue_size = score_queue_size
+        # weights used for scoring (train_with_revision): live, EMA or a periodic snapshot
+        self.score_model_kind = score_model
+        self.score_ema_decay = score_ema_decay
+        self.score_snapshot_steps = score_snapshot_steps
+        self.score_probe_steps = score_probe_steps
+        # rows per no-grad scoring forward (train_with_revision, train_with_alternative), None uses the training batch size
+        self.score_batch_size = score_batch_size
+        # with an EarlyExitModel, scoring stops at the first exit this confident (train_with_revision)
+        self.early_exit_threshold = early_exit_threshold
+        # name in selection.SELECTION_CRITERIA, None derives it from threshold_method
+        self.selection_criterion = selection_criterion
+        # per-phase step timeline (train_with_revision), disabled until a training run opens one
+        self.timeline_enabled = timeline
+        self.timeline_sync = timeline_sync
+        self.timeline = Timeline()
+        # memory peaks per epoch and phase (train_with_revision), off unless requested (--trace-malloc implies it)
+        self.track_memory = track_memory or trace_malloc
+        self.trace_malloc = trace_malloc
+        self.memory = MemoryTracker(enabled=False)
+        # live metrics (metrics_exporter.MetricsExporter) fed by the timeline and memory records of train_with_revision
+        self.metrics_exporter = metrics_exporter
+        # per-epoch p_y / margin histograms of the scoring pass (train_with_revision), 0 bins disables them
+        self.score_histogram_bins = score_histogram_bins
+        self.score_histogram = None
         self.val_loss_hist = []
         self.grad_norm_hist = []
         # initialize with starting tau so history is non-empty
         self.tau_hist = [threshold]
 
     def _compute_mask(self, outputs, labels):
-        preds = torch.argmax(outputs, dim=1)
-        if self.threshold_method == "relative":
-            prob = torch.softmax(outputs, dim=1)
-            top2_prob, top2_idx = torch.topk(prob, k=2, dim=1)
-            top1_prob = top2_prob[:, 0]
-            top2_prob_val = top2_prob[:, 1]
-            miscls_mask = preds != labels
-            correct_top1_mask = preds == labels
-            margin = top1_prob - top2_prob_val
-            rel_mask = correct_top1_mask & (margin < self.threshold)
-            mask = miscls_mask | rel_mask
-            return mask, preds
-        else:
-            if self.threshold == 0:
-                mask = preds != labels
-            else:
-                prob = torch.softmax(outputs, dim=1)
-                correct_class = prob[torch.arange(labels.size(0)), labels]
-                mask = correct_class < self.threshold
-            return mask, preds
+        # see selection.py, the criteria work on logits without a full softmax
+        return criterion_for(self.threshold_method, self.selection_criterion)(outputs, labels, self.threshold)
+
+    def _scoring_mask(self, outputs, labels):
+        """``_compute_mask`` of the scoring pass, whose logits also feed the epoch's score histograms."""
+        mask, preds = self._compute_mask(outputs, labels)
+        if self.score_histogram is not None:
+            self.score_histogram.add(outputs, labels)
+        return mask, preds
+
+    def _scored_batches(self, loader, scorer=None, score_model=None):
+        """
+        Yields (batch_idx, batch, inputs, labels, mask, preds) for one pass over ``loader``.
+        With an ``AsyncScorer`` the masks come from its background thread, otherwise each batch
+        is scored right before it is trained on, with ``score_model`` or the live model.
+        """
+        if scorer is not None:
+            yield from scorer.batches(loader)
+            return
+        score_model = score_model if score_model is not None else self.model
+        exit_net = self._early_exit_net(score_model)
+        for batch_idx, batch in enumerate(loader):
+            with self.timeline.phase("data"):
+                inputs, labels = batch[0].to(self.device), batch[1].to(self.device)
+            with torch.no_grad(), self.timeline.phase("score"), self.memory.phase("score"):
+                if exit_net is not None:
+                    outputs = exit_net.early_exit(inputs, self.early_exit_threshold)
+                else:
+                    outputs = score_model(inputs)
+                mask, preds = self._scoring_mask(outputs, labels)
+            yield batch_idx, batch, inputs, labels, mask, preds
+
+    def _early_exit_net(self, score_model):
+        """The ``EarlyExitModel`` behind ``score_model`` if early-exit scoring is enabled."""
+        net = unwrap_model(score_model.module if isinstance(score_model, ScoringModel) else score_model)
+        if self.early_exit_threshold is None or not isinstance(net, EarlyExitModel):
+            return None
+        return net
+
+    def _aux_loss(self, criterion, labels):
+        """Loss of the early-exit heads for the last training forward (0 for plain models)."""
+        net = unwrap_model(self.model)
+        return net.aux_loss(criterion, labels) if isinstance(net, EarlyExitModel) else 0.0
+
+    def _score_chunks(self, loader, chunk_batches):
+        """
+        Concatenates ``chunk_batches`` consecutive loader batches, so that the no-grad scoring
+        forward runs at the scoring batch size instead of the training batch size.
+        """
+        pending = []
+        for batch in loader:
+            pending.append(batch)
+            if len(pending) == chunk_batches:
+                yield [torch.cat(parts) for parts in zip(*pending)]
+                pending = []
+        if pending:
+            yield [torch.cat(parts) for parts in zip(*pending)]
+
+    def _survivor_batches(self, inputs, labels, mask, batch_size=None):
+        """
+        Survivors of a scored chunk as a list of training batches of about ``batch_size`` rows
+        (empty if the step has to be skipped). Without ``batch_size`` the survivors form a single
+        batch, as in ``_select``. Under DDP every rank gets the same number of batches.
+        """
+        inputs, labels = self._select(inputs, labels, mask)
+        if inputs is None:
+            return []
+        if batch_size is None:
+            return [(inputs, labels)]
+        # rebalanced shares differ by at most one row, so splitting by the smallest share keeps
+        # every batch non-empty on every rank
+        smallest_share = max(1, int(reduce_sum(inputs.size(0))) // get_world_size())
+        steps = -(-smallest_share // batch_size)
+        return list(zip(torch.tensor_split(inputs, steps), torch.tensor_split(labels, steps)))
+
+    def _select(self, inputs, labels, selection):
+        """
+        Rows of the batch picked by ``selection`` (mask or indices), or (None, None) if the step
+        has to be skipped. Under DDP the survivors are rebalanced across ranks first, so that
+        all ranks train on equally sized batches and skip the same steps.
+        """
+        inputs, labels = rebalance(inputs[selection], labels[selection])
+        if inputs.size(0) == 0:
+            return None, None
+        return inputs, labels
+
+    def _log_flops(self, flops):
+        """Saves flops.json next to ``save_path`` and the per-epoch totals to the results store."""
+        flops.save(os.path.join(os.path.dirname(self.save_path), "flops.json"))
+        log_results(self.model_name, "train", self.save_path, flops=[r["total_flops"] for r in flops.records])
 
     def train_selective(self):
         self.model.to(self.device)
@@ -79,6 +178,7 @@ class TrainRevision:
         epoch_test_losses = []
         time_per_epoch = []
         start_time = time.time()
+        flops = FlopAccountant(self.model, len(self.train_loader.dataset))
         for epoch in range(self.epochs):
             self.model.train()
             epoch_start_time = time.time()
@@ -90,26 +190,24 @@ class TrainRevision:
             print(f"Epoch [{epoch+1/self.epochs}]")
             progress_bar = tqdm(enumerate(self.train_loader), total=len(self.train_loader), desc="Training")
 
-            for batch_idx, (inputs, labels) in progress_bar:
+            for batch_idx, (inputs, labels, *_) in progress_bar:
                 inputs, labels = inputs.to(self.device), labels.to(self.device)
                 
                 with torch.no_grad():
                     outputs = self.model(inputs)
+                    flops.add("score", inputs)
                     preds = torch.argmax(outputs, dim=1)
                     
                     if self.threshold == 0:
                         mask = preds != labels
                     else:
-                        prob = torch.softmax(outputs, dim=1)
-                        correct_class = prob[torch.arange(labels.size(0)), labels]
+                        correct_class = correct_class_prob(outputs, labels)
                         mask = correct_class < self.threshold
 
-                if not mask.any():
+                inputs_misclassified, labels_misclassified = self._select(inputs, labels, mask)
+                if inputs_misclassified is None:
                     continue
 
-                inputs_misclassified = inputs[mask]
-                labels_misclassified = labels[mask]
-
                 # if inputs_misclassified.size(0) < 2:
                 #     continue
 
@@ -125,6 +223,7 @@ class TrainRevision:
                 optimizer.zero_grad()
 
                 outputs_misclassified = self.model(inputs_misclassified)
+                flops.add("train", inputs_misclassified)
                 # outputs_misclassified = outputs[mask]
                 loss = criterion(outputs_misclassified, labels_misclassified)
                 loss.backward()
@@ -161,6 +260,7 @@ class TrainRevision:
                     inputs = batch[0].to(self.device)
                     labels = batch[1].to(self.device)
                     outputs = self.model(inputs)
+                    flops.add("eval", inputs)
                     predictions = torch.argmax(outputs, dim=-1)
                     correct += (predictions == labels).sum().item()
                     total += labels.size(0)
@@ -172,26 +272,26 @@ class TrainRevision:
             scheduler.step(val_loss)
             epoch_test_accuracies.append(accuracy)
             epoch_test_losses.append(val_loss)
+            flops.end_epoch(epoch, test_accuracy=accuracy)
             
 
         end_time = time.time()
         log_memory(start_time, end_time)
+        self._log_flops(flops)
 
-        plot_metrics(epoch_losses, epoch_accuracies, "Selective Training")
-        plot_metrics_test(epoch_test_accuracies, "Selective Training")
-        # plot_accuracy_time(epoch_accuracies, time_per_epoch, title="Accuracy and Time per Epoch", save_path=save_path)
-        plot_accuracy_time_multi(
-        model_name= self.model_name,  
-        accuracy=epoch_accuracies,
-        time_per_epoch=time_per_epoch,  
-        save_path=save_path,
-        data_file=save_path
+        log_results(self.model_name, "train", save_path, loss=epoch_losses)
+        record_accuracy_time(
+            model_name=self.model_name,
+            split="train",
+            accuracy=epoch_accuracies,
+            time_per_epoch=time_per_epoch,
+            data_file=save_path
         )
-        plot_accuracy_time_multi_test(
-            model_name = self.model_name,
+        record_accuracy_time(
+            model_name=self.model_name,
+            split="test",
             accuracy=epoch_test_accuracies,
             time_per_epoch=time_per_epoch,
-            save_path=save_path,
             data_file=save_path
         )
 
@@ -211,6 +311,7 @@ class TrainRevision:
         accumulated_inputs = []
         accumulated_labels = []
         max_accumulated_samples = 128
+        flops = FlopAccountant(self.model, len(self.train_loader.dataset))
 
         for epoch in range(self.epochs):
             self.model.train()
@@ -222,20 +323,20 @@ class TrainRevision:
             print(f"Epoch [{epoch+1/self.epochs}]")
             progress_bar = tqdm(enumerate(self.train_loader), total=len(self.train_loader), desc="Training")
 
-            for batch_idx, (inputs, labels) in progress_bar:
+            for batch_idx, (inputs, labels, *_) in progress_bar:
                 inputs, labels = inputs.to(self.device), labels.to(self.device)
 
                 if epoch < self.epochs:
                     with torch.no_grad():
                         outputs = self.model(inputs)
+                        flops.add("score", inputs)
                         preds = torch.argmax(outputs, dim=1)
                         
                         if self.threshold == 0:
                             mask = preds != labels
                             mask_correct = preds == labels
                         else:
-                            prob = torch.softmax(outputs, dim=1)
-                            correct_class = prob[torch.arange(labels.size(0)), labels]
+                            correct_class = correct_class_prob(outputs, labels)
                             mask = correct_class < self.threshold
                             mask_correct = correct_class > self.threshold
 
@@ -249,21 +350,14 @@ class TrainRevision:
                         accumulated_inputs = []  
                         accumulated_labels = []
 
-                        inputs_selected = torch.cat((inputs, reintroduced_inputs), dim=0)
-                        labels_selected = torch.cat((labels, reintroduced_labels), dim=0)
+                        # one collective per step on every rank, like _select in the other branch
+                        inputs_selected, labels_selected = rebalance(torch.cat((inputs, reintroduced_inputs), dim=0),
+                                                                     torch.cat((labels, reintroduced_labels), dim=0))
 
                     else:
-                        if not mask.any():
+                        inputs_selected, labels_selected = self._select(inputs, labels, mask)
+                        if inputs_selected is None:
                             continue
-
-                        inputs_selected = inputs[mask]
-                        labels_selected = labels[mask]
-
-                    if not mask.any():
-                        continue
-
-                    inputs_selected = inputs[mask]
-                    labels_selected = labels[mask]
                 else:
                     if accumulated_inputs:
                         reintroduced_inputs = torch.cat(accumulated_inputs, dim=0).to(self.device)
@@ -281,6 +375,7 @@ class TrainRevision:
 
                 optimizer.zero_grad()
                 outputs_selected = self.model(inputs_selected)
+                flops.add("train", inputs_selected)
                 loss = criterion(outputs_selected, labels_selected)
                 loss.backward()
                 optimizer.step()
@@ -288,6 +383,7 @@ class TrainRevision:
                 running_loss += loss.item()
                 with torch.no_grad():
                     outputs = self.model(inputs)
+                    flops.add("extra", inputs)
                     preds = torch.argmax(outputs, dim=1)
                     total_correct += (preds == labels).sum().item()
                     total_samples += labels.size(0)
@@ -303,16 +399,18 @@ class TrainRevision:
             time_per_epoch.append(epoch_end_time - epoch_start_time)
 
             print(f"Epoch [{epoch+1}/{self.epochs}], Loss: {epoch_loss:.4f}, Accuracy: {epoch_accuracy:.4f}")
+            flops.end_epoch(epoch)
 
         end_time = time.time()
         log_memory(start_time, end_time)
+        self._log_flops(flops)
 
-        plot_metrics(epoch_losses, epoch_accuracies, "Selective Training with Reintroduction")
-        plot_accuracy_time_multi(
+        log_results(self.model_name, "train", save_path, loss=epoch_losses)
+        record_accuracy_time(
             model_name=self.model_name,
+            split="train",
             accuracy=epoch_accuracies,
             time_per_epoch=time_per_epoch,
-            save_path=save_path,
             data_file=save_path
         )
 
@@ -327,13 +425,8 @@ class TrainRevision:
             criterion = nn.CrossEntropyLoss()
         elif 'longtail':
             train_sampler = None
-            idx = self.epochs // 160
-            betas = [0, 0.9999]
-            effective_num = 1.0 - np.power(betas[idx], cls_num_list)
-            per_cls_weights = (1.0 - betas[idx]) / np.array(effective_num)
-            per_cls_weights = per_cls_weights / np.sum(per_cls_weights) * len(cls_num_list)
-            per_cls_weights = torch.FloatTensor(per_cls_weights).cuda(self.device)
-            criterion = FocalLoss(weight=per_cls_weights, gamma=1).cuda(self.device)
+            per_cls_weights = drw_weights(cls_num_list, 0, 160, self.device)
+            criterion = FocalLoss(weight=per_cls_weights, gamma=1).to(self.device)
         # optimizer = optim.SGD(self.model.parameters(), lr=0.1, momentum=0.9, weight_decay=0.0001)
         #as per implementation LR=0.045, they use 16 GPU. https://discuss.pytorch.org/t/training-mobilenet-on-imagenet/174391/6 from this blog
         #we use the idea to divide the learning rate by the number of GPUs. 
@@ -350,7 +443,32 @@ class TrainRevision:
         start_time = time.time()
         num_step = 0
         samples_used_per_epoch = []
+        score_model = ScoringModel(self.model, self.score_model_kind, self.score_ema_decay, self.score_snapshot_steps)
+        scorer = None
+        if self.async_scoring:
+            scorer = AsyncScorer(score_model.module, self._scoring_mask, self.device, self.score_refresh_steps, self.score_queue_size)
+        # stale masks are compared against the live weights now and then
+        probe = MaskAgreementProbe(self.score_probe_steps) if score_model.kind != "live" or scorer is not None else None
+        train_batch_size = self.train_loader.batch_size
+        chunk_batches = max(1, (self.score_batch_size or train_batch_size) // train_batch_size)
+        if chunk_batches > 1:
+            print(f"Scoring {chunk_batches} loader batches ({chunk_batches * train_batch_size} rows) per no-grad forward")
+        timeline_path = None
+        if self.timeline_enabled:
+            timeline_name = f"timeline_rank{get_rank()}.jsonl" if is_distributed() else "timeline.jsonl"
+            timeline_path = os.path.join(os.path.dirname(save_path), timeline_name)
+        self.timeline = Timeline(timeline_path, self.device, self.timeline_sync, exporter=self.metrics_exporter)
+        timeline = self.timeline
+        flops = FlopAccountant(self.model, len(self.train_loader.dataset))
+        self.memory = MemoryTracker(self.device, trace_python=self.trace_malloc, exporter=self.metrics_exporter,
+                                    enabled=self.track_memory)
+        memory = self.memory
+        self.score_histogram = ScoreHistogram(self.score_histogram_bins) if self.score_histogram_bins > 0 else None
+        epoch_taus = []
         for epoch in range(self.epochs):
+            if isinstance(criterion, FocalLoss):
+                # deferred re-weighting: class-balanced weights from epoch 160 on
+                criterion.weight = drw_weights(cls_num_list, epoch, 160, self.device)
             # Update dynamic threshold for DBPD
             if self.threshold_scheduler is not None:
                 state = {
@@ -360,6 +478,7 @@ class TrainRevision:
                 }
                 self.threshold = self.threshold_scheduler(epoch, state)
                 self.tau_hist.append(self.threshold)
+            epoch_taus.append(float(self.threshold))
             samples_used = 0
             epoch_grad_sq = 0.0
             epoch_grad_count = 0
@@ -372,56 +491,82 @@ class TrainRevision:
                 total_samples = 0
                 total = 0
                 print(f"Epoch [{epoch+1/self.epochs}]")
-                progress_bar = tqdm(enumerate(self.train_loader), total=len(self.train_loader), desc="Training")
+                scored_source = self._score_chunks(self.train_loader, chunk_batches) if chunk_batches > 1 else self.train_loader
+                if scorer is None:
+                    scored = self._scored_batches(timeline.timed(scored_source, "data"), None, score_model)
+                else:
+                    # loading and scoring happen in the scorer thread, only the wait is on the hot path
+                    scored = timeline.timed(self._scored_batches(scored_source, scorer, score_model), "score_wait")
+                progress_bar = tqdm(scored, total=-(-len(self.train_loader) // chunk_batches), desc="Training")
+                train_steps = 0
                 
-                for batch_idx, (inputs, labels) in progress_bar:
-                    batch_start_idx = batch_idx * self.train_loader.batch_size
-                    inputs, labels = inputs.to(self.device), labels.to(self.device)
-                    
-                    with torch.no_grad():
-                        outputs = self.model(inputs)
-                        mask, preds = self._compute_mask(outputs, labels)
-
-                    if not mask.any():
+                for batch_idx, batch, inputs, labels, mask, preds in progress_bar:
+                    batch_start_idx = batch_idx * train_batch_size * chunk_batches
+                    # datasets that yield their own sample ids (e.g. sharded ImageNet) keep the survival log exact
+                    sample_ids = batch[2] if len(batch) > 2 else None
+                    flops.add("score", inputs)
+                    if probe is not None:
+                        with timeline.phase("probe"):
+                            if probe.maybe_probe(epoch, self.model, self._compute_mask, inputs, labels, mask):
+                                flops.add("extra", inputs)
+
+                    with timeline.phase("select"):
+                        # survivors of a large scoring chunk are trained on in batches of the training size
+                        survivors = self._survivor_batches(inputs, labels, mask, train_batch_size if chunk_batches > 1 else None)
+                    if not survivors:
+                        timeline.step(epoch, samples=labels.size(0), survivors=0)
                         continue
 
-                    inputs_misclassified = inputs[mask]
-                    labels_misclassified = labels[mask]
-
-                    used_labels = labels_misclassified
-                    for label in used_labels.tolist():
-                        label_log[int(label)] += 1
-
-                    misclassified_in_batch = torch.nonzero(mask, as_tuple=False).squeeze(1)
-                    absolute_indices = (misclassified_in_batch + batch_start_idx).tolist()
-                    survival_log[epoch].extend(absolute_indices)
-
-                    optimizer.zero_grad()
-
-                    outputs_misclassified = self.model(inputs_misclassified)
-                    loss = criterion(outputs_misclassified, labels_misclassified)
-                    num_step+=len(outputs_misclassified)
-                    samples_used+=len(outputs_misclassified)
-                    loss.backward()
-                    # grad norm (for adaptive_grad)
-                    total_norm_sq = 0.0
-                    for p in self.model.parameters():
-                        if p.grad is not None:
-                            param_norm = p.grad.data.norm(2).item()
-                            total_norm_sq += param_norm * param_norm
-                    batch_grad_norm = total_norm_sq ** 0.5
-                    optimizer.step()
-                    # accumulate epoch grad norm
-                    epoch_grad_sq += batch_grad_norm * batch_grad_norm
-                    epoch_grad_count += 1
+                    with timeline.phase("select"):
+                        for _, used_labels in survivors:
+                            for label in used_labels.tolist():
+                                label_log[int(label)] += 1
 
-                    running_loss += loss.item()
+                        misclassified_in_batch = torch.nonzero(mask, as_tuple=False).squeeze(1)
+                        if sample_ids is not None:
+                            absolute_indices = sample_ids[misclassified_in_batch.cpu()].tolist()
+                        else:
+                            absolute_indices = (misclassified_in_batch + batch_start_idx).tolist()
+                        survival_log[epoch].extend(absolute_indices)
+
+                    for inputs_misclassified, labels_misclassified in survivors:
+                        with timeline.phase("forward"), memory.phase("train"):
+                            optimizer.zero_grad()
+
+                            outputs_misclassified = self.model(inputs_misclassified)
+                            loss = criterion(outputs_misclassified, labels_misclassified) + self._aux_loss(criterion, labels_misclassified)
+                        flops.add("train", inputs_misclassified)
+                        num_step+=len(outputs_misclassified)
+                        samples_used+=len(outputs_misclassified)
+                        with timeline.phase("backward"), memory.phase("train"):
+                            loss.backward()
+                        # grad norm (for adaptive_grad)
+                        with timeline.phase("grad_norm"):
+                            total_norm_sq = 0.0
+                            for p in self.model.parameters():
+                                if p.grad is not None:
+                                    param_norm = p.grad.data.norm(2).item()
+                                    total_norm_sq += param_norm * param_norm
+                            batch_grad_norm = total_norm_sq ** 0.5
+                        with timeline.phase("optimizer"), memory.phase("train"):
+                            optimizer.step()
+                            score_model.step()
+                            if scorer is not None:
+                                scorer.step()
+                        # accumulate epoch grad norm
+                        epoch_grad_sq += batch_grad_norm * batch_grad_norm
+                        epoch_grad_count += 1
+
+                        running_loss += loss.item()
+                        train_steps += 1
 
                     total_correct += (preds == labels).sum().item()
                     total_samples += labels.size(0)
                     progress_bar.set_postfix({"Loss": loss.item()})
+                    timeline.step(epoch, samples=labels.size(0), survivors=sum(len(l) for _, l in survivors))
 
-                epoch_loss = running_loss / len(self.train_loader)
+                # chunked scoring takes several steps per scored chunk, average over the steps taken
+                epoch_loss = running_loss / (len(self.train_loader) if chunk_batches == 1 else max(1, train_steps))
                 epoch_accuracy = total_correct/total_samples if total_samples > 0 else 0 
                 epoch_losses.append(epoch_loss)
                 epoch_accuracies.append(epoch_accuracy)
@@ -431,22 +576,28 @@ class TrainRevision:
 
                 print(f"Epoch [{epoch+1}/{self.epochs}], Loss: {epoch_loss:.4f}, Accuracy: {epoch_accuracy:.4f}")
 
-                self.model.eval()
-                correct = 0
-                total = 0
-                test_loss = 0.0
-                with torch.no_grad():
-                    for batch in tqdm(self.test_loader, desc="Evaluating"):
-                        inputs = batch[0].to(self.device)
-                        labels = batch[1].to(self.device)
-                        outputs = self.model(inputs)
+                # survivor-aware datasets stop reading samples dropped this epoch; full passes read everything
+                if hasattr(self.train_loader.dataset, "set_survivors"):
+                    self.train_loader.dataset.set_survivors(survival_log[epoch] if epoch + 1 < start_revision else None)
 
-                        batch_loss = criterion(outputs, labels)
-                        test_loss+=batch_loss.item()
+                with timeline.phase("eval"), memory.phase("eval"):
+                    self.model.eval()
+                    correct = 0
+                    total = 0
+                    test_loss = 0.0
+                    with torch.no_grad():
+                        for batch in tqdm(self.test_loader, desc="Evaluating"):
+                            inputs = batch[0].to(self.device)
+                            labels = batch[1].to(self.device)
+                            outputs = self.model(inputs)
+                            flops.add("eval", inputs)
 
-                        predictions = torch.argmax(outputs, dim=-1)
-                        correct += (predictions == labels).sum().item()
-                        total += labels.size(0)
+                            batch_loss = criterion(outputs, labels)
+                            test_loss+=batch_loss.item()
+
+                            predictions = torch.argmax(outputs, dim=-1)
+                            correct += (predictions == labels).sum().item()
+                            total += labels.size(0)
 
                 accuracy = correct / total
                 val_loss = test_loss / len(self.test_loader)
@@ -459,6 +610,11 @@ class TrainRevision:
                 if epoch_grad_count > 0:
                     mean_grad_norm = (epoch_grad_sq / max(1, epoch_grad_count)) ** 0.5
                     self.grad_norm_hist.append(mean_grad_norm)
+                timeline.end_epoch(epoch, revision=True, tau=float(self.threshold), train_loss=epoch_loss, test_accuracy=accuracy)
+                flops.end_epoch(epoch, revision=True, test_accuracy=accuracy)
+                memory.end_epoch(epoch, survival_log=survival_log, label_log=label_log)
+                if self.score_histogram is not None:
+                    self.score_histogram.end_epoch(epoch)
 
             else:
                 self.model.train()
@@ -467,32 +623,45 @@ class TrainRevision:
                 total = 0
 
                 print(f"Epoch [{epoch+1/self.epochs}]")
-                progress_bar = tqdm(enumerate(self.train_loader), total=len(self.train_loader), desc="Training")
+                progress_bar = tqdm(enumerate(timeline.timed(self.train_loader, "data")), total=len(self.train_loader), desc="Training")
 
 
-                for batch_idx, (inputs, labels) in progress_bar:
-                    inputs, labels = inputs.to(self.device), labels.to(self.device)
+                for batch_idx, batch in progress_bar:
+                    batch_start_idx = batch_idx * self.train_loader.batch_size
+                    with timeline.phase("data"):
+                        inputs, labels = batch[0].to(self.device), batch[1].to(self.device)
 
-                    optimizer.zero_grad()
+                    with timeline.phase("forward"), memory.phase("train"):
+                        optimizer.zero_grad()
 
-                    outputs = self.model(inputs)
-                    loss = criterion(outputs, labels)
-                    absolute_indices = list(range(batch_start_idx, batch_start_idx + inputs.size(0)))
+                        outputs = self.model(inputs)
+                        loss = criterion(outputs, labels) + self._aux_loss(criterion, labels)
+                    flops.add("train", inputs)
+                    if len(batch) > 2:
+                        absolute_indices = batch[2].tolist()
+                    else:
+                        absolute_indices = list(range(batch_start_idx, batch_start_idx + inputs.size(0)))
                     survival_log[epoch].extend(absolute_indices)
                     used_labels = labels
                     for label in used_labels.tolist():
                         label_log[int(label)] += 1
                     num_step+=len(outputs)
                     samples_used+=len(outputs)
-                    loss.backward()
-                    optimizer.step()
+                    with timeline.phase("backward"), memory.phase("train"):
+                        loss.backward()
+                    with timeline.phase("optimizer"), memory.phase("train"):
+                        optimizer.step()
+                        score_model.step()
 
                     running_loss += loss.item()
                     
-                    outputs = self.model(inputs)
-                    preds = torch.argmax(outputs, dim=1)
-                    correct += (preds == labels).sum().item()
-                    total += labels.size(0)
+                    with timeline.phase("metrics"):
+                        outputs = self.model(inputs)
+                        flops.add("extra", inputs)
+                        preds = torch.argmax(outputs, dim=1)
+                        correct += (preds == labels).sum().item()
+                        total += labels.size(0)
+                    timeline.step(epoch, samples=labels.size(0), survivors=labels.size(0))
 
                 epoch_loss = running_loss / len(self.train_loader)
                 epoch_accuracy = correct / total
@@ -504,22 +673,24 @@ class TrainRevision:
 
                 print(f"Epoch [{epoch+1}/{self.epochs}], Loss: {epoch_loss:.4f}, Accuracy: {epoch_accuracy:.4f}")
 
-                self.model.eval()
-                test_correct = 0
-                test_total = 0
-                test_loss = 0.0
-                with torch.no_grad():
-                    for batch in tqdm(self.test_loader, desc="Evaluating"):
-                        inputs = batch[0].to(self.device)
-                        labels = batch[1].to(self.device)
-                        outputs = self.model(inputs)
+                with timeline.phase("eval"), memory.phase("eval"):
+                    self.model.eval()
+                    test_correct = 0
+                    test_total = 0
+                    test_loss = 0.0
+                    with torch.no_grad():
+                        for batch in tqdm(self.test_loader, desc="Evaluating"):
+                            inputs = batch[0].to(self.device)
+                            labels = batch[1].to(self.device)
+                            outputs = self.model(inputs)
+                            flops.add("eval", inputs)
 
-                        batch_loss = criterion(outputs, labels)
-                        test_loss+=batch_loss.item()
+                            batch_loss = criterion(outputs, labels)
+                            test_loss+=batch_loss.item()
 
-                        predictions = torch.argmax(outputs, dim=-1)
-                        test_correct += (predictions == labels).sum().item()
-                        test_total += labels.size(0)
+                            predictions = torch.argmax(outputs, dim=-1)
+                            test_correct += (predictions == labels).sum().item()
+                            test_total += labels.size(0)
 
                 accuracy = test_correct / test_total
                 val_loss = test_loss / len(self.test_loader)
@@ -528,10 +699,28 @@ class TrainRevision:
                 epoch_test_accuracies.append(accuracy)
                 epoch_test_losses.append(val_loss)
                 self.val_loss_hist.append(val_loss)
+                timeline.end_epoch(epoch, revision=False, train_loss=epoch_loss, test_accuracy=accuracy)
+                flops.end_epoch(epoch, revision=False, test_accuracy=accuracy)
+                memory.end_epoch(epoch, survival_log=survival_log, label_log=label_log)
+                if self.score_histogram is not None:
+                    self.score_histogram.end_epoch(epoch)
             
-            samples_used_per_epoch.append(samples_used)
-
-
+            samples_used_per_epoch.append(reduce_sum(samples_used))
+
+
+        timeline.close()
+        flops.save(os.path.join(os.path.dirname(save_path), "flops.json"))
+        memory_name = f"memory_rank{get_rank()}.json" if is_distributed() else "memory.json"
+        memory.close(os.path.join(os.path.dirname(save_path), memory_name))
+        log_results(self.model_name, "train", save_path, loss=epoch_losses, tau=epoch_taus,
+                    flops=[r["total_flops"] for r in flops.records])
+        log_results(self.model_name, "test", save_path, loss=epoch_test_losses)
+        if memory.enabled:
+            # peaks of rank 0 under DDP (the other ranks are in their memory_rank{r}.json)
+            log_results(self.model_name, "train", save_path, rss_peak_mb=memory.peaks("rss_mb"),
+                        cuda_peak_mb=memory.peaks("cuda_allocated_mb"))
+        if self.score_histogram is not None:
+            log_histograms(self.model_name, save_path, self.score_histogram.records)
         end_time = time.time()
         log_memory(start_time, end_time)
         print(num_step)
@@ -541,32 +730,47 @@ class TrainRevision:
             f"({total_wall_time / 60:.2f} minutes)")
 
 
-        plot_accuracy_time_multi(
-        model_name=self.model_name,  
-        accuracy=epoch_accuracies,
-        time_per_epoch=time_per_epoch,  
-        save_path=save_path,
-        data_file=save_path
+        record_accuracy_time(
+            model_name=self.model_name,
+            split="train",
+            accuracy=epoch_accuracies,
+            time_per_epoch=time_per_epoch,
+            data_file=save_path
         )
-        plot_accuracy_time_multi_test(
-            model_name = self.model_name,
+        record_accuracy_time(
+            model_name=self.model_name,
+            split="test",
             accuracy=epoch_test_accuracies,
             time_per_epoch=time_per_epoch,
             samples_per_epoch=samples_used_per_epoch,
-            threshold=self.threshold,
-            save_path=save_path,
             data_file=save_path
         )
         
-        survival_log_path = os.path.join(os.path.dirname(save_path), "survival_log_eff.json")
-        with open(survival_log_path, "w") as f:
-            json.dump(dict(survival_log), f, indent=2)
-        print(f"Survival log saved to {survival_log_path}")
-
-        label_log_path = os.path.join(os.path.dirname(save_path), "label_log_eff.json")
-        with open(label_log_path, "w") as f:
-            json.dump(dict(label_log), f, indent=2)
-        print(f"Survival log saved to {label_log_path}")
+        exit_net = self._early_exit_net(score_model)
+        if exit_net is not None:
+            print(exit_net.exit_summary())
+
+        if probe is not None and is_main_process():
+            probe_path = os.path.join(os.path.dirname(save_path), "score_model_probes.json")
+            with open(probe_path, "w") as f:
+                json.dump(dict(score_model.describe(), async_scoring=scorer is not None,
+                               score_refresh_steps=self.score_refresh_steps,
+                               final_test_accuracy=epoch_test_accuracies[-1] if epoch_test_accuracies else None,
+                               **probe.summary(), records=probe.records), f, indent=2)
+            print(f"Mask agreement probes saved to {probe_path}")
+
+        survival_log = gather_log(survival_log)
+        label_log = gather_log(label_log)
+        if is_main_process():
+            survival_log_path = os.path.join(os.path.dirname(save_path), "survival_log_eff.json")
+            with open(survival_log_path, "w") as f:
+                json.dump(dict(survival_log), f, indent=2)
+            print(f"Survival log saved to {survival_log_path}")
+
+            label_log_path = os.path.join(os.path.dirname(save_path), "label_log_eff.json")
+            with open(label_log_path, "w") as f:
+                json.dump(dict(label_log), f, indent=2)
+            print(f"Survival log saved to {label_log_path}")
 
         return self.model, num_step
     
@@ -589,6 +793,7 @@ class TrainRevision:
 
         start_time = time.time()
         num_step = 0
+        flops = FlopAccountant(self.model, len(self.train_loader.dataset))
 
         for epoch in range(self.epochs):
             samples_used = 0
@@ -603,33 +808,32 @@ class TrainRevision:
 
                 progress_bar = tqdm(enumerate(self.train_loader), total=len(self.train_loader), desc="Training")
 
-                for batch_idx, (inputs, labels) in progress_bar:
+                for batch_idx, (inputs, labels, *_) in progress_bar:
                     inputs, labels = inputs.to(self.device), labels.to(self.device)
 
                     with torch.no_grad():
                         outputs = self.model(inputs)
+                        flops.add("score", inputs)
                         preds = torch.argmax(outputs, dim=1)
 
                         if self.threshold == 0:
                             mask = preds != labels
                         else:
-                            prob = torch.softmax(outputs, dim=1)
-                            correct_class = prob[torch.arange(labels.size(0)), labels]
+                            correct_class = correct_class_prob(outputs, labels)
                             mask = correct_class < self.threshold
 
                         num_to_select = mask.sum().item()
 
-                    # Skip batch if no samples pass threshold
-                    if num_to_select == 0:
-                        continue
-
                     # 🔁 Random sampling based on how many passed threshold
                     indices = torch.randperm(inputs.size(0))[:num_to_select]
-                    inputs_sampled = inputs[indices]
-                    labels_sampled = labels[indices]
+                    inputs_sampled, labels_sampled = self._select(inputs, labels, indices)
+                    # Skip batch if no samples pass threshold
+                    if inputs_sampled is None:
+                        continue
 
                     optimizer.zero_grad()
                     outputs_sampled = self.model(inputs_sampled)
+                    flops.add("train", inputs_sampled)
                     loss = criterion(outputs_sampled, labels_sampled)
 
                     loss.backward()
@@ -642,6 +846,7 @@ class TrainRevision:
                     # Stats on original batch
                     with torch.no_grad():
                         outputs = self.model(inputs)
+                        flops.add("extra", inputs)
                         preds = torch.argmax(outputs, dim=1)
                         total_correct += (preds == labels).sum().item()
                         total_samples += labels.size(0)
@@ -668,6 +873,7 @@ class TrainRevision:
                         inputs = batch[0].to(self.device)
                         labels = batch[1].to(self.device)
                         outputs = self.model(inputs)
+                        flops.add("eval", inputs)
 
                         batch_loss = criterion(outputs, labels)
                         test_loss += batch_loss.item()
@@ -691,11 +897,12 @@ class TrainRevision:
                 total = 0
 
                 progress_bar = tqdm(enumerate(self.train_loader), total=len(self.train_loader), desc="Training")
-                for batch_idx, (inputs, labels) in progress_bar:
+                for batch_idx, (inputs, labels, *_) in progress_bar:
                     inputs, labels = inputs.to(self.device), labels.to(self.device)
 
                     optimizer.zero_grad()
                     outputs = self.model(inputs)
+                    flops.add("train", inputs)
                     loss = criterion(outputs, labels)
 
                     loss.backward()
@@ -732,6 +939,7 @@ class TrainRevision:
                         inputs = batch[0].to(self.device)
                         labels = batch[1].to(self.device)
                         outputs = self.model(inputs)
+                        flops.add("eval", inputs)
 
                         batch_loss = criterion(outputs, labels)
                         test_loss += batch_loss.item()
@@ -747,27 +955,28 @@ class TrainRevision:
                 epoch_test_accuracies.append(accuracy)
                 epoch_test_losses.append(val_loss)
 
-            samples_used_per_epoch.append(samples_used)
+            flops.end_epoch(epoch, test_accuracy=accuracy)
+            samples_used_per_epoch.append(reduce_sum(samples_used))
 
         end_time = time.time()
         log_memory(start_time, end_time)
+        self._log_flops(flops)
         print(num_step)
 
         # Visualization
-        plot_accuracy_time_multi(
-            model_name=self.model_name,  
+        record_accuracy_time(
+            model_name=self.model_name,
+            split="train",
             accuracy=epoch_accuracies,
-            time_per_epoch=time_per_epoch,  
-            save_path=save_path,
+            time_per_epoch=time_per_epoch,
             data_file=save_path
         )
-        plot_accuracy_time_multi_test(
+        record_accuracy_time(
             model_name=self.model_name,
+            split="test",
             accuracy=epoch_test_accuracies,
             time_per_epoch=time_per_epoch,
             samples_per_epoch=samples_used_per_epoch,
-            threshold=self.threshold,
-            save_path=save_path,
             data_file=save_path
         )
 
@@ -790,6 +999,7 @@ class TrainRevision:
         time_per_epoch = []
         start_time = time.time()
         num_step = 0
+        flops = FlopAccountant(self.model, len(self.train_loader.dataset))
         samples_used_per_epoch = []
         for epoch in range(self.epochs):
             if self.threshold_scheduler is not None:
@@ -814,22 +1024,22 @@ class TrainRevision:
                 print(f"Epoch [{epoch+1/self.epochs}]")
                 progress_bar = tqdm(enumerate(self.train_loader), total=len(self.train_loader), desc="Training")
                 
-                for batch_idx, (inputs, labels) in progress_bar:
+                for batch_idx, (inputs, labels, *_) in progress_bar:
                     inputs, labels = inputs.to(self.device).float(), labels.to(self.device).long().view(-1)
                     
                     with torch.no_grad():
                         outputs = self.model(inputs)
+                        flops.add("score", inputs)
                         mask, preds = self._compute_mask(outputs, labels)
 
-                    if not mask.any():
+                    inputs_misclassified, labels_misclassified = self._select(inputs, labels, mask)
+                    if inputs_misclassified is None:
                         continue
 
-                    inputs_misclassified = inputs[mask]
-                    labels_misclassified = labels[mask]
-
                     optimizer.zero_grad()
 
                     outputs_misclassified = self.model(inputs_misclassified)
+                    flops.add("train", inputs_misclassified)
                     loss = criterion(outputs_misclassified, labels_misclassified)
                     num_step+=len(outputs_misclassified)
                     samples_used+=len(outputs_misclassified)
@@ -869,6 +1079,7 @@ class TrainRevision:
                         inputs = batch[0].to(self.device).float()
                         labels = batch[1].to(self.device).long().view(-1)
                         outputs = self.model(inputs)
+                        flops.add("eval", inputs)
 
                         batch_loss = criterion(outputs, labels)
                         test_loss+=batch_loss.item()
@@ -898,12 +1109,13 @@ class TrainRevision:
                 progress_bar = tqdm(enumerate(self.train_loader), total=len(self.train_loader), desc="Training")
 
 
-                for batch_idx, (inputs, labels) in progress_bar:
+                for batch_idx, (inputs, labels, *_) in progress_bar:
                     inputs, labels = inputs.to(self.device).float(), labels.to(self.device).long().view(-1)
 
                     optimizer.zero_grad()
 
                     outputs = self.model(inputs)
+                    flops.add("train", inputs)
                     loss = criterion(outputs, labels)
                     num_step+=len(outputs)
                     samples_used+=len(outputs)
@@ -913,6 +1125,7 @@ class TrainRevision:
                     running_loss += loss.item()
                     
                     outputs = self.model(inputs)
+                    flops.add("extra", inputs)
                     preds = torch.argmax(outputs, dim=1)
                     correct += (preds == labels).sum().item()
                     total += labels.size(0)
@@ -936,6 +1149,7 @@ class TrainRevision:
                         inputs = batch[0].to(self.device).float()
                         labels = batch[1].to(self.device).long().view(-1)
                         outputs = self.model(inputs)
+                        flops.add("eval", inputs)
 
                         batch_loss = criterion(outputs, labels)
                         test_loss+=batch_loss.item()
@@ -952,32 +1166,31 @@ class TrainRevision:
                 epoch_test_losses.append(val_loss)
                 self.val_loss_hist.append(val_loss)
             
-            samples_used_per_epoch.append(samples_used)
+            flops.end_epoch(epoch, test_accuracy=accuracy)
+            samples_used_per_epoch.append(reduce_sum(samples_used))
 
 
         end_time = time.time()
         log_memory(start_time, end_time)
+        self._log_flops(flops)
         print(num_step)
 
 
 
 
-        # plot_metrics(epoch_losses, epoch_accuracies, "Revision")
-        # plot_metrics_test(epoch_test_accuracies, "Revision Test")
-        plot_accuracy_time_multi(
-        model_name=self.model_name,  
-        accuracy=epoch_accuracies,
-        time_per_epoch=time_per_epoch,  
-        save_path=save_path,
-        data_file=save_path
+        record_accuracy_time(
+            model_name=self.model_name,
+            split="train",
+            accuracy=epoch_accuracies,
+            time_per_epoch=time_per_epoch,
+            data_file=save_path
         )
-        plot_accuracy_time_multi_test(
-            model_name = self.model_name,
+        record_accuracy_time(
+            model_name=self.model_name,
+            split="test",
             accuracy=epoch_test_accuracies,
             time_per_epoch=time_per_epoch,
             samples_per_epoch=samples_used_per_epoch,
-            threshold=self.threshold,
-            save_path=save_path,
             data_file=save_path
         )
 
@@ -999,6 +1212,7 @@ class TrainRevision:
         time_per_epoch = []
         samples_used_per_epoch = []
         num_step = 0
+        flops = FlopAccountant(self.model, len(self.train_loader.dataset))
         start_time = time.time()
 
         for epoch in range(self.epochs):
@@ -1016,7 +1230,7 @@ class TrainRevision:
 
             if epoch < start_revision:
                 decay_factor = 0.99 ** epoch  ##percentage to be sampled
-                for batch_idx, (inputs, labels) in progress_bar:
+                for batch_idx, (inputs, labels, *_) in progress_bar:
                     inputs, labels = inputs.to(self.device), labels.to(self.device)
                     batch_size = inputs.size(0)
                     selected_count = int(decay_factor * batch_size)
@@ -1030,6 +1244,7 @@ class TrainRevision:
 
                     optimizer.zero_grad()
                     outputs = self.model(inputs_selected)
+                    flops.add("train", inputs_selected)
                     loss = criterion(outputs, labels_selected)
                     num_step += selected_count
                     samples_used += selected_count
@@ -1038,16 +1253,18 @@ class TrainRevision:
 
                     running_loss += loss.item()
                     with torch.no_grad():
+                        flops.add("extra", inputs)
                         preds = torch.argmax(self.model(inputs), dim=1)
                         total_correct += (preds == labels).sum().item()
                         total_samples += labels.size(0)
 
                     progress_bar.set_postfix({"Loss": loss.item()})
             else:
-                for batch_idx, (inputs, labels) in progress_bar:
+                for batch_idx, (inputs, labels, *_) in progress_bar:
                     inputs, labels = inputs.to(self.device), labels.to(self.device)
                     optimizer.zero_grad()
                     outputs = self.model(inputs)
+                    flops.add("train", inputs)
                     loss = criterion(outputs, labels)
                     num_step += inputs.size(0)
                     samples_used += inputs.size(0)
@@ -1081,6 +1298,7 @@ class TrainRevision:
                     inputs = batch[0].to(self.device)
                     labels = batch[1].to(self.device)
                     outputs = self.model(inputs)
+                    flops.add("eval", inputs)
                     batch_loss = criterion(outputs, labels)
                     test_loss += batch_loss.item()
                     predictions = torch.argmax(outputs, dim=-1)
@@ -1093,27 +1311,28 @@ class TrainRevision:
             scheduler.step(val_loss)
             epoch_test_accuracies.append(accuracy)
             epoch_test_losses.append(val_loss)
-            samples_used_per_epoch.append(samples_used)
+            flops.end_epoch(epoch, test_accuracy=accuracy)
+            samples_used_per_epoch.append(reduce_sum(samples_used))
 
         end_time = time.time()
         log_memory(start_time, end_time)
+        self._log_flops(flops)
         print(num_step)
 
-        plot_accuracy_time_multi(
+        record_accuracy_time(
             model_name=self.model_name,
+            split="train",
             accuracy=epoch_accuracies,
             time_per_epoch=time_per_epoch,
-            save_path=save_path,
-            data_file=save_path,
+            data_file=save_path
         )
-        plot_accuracy_time_multi_test(
+        record_accuracy_time(
             model_name=self.model_name,
+            split="test",
             accuracy=epoch_test_accuracies,
             time_per_epoch=time_per_epoch,
             samples_per_epoch=samples_used_per_epoch,
-            threshold=self.threshold,
-            save_path=save_path,
-            data_file=save_path,
+            data_file=save_path
         )
 
         return self.model, num_step
@@ -1141,6 +1360,7 @@ class TrainRevision:
         time_per_epoch = []
         samples_used_per_epoch = []
         num_step = 0
+        flops = FlopAccountant(self.model, len(self.train_loader.dataset))
         alpha=2
         start_time = time.time()
 
@@ -1162,7 +1382,7 @@ class TrainRevision:
                 scaled_value = self.inverse_linear(epoch + 1, alpha)  # epoch+1 to match 1-based indexing
                 sample_ratio = scaled_value / data_size
 
-                for batch_idx, (inputs, labels) in progress_bar:
+                for batch_idx, (inputs, labels, *_) in progress_bar:
                     inputs, labels = inputs.to(self.device), labels.to(self.device)
                     batch_size = inputs.size(0)
                     selected_count = int(sample_ratio * batch_size)
@@ -1176,6 +1396,7 @@ class TrainRevision:
 
                     optimizer.zero_grad()
                     outputs = self.model(inputs_selected)
+                    flops.add("train", inputs_selected)
                     loss = criterion(outputs, labels_selected)
                     num_step += selected_count
                     samples_used += selected_count
@@ -1184,16 +1405,18 @@ class TrainRevision:
 
                     running_loss += loss.item()
                     with torch.no_grad():
+                        flops.add("extra", inputs)
                         preds = torch.argmax(self.model(inputs), dim=1)
                         total_correct += (preds == labels).sum().item()
                         total_samples += labels.size(0)
 
                     progress_bar.set_postfix({"Loss": loss.item()})
             else:
-                for batch_idx, (inputs, labels) in progress_bar:
+                for batch_idx, (inputs, labels, *_) in progress_bar:
                     inputs, labels = inputs.to(self.device), labels.to(self.device)
                     optimizer.zero_grad()
                     outputs = self.model(inputs)
+                    flops.add("train", inputs)
                     loss = criterion(outputs, labels)
                     num_step += inputs.size(0)
                     samples_used += inputs.size(0)
@@ -1227,6 +1450,7 @@ class TrainRevision:
                     inputs = batch[0].to(self.device)
                     labels = batch[1].to(self.device)
                     outputs = self.model(inputs)
+                    flops.add("eval", inputs)
                     batch_loss = criterion(outputs, labels)
                     test_loss += batch_loss.item()
                     predictions = torch.argmax(outputs, dim=-1)
@@ -1239,27 +1463,28 @@ class TrainRevision:
             scheduler.step(val_loss)
             epoch_test_accuracies.append(accuracy)
             epoch_test_losses.append(val_loss)
-            samples_used_per_epoch.append(samples_used)
+            flops.end_epoch(epoch, test_accuracy=accuracy)
+            samples_used_per_epoch.append(reduce_sum(samples_used))
 
         end_time = time.time()
         log_memory(start_time, end_time)
+        self._log_flops(flops)
         print(num_step)
 
-        plot_accuracy_time_multi(
+        record_accuracy_time(
             model_name=self.model_name,
+            split="train",
             accuracy=epoch_accuracies,
             time_per_epoch=time_per_epoch,
-            save_path=save_path,
-            data_file=save_path,
+            data_file=save_path
         )
-        plot_accuracy_time_multi_test(
+        record_accuracy_time(
             model_name=self.model_name,
+            split="test",
             accuracy=epoch_test_accuracies,
             time_per_epoch=time_per_epoch,
             samples_per_epoch=samples_used_per_epoch,
-            threshold=self.threshold,
-            save_path=save_path,
-            data_file=save_path,
+            data_file=save_path
         )
 
         return self.model, num_step
@@ -1285,6 +1510,7 @@ class TrainRevision:
         time_per_epoch = []
         samples_used_per_epoch = []
         num_step = 0
+        flops = FlopAccountant(self.model, len(self.train_loader.dataset))
         alpha=2
         start_time = time.time()
 
@@ -1306,7 +1532,7 @@ class TrainRevision:
                 scaled_value = self.log_schedule(epoch + 1, data_size, alpha)  # epoch+1 to match 1-based indexing
                 sample_ratio = scaled_value / data_size
 
-                for batch_idx, (inputs, labels) in progress_bar:
+                for batch_idx, (inputs, labels, *_) in progress_bar:
                     inputs, labels = inputs.to(self.device), labels.to(self.device)
                     batch_size = inputs.size(0)
                     selected_count = int(sample_ratio * batch_size)
@@ -1320,6 +1546,7 @@ class TrainRevision:
 
                     optimizer.zero_grad()
                     outputs = self.model(inputs_selected)
+                    flops.add("train", inputs_selected)
                     loss = criterion(outputs, labels_selected)
                     num_step += selected_count
                     samples_used += selected_count
@@ -1328,16 +1555,18 @@ class TrainRevision:
 
                     running_loss += loss.item()
                     with torch.no_grad():
+                        flops.add("extra", inputs)
                         preds = torch.argmax(self.model(inputs), dim=1)
                         total_correct += (preds == labels).sum().item()
                         total_samples += labels.size(0)
 
                     progress_bar.set_postfix({"Loss": loss.item()})
             else:
-                for batch_idx, (inputs, labels) in progress_bar:
+                for batch_idx, (inputs, labels, *_) in progress_bar:
                     inputs, labels = inputs.to(self.device), labels.to(self.device)
                     optimizer.zero_grad()
                     outputs = self.model(inputs)
+                    flops.add("train", inputs)
                     loss = criterion(outputs, labels)
                     num_step += inputs.size(0)
                     samples_used += inputs.size(0)
@@ -1371,6 +1600,7 @@ class TrainRevision:
                     inputs = batch[0].to(self.device)
                     labels = batch[1].to(self.device)
                     outputs = self.model(inputs)
+                    flops.add("eval", inputs)
                     batch_loss = criterion(outputs, labels)
                     test_loss += batch_loss.item()
                     predictions = torch.argmax(outputs, dim=-1)
@@ -1383,27 +1613,28 @@ class TrainRevision:
             scheduler.step(val_loss)
             epoch_test_accuracies.append(accuracy)
             epoch_test_losses.append(val_loss)
-            samples_used_per_epoch.append(samples_used)
+            flops.end_epoch(epoch, test_accuracy=accuracy)
+            samples_used_per_epoch.append(reduce_sum(samples_used))
 
         end_time = time.time()
         log_memory(start_time, end_time)
+        self._log_flops(flops)
         print(num_step)
 
-        plot_accuracy_time_multi(
+        record_accuracy_time(
             model_name=self.model_name,
+            split="train",
             accuracy=epoch_accuracies,
             time_per_epoch=time_per_epoch,
-            save_path=save_path,
-            data_file=save_path,
+            data_file=save_path
         )
-        plot_accuracy_time_multi_test(
+        record_accuracy_time(
             model_name=self.model_name,
+            split="test",
             accuracy=epoch_test_accuracies,
             time_per_epoch=time_per_epoch,
             samples_per_epoch=samples_used_per_epoch,
-            threshold=self.threshold,
-            save_path=save_path,
-            data_file=save_path,
+            data_file=save_path
         )
 
         return self.model, num_step 
@@ -1416,13 +1647,8 @@ class TrainRevision:
             criterion = nn.CrossEntropyLoss()
         elif 'longtail':
             train_sampler = None
-            idx = self.epochs // 160
-            betas = [0, 0.9999]
-            effective_num = 1.0 - np.power(betas[idx], cls_num_list)
-            per_cls_weights = (1.0 - betas[idx]) / np.array(effective_num)
-            per_cls_weights = per_cls_weights / np.sum(per_cls_weights) * len(cls_num_list)
-            per_cls_weights = torch.FloatTensor(per_cls_weights).cuda(self.device)
-            criterion = FocalLoss(weight=per_cls_weights, gamma=1).cuda(self.device)
+            per_cls_weights = drw_weights(cls_num_list, 0, 160, self.device)
+            criterion = FocalLoss(weight=per_cls_weights, gamma=1).to(self.device)
         # optimizer = optim.SGD(self.model.parameters(), lr=0.1, momentum=0.9, weight_decay=0.0001)
         #as per implementation LR=0.045, they use 16 GPU. https://discuss.pytorch.org/t/training-mobilenet-on-imagenet/174391/6 from this blog
         #we use the idea to divide the learning rate by the number of GPUs. 
@@ -1436,9 +1662,13 @@ class TrainRevision:
         time_per_epoch = []
         start_time = time.time()
         num_step = 0
+        flops = FlopAccountant(self.model, len(self.train_loader.dataset))
         samples_used_per_epoch = []
         init_threshold = self.threshold
         for epoch in range(self.epochs):
+            if isinstance(criterion, FocalLoss):
+                # deferred re-weighting: class-balanced weights from epoch 160 on
+                criterion.weight = drw_weights(cls_num_list, epoch, 160, self.device)
             samples_used = 0
             
             self.threshold = self.threshold + (epoch // interval)*increment
@@ -1455,22 +1685,22 @@ class TrainRevision:
                 print(f"Epoch [{epoch+1/self.epochs}]")
                 progress_bar = tqdm(enumerate(self.train_loader), total=len(self.train_loader), desc="Training")
                 
-                for batch_idx, (inputs, labels) in progress_bar:
+                for batch_idx, (inputs, labels, *_) in progress_bar:
                     inputs, labels = inputs.to(self.device), labels.to(self.device)
                     
                     with torch.no_grad():
                         outputs = self.model(inputs)
+                        flops.add("score", inputs)
                         mask, preds = self._compute_mask(outputs, labels)
 
-                    if not mask.any():
+                    inputs_misclassified, labels_misclassified = self._select(inputs, labels, mask)
+                    if inputs_misclassified is None:
                         continue
 
-                    inputs_misclassified = inputs[mask]
-                    labels_misclassified = labels[mask]
-
                     optimizer.zero_grad()
 
                     outputs_misclassified = self.model(inputs_misclassified)
+                    flops.add("train", inputs_misclassified)
                     loss = criterion(outputs_misclassified, labels_misclassified)
                     num_step+=len(outputs_misclassified)
                     samples_used+=len(outputs_misclassified)
@@ -1502,6 +1732,7 @@ class TrainRevision:
                         inputs = batch[0].to(self.device)
                         labels = batch[1].to(self.device)
                         outputs = self.model(inputs)
+                        flops.add("eval", inputs)
 
                         batch_loss = criterion(outputs, labels)
                         test_loss+=batch_loss.item()
@@ -1527,12 +1758,13 @@ class TrainRevision:
                 progress_bar = tqdm(enumerate(self.train_loader), total=len(self.train_loader), desc="Training")
 
 
-                for batch_idx, (inputs, labels) in progress_bar:
+                for batch_idx, (inputs, labels, *_) in progress_bar:
                     inputs, labels = inputs.to(self.device), labels.to(self.device)
 
                     optimizer.zero_grad()
 
                     outputs = self.model(inputs)
+                    flops.add("train", inputs)
                     loss = criterion(outputs, labels)
                     num_step+=len(outputs)
                     samples_used+=len(outputs)
@@ -1542,6 +1774,7 @@ class TrainRevision:
                     running_loss += loss.item()
                     
                     outputs = self.model(inputs)
+                    flops.add("extra", inputs)
                     preds = torch.argmax(outputs, dim=1)
                     correct += (preds == labels).sum().item()
                     total += labels.size(0)
@@ -1565,6 +1798,7 @@ class TrainRevision:
                         inputs = batch[0].to(self.device)
                         labels = batch[1].to(self.device)
                         outputs = self.model(inputs)
+                        flops.add("eval", inputs)
 
                         batch_loss = criterion(outputs, labels)
                         test_loss+=batch_loss.item()
@@ -1580,11 +1814,13 @@ class TrainRevision:
                 epoch_test_accuracies.append(accuracy)
                 epoch_test_losses.append(val_loss)
             
-            samples_used_per_epoch.append(samples_used)
+            flops.end_epoch(epoch, test_accuracy=accuracy)
+            samples_used_per_epoch.append(reduce_sum(samples_used))
 
 
         end_time = time.time()
         log_memory(start_time, end_time)
+        self._log_flops(flops)
         print(num_step)
 
         total_wall_time = end_time - start_time
@@ -1592,20 +1828,19 @@ class TrainRevision:
             f"({total_wall_time / 60:.2f} minutes)")
 
 
-        plot_accuracy_time_multi(
-        model_name=self.model_name,  
-        accuracy=epoch_accuracies,
-        time_per_epoch=time_per_epoch,  
-        save_path=save_path,
-        data_file=save_path
+        record_accuracy_time(
+            model_name=self.model_name,
+            split="train",
+            accuracy=epoch_accuracies,
+            time_per_epoch=time_per_epoch,
+            data_file=save_path
         )
-        plot_accuracy_time_multi_test(
-            model_name = self.model_name,
+        record_accuracy_time(
+            model_name=self.model_name,
+            split="test",
             accuracy=epoch_test_accuracies,
             time_per_epoch=time_per_epoch,
             samples_per_epoch=samples_used_per_epoch,
-            threshold=self.threshold,
-            save_path=save_path,
             data_file=save_path
         )
 
@@ -1619,13 +1854,8 @@ class TrainRevision:
             criterion = nn.CrossEntropyLoss()
         elif 'longtail':
             train_sampler = None
-            idx = self.epochs // 160
-            betas = [0, 0.9999]
-            effective_num = 1.0 - np.power(betas[idx], cls_num_list)
-            per_cls_weights = (1.0 - betas[idx]) / np.array(effective_num)
-            per_cls_weights = per_cls_weights / np.sum(per_cls_weights) * len(cls_num_list)
-            per_cls_weights = torch.FloatTensor(per_cls_weights).cuda(self.device)
-            criterion = FocalLoss(weight=per_cls_weights, gamma=1).cuda(self.device)
+            per_cls_weights = drw_weights(cls_num_list, 0, 160, self.device)
+            criterion = FocalLoss(weight=per_cls_weights, gamma=1).to(self.device)
         # optimizer = optim.SGD(self.model.parameters(), lr=0.1, momentum=0.9, weight_decay=0.0001)
         #as per implementation LR=0.045, they use 16 GPU. https://discuss.pytorch.org/t/training-mobilenet-on-imagenet/174391/6 from this blog
         #we use the idea to divide the learning rate by the number of GPUs. 
@@ -1639,8 +1869,12 @@ class TrainRevision:
         time_per_epoch = []
         start_time = time.time()
         num_step = 0
+        flops = FlopAccountant(self.model, len(self.train_loader.dataset))
         samples_used_per_epoch = []
         for epoch in range(self.epochs):
+            if isinstance(criterion, FocalLoss):
+                # deferred re-weighting: class-balanced weights from epoch 160 on
+                criterion.weight = drw_weights(cls_num_list, epoch, 160, self.device)
             if self.threshold_scheduler is not None:
                 state = {
                     "val_loss_hist": self.val_loss_hist,
@@ -1668,24 +1902,23 @@ class TrainRevision:
                     
                     with torch.no_grad():
                         outputs = self.model(inputs)
+                        flops.add("score", inputs)
                         preds = torch.argmax(outputs, dim=1)
                         
                         if self.threshold == 0:
                             mask = preds != labels
                         else:
-                            prob = torch.softmax(outputs, dim=1)
-                            correct_class = prob[torch.arange(labels.size(0)), labels]
+                            correct_class = correct_class_prob(outputs, labels)
                             mask = correct_class < self.threshold
 
-                    if not mask.any():
+                    inputs_misclassified, labels_misclassified = self._select(inputs, labels, mask)
+                    if inputs_misclassified is None:
                         continue
 
-                    inputs_misclassified = inputs[mask]
-                    labels_misclassified = labels[mask]
-
                     optimizer.zero_grad()
 
                     outputs_misclassified = self.model(inputs_misclassified)
+                    flops.add("train", inputs_misclassified)
                     loss = criterion(outputs_misclassified, labels_misclassified)
                     num_step+=len(outputs_misclassified)
                     samples_used+=len(outputs_misclassified)
@@ -1725,6 +1958,7 @@ class TrainRevision:
                         inputs = batch[0].to(self.device)
                         labels = batch[1].to(self.device)
                         outputs = self.model(inputs)
+                        flops.add("eval", inputs)
 
                         batch_loss = criterion(outputs, labels)
                         test_loss+=batch_loss.item()
@@ -1760,6 +1994,7 @@ class TrainRevision:
                     optimizer.zero_grad()
 
                     outputs = self.model(inputs)
+                    flops.add("train", inputs)
                     loss = criterion(outputs, labels)
                     num_step+=len(outputs)
                     samples_used+=len(outputs)
@@ -1769,6 +2004,7 @@ class TrainRevision:
                     running_loss += loss.item()
                     
                     outputs = self.model(inputs)
+                    flops.add("extra", inputs)
                     preds = torch.argmax(outputs, dim=1)
                     correct += (preds == labels).sum().item()
                     total += labels.size(0)
@@ -1792,6 +2028,7 @@ class TrainRevision:
                         inputs = batch[0].to(self.device)
                         labels = batch[1].to(self.device)
                         outputs = self.model(inputs)
+                        flops.add("eval", inputs)
 
                         batch_loss = criterion(outputs, labels)
                         test_loss+=batch_loss.item()
@@ -1808,11 +2045,13 @@ class TrainRevision:
                 epoch_test_losses.append(val_loss)
                 self.val_loss_hist.append(val_loss)
             
-            samples_used_per_epoch.append(samples_used)
+            flops.end_epoch(epoch, test_accuracy=accuracy)
+            samples_used_per_epoch.append(reduce_sum(samples_used))
 
 
         end_time = time.time()
         log_memory(start_time, end_time)
+        self._log_flops(flops)
         print(num_step)
 
         total_wall_time = end_time - start_time
@@ -1820,20 +2059,19 @@ class TrainRevision:
             f"({total_wall_time / 60:.2f} minutes)")
 
 
-        plot_accuracy_time_multi(
-        model_name=self.model_name,  
-        accuracy=epoch_accuracies,
-        time_per_epoch=time_per_epoch,  
-        save_path=save_path,
-        data_file=save_path
+        record_accuracy_time(
+            model_name=self.model_name,
+            split="train",
+            accuracy=epoch_accuracies,
+            time_per_epoch=time_per_epoch,
+            data_file=save_path
         )
-        plot_accuracy_time_multi_test(
-            model_name = self.model_name,
+        record_accuracy_time(
+            model_name=self.model_name,
+            split="test",
             accuracy=epoch_test_accuracies,
             time_per_epoch=time_per_epoch,
             samples_per_epoch=samples_used_per_epoch,
-            threshold=self.threshold,
-            save_path=save_path,
             data_file=save_path
         )
 
@@ -1847,13 +2085,8 @@ class TrainRevision:
             criterion = nn.CrossEntropyLoss()
         elif 'longtail':
             train_sampler = None
-            idx = self.epochs // 160
-            betas = [0, 0.9999]
-            effective_num = 1.0 - np.power(betas[idx], cls_num_list)
-            per_cls_weights = (1.0 - betas[idx]) / np.array(effective_num)
-            per_cls_weights = per_cls_weights / np.sum(per_cls_weights) * len(cls_num_list)
-            per_cls_weights = torch.FloatTensor(per_cls_weights).cuda(self.device)
-            criterion = FocalLoss(weight=per_cls_weights, gamma=1).cuda(self.device)
+            per_cls_weights = drw_weights(cls_num_list, 0, 160, self.device)
+            criterion = FocalLoss(weight=per_cls_weights, gamma=1).to(self.device)
         # optimizer = optim.SGD(self.model.parameters(), lr=0.1, momentum=0.9, weight_decay=0.0001)
         #as per implementation LR=0.045, they use 16 GPU. https://discuss.pytorch.org/t/training-mobilenet-on-imagenet/174391/6 from this blog
         #we use the idea to divide the learning rate by the number of GPUs. 
@@ -1867,8 +2100,21 @@ class TrainRevision:
         time_per_epoch = []
         start_time = time.time()
         num_step = 0
+        flops = FlopAccountant(self.model, len(self.train_loader.dataset))
         samples_used_per_epoch = []
+        compact_dir = self.compact_dir
+        if compact_dir and is_distributed():
+            compact_dir = os.path.join(compact_dir, f"rank{get_rank()}")
+        compactor = SurvivorCompactor(self.train_loader.dataset, compact_dir) if compact_dir else None
+        # score in dataset order so that the cached indices are real sample ids; under DDP every
+        # rank scores a strided share and the hard sets are exchanged afterwards
+        score_ids = list(range(get_rank(), len(self.train_loader.dataset), get_world_size()))
+        scoring_set = torch.utils.data.Subset(self.train_loader.dataset, score_ids) if is_distributed() else self.train_loader.dataset
+        scoring_loader = torch.utils.data.DataLoader(scoring_set, batch_size=self.score_batch_size or self.train_loader.batch_size, shuffle=False)
         for epoch in range(self.epochs):
+            if isinstance(criterion, FocalLoss):
+                # deferred re-weighting: class-balanced weights from epoch 160 on
+                criterion.weight = drw_weights(cls_num_list, epoch, 160, self.device)
             samples_used = 0
             if epoch < start_revision : 
                 self.model.train()
@@ -1882,42 +2128,52 @@ class TrainRevision:
                 if epoch % 2 == 0:
                     misclassified_indices = []
 
-                    for batch_idx, (inputs, labels) in tqdm(enumerate(self.train_loader), total=len(self.train_loader)):
+                    for batch_idx, (inputs, labels, *_) in tqdm(enumerate(scoring_loader), total=len(scoring_loader)):
                         inputs, labels = inputs.to(self.device), labels.to(self.device)
 
                         with torch.no_grad():
                             outputs = self.model(inputs)
+                            flops.add("score", inputs)
                             preds = torch.argmax(outputs, dim=1)
 
                             if self.threshold == 0:
                                 mask = preds != labels
                             else:
-                                prob = torch.softmax(outputs, dim=1)
-                                correct_class = prob[torch.arange(labels.size(0)), labels]
+                                correct_class = correct_class_prob(outputs, labels)
                                 mask = correct_class < self.threshold
 
                         if mask.any():
-                            base_idx = batch_idx * self.train_loader.batch_size
+                            base_idx = batch_idx * scoring_loader.batch_size
                             selected = mask.nonzero(as_tuple=True)[0] + base_idx
-                            misclassified_indices.extend(selected.tolist())
+                            misclassified_indices.extend(score_ids[i] for i in selected.tolist())
 
-                    cached_misclassified_indices = misclassified_indices
+                    cached_misclassified_indices = all_gather_indices(misclassified_indices)
+                    if compactor is not None and cached_misclassified_indices:
+                        compactor.submit(cached_misclassified_indices)
 
                 # Use cached indices for training
                 if not cached_misclassified_indices:
                     print("No misclassified samples. Skipping...")
                     continue
 
-                subset = torch.utils.data.Subset(self.train_loader.dataset, cached_misclassified_indices)
+                if compactor is not None:
+                    # compacted segments are read (nearly) sequentially in a block order reshuffled every epoch
+                    subset = compactor.dataset_for(cached_misclassified_indices, epoch)
+                else:
+                    subset = torch.utils.data.Subset(self.train_loader.dataset, cached_misclassified_indices)
+                shuffle = not isinstance(subset, CompactedDataset)
                 misclassified_loader = torch.utils.data.DataLoader(
-                    subset, batch_size=self.train_loader.batch_size, shuffle=True, num_workers=2
+                    subset, batch_size=self.train_loader.batch_size, shuffle=shuffle, num_workers=2
                 )
+                # ranks get equally many batches of the shared hard set
+                misclassified_loader = distribute_loader(misclassified_loader, shuffle=shuffle)
 
-                for batch_idx, (inputs, labels) in tqdm(enumerate(misclassified_loader), total=len(misclassified_loader)):
+                for batch_idx, (inputs, labels, *_) in tqdm(enumerate(misclassified_loader), total=len(misclassified_loader)):
                     inputs, labels = inputs.to(self.device), labels.to(self.device)
 
                     optimizer.zero_grad()
                     outputs = self.model(inputs)
+                    flops.add("train", inputs)
                     loss = criterion(outputs, labels)
                     num_step += len(outputs)
                     samples_used += len(outputs)
@@ -1948,6 +2204,7 @@ class TrainRevision:
                         inputs = batch[0].to(self.device)
                         labels = batch[1].to(self.device)
                         outputs = self.model(inputs)
+                        flops.add("eval", inputs)
 
                         batch_loss = criterion(outputs, labels)
                         test_loss+=batch_loss.item()
@@ -1973,12 +2230,13 @@ class TrainRevision:
                 progress_bar = tqdm(enumerate(self.train_loader), total=len(self.train_loader), desc="Training")
 
 
-                for batch_idx, (inputs, labels) in progress_bar:
+                for batch_idx, (inputs, labels, *_) in progress_bar:
                     inputs, labels = inputs.to(self.device), labels.to(self.device)
 
                     optimizer.zero_grad()
 
                     outputs = self.model(inputs)
+                    flops.add("train", inputs)
                     loss = criterion(outputs, labels)
                     num_step+=len(outputs)
                     samples_used+=len(outputs)
@@ -1988,6 +2246,7 @@ class TrainRevision:
                     running_loss += loss.item()
                     
                     outputs = self.model(inputs)
+                    flops.add("extra", inputs)
                     preds = torch.argmax(outputs, dim=1)
                     correct += (preds == labels).sum().item()
                     total += labels.size(0)
@@ -2011,6 +2270,7 @@ class TrainRevision:
                         inputs = batch[0].to(self.device)
                         labels = batch[1].to(self.device)
                         outputs = self.model(inputs)
+                        flops.add("eval", inputs)
 
                         batch_loss = criterion(outputs, labels)
                         test_loss+=batch_loss.item()
@@ -2026,11 +2286,15 @@ class TrainRevision:
                 epoch_test_accuracies.append(accuracy)
                 epoch_test_losses.append(val_loss)
             
-            samples_used_per_epoch.append(samples_used)
+            flops.end_epoch(epoch, test_accuracy=accuracy)
+            samples_used_per_epoch.append(reduce_sum(samples_used))
 
 
+        if compactor is not None:
+            compactor.close()
         end_time = time.time()
         log_memory(start_time, end_time)
+        self._log_flops(flops)
         print(num_step)
 
         total_wall_time = end_time - start_time
@@ -2038,20 +2302,19 @@ class TrainRevision:
             f"({total_wall_time / 60:.2f} minutes)")
 
 
-        plot_accuracy_time_multi(
-        model_name=self.model_name,  
-        accuracy=epoch_accuracies,
-        time_per_epoch=time_per_epoch,  
-        save_path=save_path,
-        data_file=save_path
+        record_accuracy_time(
+            model_name=self.model_name,
+            split="train",
+            accuracy=epoch_accuracies,
+            time_per_epoch=time_per_epoch,
+            data_file=save_path
         )
-        plot_accuracy_time_multi_test(
-            model_name = self.model_name,
+        record_accuracy_time(
+            model_name=self.model_name,
+            split="test",
             accuracy=epoch_test_accuracies,
             time_per_epoch=time_per_epoch,
             samples_per_epoch=samples_used_per_epoch,
-            threshold=self.threshold,
-            save_path=save_path,
             data_file=save_path
         )
 
@@ -2075,6 +2338,7 @@ class TrainRevision:
 
         start_time = time.time()
         num_step = 0
+        flops = FlopAccountant(self.model, len(self.train_loader.dataset))
 
         for epoch in range(self.epochs):
             samples_used = 0
@@ -2094,28 +2358,27 @@ class TrainRevision:
 
                     with torch.no_grad():
                         outputs = self.model(inputs)
+                        flops.add("score", inputs)
                         preds = torch.argmax(outputs, dim=1)
 
                         if self.threshold == 0:
                             mask = preds != labels
                         else:
-                            prob = torch.softmax(outputs, dim=1)
-                            correct_class = prob[torch.arange(labels.size(0)), labels]
+                            correct_class = correct_class_prob(outputs, labels)
                             mask = correct_class < self.threshold
 
                         num_to_select = mask.sum().item()
 
-                    # Skip batch if no samples pass threshold
-                    if num_to_select == 0:
-                        continue
-
                     # 🔁 Random sampling based on how many passed threshold
                     indices = torch.randperm(inputs.size(0))[:num_to_select]
-                    inputs_sampled = inputs[indices]
-                    labels_sampled = labels[indices]
+                    inputs_sampled, labels_sampled = self._select(inputs, labels, indices)
+                    # Skip batch if no samples pass threshold
+                    if inputs_sampled is None:
+                        continue
 
                     optimizer.zero_grad()
                     outputs_sampled = self.model(inputs_sampled)
+                    flops.add("train", inputs_sampled)
                     loss = criterion(outputs_sampled, labels_sampled)
 
                     loss.backward()
@@ -2128,6 +2391,7 @@ class TrainRevision:
                     # Stats on original batch
                     with torch.no_grad():
                         outputs = self.model(inputs)
+                        flops.add("extra", inputs)
                         preds = torch.argmax(outputs, dim=1)
                         total_correct += (preds == labels).sum().item()
                         total_samples += labels.size(0)
@@ -2154,6 +2418,7 @@ class TrainRevision:
                         inputs = batch[0].to(self.device)
                         labels = batch[1].to(self.device)
                         outputs = self.model(inputs)
+                        flops.add("eval", inputs)
 
                         batch_loss = criterion(outputs, labels)
                         test_loss += batch_loss.item()
@@ -2182,6 +2447,7 @@ class TrainRevision:
 
                     optimizer.zero_grad()
                     outputs = self.model(inputs)
+                    flops.add("train", inputs)
                     loss = criterion(outputs, labels)
 
                     loss.backward()
@@ -2218,6 +2484,7 @@ class TrainRevision:
                         inputs = batch[0].to(self.device)
                         labels = batch[1].to(self.device)
                         outputs = self.model(inputs)
+                        flops.add("eval", inputs)
 
                         batch_loss = criterion(outputs, labels)
                         test_loss += batch_loss.item()
@@ -2233,27 +2500,28 @@ class TrainRevision:
                 epoch_test_accuracies.append(accuracy)
                 epoch_test_losses.append(val_loss)
 
-            samples_used_per_epoch.append(samples_used)
+            flops.end_epoch(epoch, test_accuracy=accuracy)
+            samples_used_per_epoch.append(reduce_sum(samples_used))
 
         end_time = time.time()
         log_memory(start_time, end_time)
+        self._log_flops(flops)
         print(num_step)
 
         # Visualization
-        plot_accuracy_time_multi(
-            model_name=self.model_name,  
+        record_accuracy_time(
+            model_name=self.model_name,
+            split="train",
             accuracy=epoch_accuracies,
-            time_per_epoch=time_per_epoch,  
-            save_path=save_path,
+            time_per_epoch=time_per_epoch,
             data_file=save_path
         )
-        plot_accuracy_time_multi_test(
+        record_accuracy_time(
             model_name=self.model_name,
+            split="test",
             accuracy=epoch_test_accuracies,
             time_per_epoch=time_per_epoch,
             samples_per_epoch=samples_used_per_epoch,
-            threshold=self.threshold,
-            save_path=save_path,
             data_file=save_path
         )
 
@@ -2274,6 +2542,7 @@ class TrainRevision:
         time_per_epoch = []
         samples_used_per_epoch = []
         num_step = 0
+        flops = FlopAccountant(self.model, len(self.train_loader.dataset))
         start_time = time.time()
 
         for epoch in range(self.epochs):
@@ -2305,6 +2574,7 @@ class TrainRevision:
 
                     optimizer.zero_grad()
                     outputs = self.model(inputs_selected)
+                    flops.add("train", inputs_selected)
                     loss = criterion(outputs, labels_selected)
                     num_step += selected_count
                     samples_used += selected_count
@@ -2313,6 +2583,7 @@ class TrainRevision:
 
                     running_loss += loss.item()
                     with torch.no_grad():
+                        flops.add("extra", inputs)
                         preds = torch.argmax(self.model(inputs), dim=1)
                         total_correct += (preds == labels).sum().item()
                         total_samples += labels.size(0)
@@ -2323,6 +2594,7 @@ class TrainRevision:
                     inputs, labels = inputs.to(self.device), labels.to(self.device)
                     optimizer.zero_grad()
                     outputs = self.model(inputs)
+                    flops.add("train", inputs)
                     loss = criterion(outputs, labels)
                     num_step += inputs.size(0)
                     samples_used += inputs.size(0)
@@ -2356,6 +2628,7 @@ class TrainRevision:
                     inputs = batch[0].to(self.device)
                     labels = batch[1].to(self.device)
                     outputs = self.model(inputs)
+                    flops.add("eval", inputs)
                     batch_loss = criterion(outputs, labels)
                     test_loss += batch_loss.item()
                     predictions = torch.argmax(outputs, dim=-1)
@@ -2368,27 +2641,28 @@ class TrainRevision:
             scheduler.step(val_loss)
             epoch_test_accuracies.append(accuracy)
             epoch_test_losses.append(val_loss)
-            samples_used_per_epoch.append(samples_used)
+            flops.end_epoch(epoch, test_accuracy=accuracy)
+            samples_used_per_epoch.append(reduce_sum(samples_used))
 
         end_time = time.time()
         log_memory(start_time, end_time)
+        self._log_flops(flops)
         print(num_step)
 
-        plot_accuracy_time_multi(
+        record_accuracy_time(
             model_name=self.model_name,
+            split="train",
             accuracy=epoch_accuracies,
             time_per_epoch=time_per_epoch,
-            save_path=save_path,
-            data_file=save_path,
+            data_file=save_path
         )
-        plot_accuracy_time_multi_test(
+        record_accuracy_time(
             model_name=self.model_name,
+            split="test",
             accuracy=epoch_test_accuracies,
             time_per_epoch=time_per_epoch,
             samples_per_epoch=samples_used_per_epoch,
-            threshold=self.threshold,
-            save_path=save_path,
-            data_file=save_path,
+            data_file=save_path
         )
 
         return self.model, num_step
\ No newline at end of file
@@ -0,0 +1,203 @@
+import argparse
+import io
+import json
+import os
+import tarfile
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from PIL import Image
+from torch.utils.data import IterableDataset, get_worker_info
+
+INDEX_FILE = "index.json"
+# Columns of the per-shard ``.idx.npy`` record tables.
+GLOBAL_IDX, LABEL, OFFSET, SIZE = range(4)
+
+
+def write_shards(samples: Sequence[Tuple[str, int]], out_dir: str, shard_size: int = 1000,
+                 prefix: str = "train") -> str:
+    """
+    Packs (path, label) samples into sequential tar shards.
+
+    Each shard ``<prefix>-NNNNN.tar`` holds the raw encoded image bytes in sample order and is
+    accompanied by ``<prefix>-NNNNN.idx.npy``, an int64 table of (global index, label, byte
+    offset, byte size) per record, so readers can seek straight to the surviving records.
+    Returns the path of the split manifest.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    shards = []
+    for shard_id, start in enumerate(range(0, len(samples), shard_size)):
+        chunk = samples[start:start + shard_size]
+        name = f"{prefix}-{shard_id:05d}"
+        tar_path = os.path.join(out_dir, name + ".tar")
+        with tarfile.open(tar_path, "w") as tar:
+            for offset, (path, _) in enumerate(chunk):
+                ext = os.path.splitext(path)[1] or ".jpg"
+                tar.add(path, arcname=f"{start + offset:09d}{ext}", recursive=False)
+
+        # Data offsets are only known once the headers are written, so re-read them.
+        records = np.zeros((len(chunk), 4), dtype=np.int64)
+        with tarfile.open(tar_path, "r") as tar:
+            for row, member in enumerate(tar.getmembers()):
+                records[row] = (start + row, chunk[row][1], member.offset_data, member.size)
+        np.save(os.path.join(out_dir, name + ".idx.npy"), records)
+        shards.append({"name": name, "count": len(chunk)})
+        print(f"Wrote {tar_path} ({len(chunk)} records)")
+
+    manifest_path = os.path.join(out_dir, f"{prefix}-{INDEX_FILE}")
+    with open(manifest_path, "w") as f:
+        json.dump({"num_records": len(samples), "shards": shards}, f, indent=2)
+    return manifest_path
+
+
+class ShardedImageDataset(IterableDataset):
+    """
+    Streams images from shards written by ``write_shards``.
+
+    Shards are split across DataLoader workers, so each worker reads whole files sequentially.
+    When ``survivor_skipping`` is enabled, ``set_survivors`` restricts the next epochs to the given
+    global indices: records without survivors are never read and shards without any survivors are
+    never opened. Items are (image, label) or (image, label, index) with ``return_index``.
+
+    Under DDP every rank reads its own shards. With ``even_ranks`` each of the ``num_workers``
+    loader workers (of the loader that will read this dataset) stops at the smallest record count
+    the same worker has on any rank, so all ranks take the same number of steps per epoch.
+    """
+
+    def __init__(self, shard_dir: str, prefix: str = "train", transform=None, shuffle: bool = True,
+                 survivor_skipping: bool = False, return_index: bool = False, seed: int = 0,
+                 num_workers: int = 0, even_ranks: bool = False):
+        with open(os.path.join(shard_dir, f"{prefix}-{INDEX_FILE}"), "r") as f:
+            manifest = json.load(f)
+        self.shard_dir = shard_dir
+        self.transform = transform
+        self.shuffle = shuffle
+        self.survivor_skipping = survivor_skipping
+        self.return_index = return_index
+        self.seed = seed
+        self.num_records = manifest["num_records"]
+        self.shard_paths = [os.path.join(shard_dir, s["name"] + ".tar") for s in manifest["shards"]]
+        self.records = [np.load(os.path.join(shard_dir, s["name"] + ".idx.npy")) for s in manifest["shards"]]
+        self.num_workers = num_workers
+        self.even_ranks = even_ranks
+        self._survivors: Optional[np.ndarray] = None
+        self._quota: Optional[List[int]] = None
+        self._epoch = 0
+        self._balance()
+
+    def set_survivors(self, indices: Optional[Sequence[int]]):
+        """
+        Restricts iteration to ``indices`` (global sample ids); ``None`` restores the full set.
+        Under DDP with ``even_ranks`` every rank must call it at the same point.
+        """
+        if not self.survivor_skipping or indices is None:
+            self._survivors = None
+        else:
+            survivors = np.zeros(self.num_records, dtype=bool)
+            survivors[np.asarray(indices, dtype=np.int64)] = True
+            self._survivors = survivors
+        self._balance()
+
+    def _balance(self):
+        # per-worker record quotas, the minimum over ranks (a collective, run in the main process)
+        if not (self.even_ranks and dist.is_available() and dist.is_initialized()):
+            self._quota = None
+            return
+        workers = max(1, self.num_workers)
+        counts = torch.tensor([sum(len(self._surviving_records(s)) for s in self._worker_shards(w, workers))
+                               for w in range(workers)], dtype=torch.int64)
+        if dist.get_backend() == "nccl":
+            counts = counts.cuda()
+        dist.all_reduce(counts, op=dist.ReduceOp.MIN)
+        self._quota = counts.cpu().tolist()
+
+    def _surviving_records(self, shard_id: int) -> np.ndarray:
+        records = self.records[shard_id]
+        if self._survivors is None:
+            return records
+        return records[self._survivors[records[:, GLOBAL_IDX]]]
+
+    def __len__(self):
+        """Records this rank reads per epoch (all of them without DDP)."""
+        if self._quota is not None:
+            return sum(self._quota)
+        return sum(len(self._surviving_records(s)) for s in self._worker_shards(0, 1))
+
+    def _epoch_seed(self) -> int:
+        info = get_worker_info()
+        if info is None:
+            self._epoch += 1
+            return self.seed + self._epoch
+        # Workers receive a fresh copy every epoch; their shared base seed changes per epoch.
+        return (info.seed - info.id) % (2 ** 32)
+
+    def _worker_shards(self, worker: int, num_workers: int) -> np.ndarray:
+        shard_ids = np.arange(len(self.shard_paths))
+        if dist.is_available() and dist.is_initialized():
+            # Fixed shards per rank: each rank's survivor log then only covers its own shards
+            shard_ids = shard_ids[dist.get_rank()::dist.get_world_size()]
+        # fixed shards per worker too, so that the quotas can be computed outside the workers
+        return shard_ids[worker::num_workers]
+
+    def _shards_for_worker(self, rng: np.random.RandomState) -> List[int]:
+        info = get_worker_info()
+        shard_ids = self._worker_shards(info.id, info.num_workers) if info is not None else self._worker_shards(0, 1)
+        if self.shuffle:
+            rng.shuffle(shard_ids)
+        return shard_ids.tolist()
+
+    def __iter__(self):
+        rng = np.random.RandomState(self._epoch_seed())
+        info = get_worker_info()
+        quota = None
+        if self._quota is not None:
+            workers = info.num_workers if info is not None else 1
+            if len(self._quota) != workers:
+                raise RuntimeError(f"ShardedImageDataset was balanced for {len(self._quota)} loader workers, "
+                                   f"but is read by {workers}")
+            quota = self._quota[info.id if info is not None else 0]
+        yielded = 0
+        for shard_id in self._shards_for_worker(rng):
+            if quota is not None and yielded >= quota:
+                return
+            records = self._surviving_records(shard_id)
+            if len(records) == 0:
+                continue
+            records = records[np.argsort(records[:, OFFSET])]
+            payloads = []
+            with open(self.shard_paths[shard_id], "rb") as f:
+                for record in records:
+                    f.seek(record[OFFSET])
+                    payloads.append(f.read(record[SIZE]))
+            order = rng.permutation(len(records)) if self.shuffle else range(len(records))
+            for i in order:
+                if quota is not None and yielded >= quota:
+                    return
+                yielded += 1
+                img = Image.open(io.BytesIO(payloads[i])).convert("RGB")
+                if self.transform is not None:
+                    img = self.transform(img)
+                label = int(records[i, LABEL])
+                if self.return_index:
+                    yield img, label, int(records[i, GLOBAL_IDX])
+                else:
+                    yield img, label
+
+
+def convert_imagenet(root: str, out_dir: str, shard_size: int = 1000):
+    import torchvision
+
+    for split in ("train", "val"):
+        dataset = torchvision.datasets.ImageNet(root=root, split=split)
+        write_shards(dataset.samples, out_dir, shard_size=shard_size, prefix=split)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert ImageNet into sequential tar shards")
+    parser.add_argument("--root", type=str, required=True, help="ImageNet root used by torchvision.datasets.ImageNet")
+    parser.add_argument("--out", type=str, required=True, help="Output directory for shards")
+    parser.add_argument("--shard-size", dest="shard_size", type=int, default=1000, help="Records per shard")
+    args = parser.parse_args()
+    convert_imagenet(args.root, args.out, args.shard_size)
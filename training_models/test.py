@@ -5,7 +5,7 @@ def test_model(model, test_loader, device):
     correct = 0
     total = 0
     with torch.no_grad():
-        for inputs, labels in test_loader:
+        for inputs, labels, *_ in test_loader:
             inputs, labels = inputs.to(device), labels.to(device)
             outputs = model(inputs)
             preds = torch.argmax(outputs, dim=1)
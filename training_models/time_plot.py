@@ -1,4 +1,4 @@
-from utils import plot_training_time
+from report import plot_training_time
 
 time_dict = {"baseline":1450.57, "selective_gradient": 1434.17}
 